@@ -1,26 +1,51 @@
-from flask import Flask, render_template, jsonify, request
-import requests
-from requests.auth import HTTPDigestAuth
-import xml.etree.ElementTree as ET
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 from datetime import datetime
 import threading
 import time
-import subprocess
 import os
-import json
+from urllib.parse import urlsplit
+
+from gv_tally_control import DEFAULT_IP, DEFAULT_PORT, default_sessions
+from mapping_file import MappingFile
+from metrics import REGISTRY, CONTENT_TYPE
+from relay_state import Snapshot, StateStore, etag_matches
+from state_broadcaster import StateBroadcaster
+from tally_dispatch import SendDispatcher
+from tally_index import TallyIndex, TallyMerge
+from tally_ingest import TallyIngest
+from tally_journal import TallyJournal, WarmStart
+from tally_outputs import TallyOutputs, GatewaySink
+from tally_reconciler import Reconciler
+from topology import Topology, SwitcherConfig, GatewayConfig, load_topology
+from tsl_umd import TslReceiver
+from vectar_client import VectarClient, LabelCache, iter_tally_columns, iter_physical_inputs
 
 app = Flask(__name__)
 
 # Configuration
 VECTAR_IP = "INSERT-YOUR-VECTAR-IP-HERE"
-SWITCHER_URL = f"http://{VECTAR_IP}/v1/dictionary?key=switcher"
-TALLY_URL = f"http://{VECTAR_IP}/v1/dictionary?key=tally"
-UPDATE_INTERVAL = 1 
+UPDATE_INTERVAL = 1 # Seconds between polls, can go down to 0.05
+MAX_BACKOFF = 10 # Longest wait between polls while the Vectar is unreachable
+LABEL_TTL = 30 # Seconds between source label refreshes
+RECONCILE_INTERVAL = 30 # Seconds between background re-sends of every lamp, 0 to only resync after reconnects
+RECONCILE_RATE = 10 # Most XCUs re-sent per second in the background
+UMD_REFRESH_INTERVAL = 5 # Seconds between full re-sends to the TSL displays, 0 for changes only
+
+# Vectar push notifications, set VECTAR_NOTIFY_HOST to None to always poll
+VECTAR_NOTIFY_HOST = urlsplit(f"http://{VECTAR_IP}").hostname
+VECTAR_NOTIFY_PORT = 5951
 
 # Path to the camera-to-XCU mapping file
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_FILE = os.path.join(SCRIPT_DIR, "camera_mapping.json")
 
+# Log of the lamp states the relay asked for and the gateways accepted, replayed on restart
+JOURNAL_FILE = os.path.join(SCRIPT_DIR, "tally_journal.bin")
+WARM_START_TIMEOUT = 30 # Seconds to wait for every switcher before correcting the lamps left lit anyway
+
+# Optional multi-switcher / multi-gateway topology, see topology.example.json
+TOPOLOGY_FILE = os.path.join(SCRIPT_DIR, "topology.json")
+
 # Default Camera to XCU mapping
 DEFAULT_CAMERA_TO_XCU = {
     'input1': 'XCU-01',
@@ -33,58 +58,90 @@ DEFAULT_CAMERA_TO_XCU = {
     'input8': 'XCU-08',
 }
 
+# Saves the mapping off the request thread, and applies edits made to the file by hand
+mapping_file = MappingFile(CONFIG_FILE, lambda mapping: reload_camera_mapping(mapping))
+
 # Load camera mapping from the json
 def load_camera_mapping():
-    global CAMERA_TO_XCU
     try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                CAMERA_TO_XCU = json.load(f)
-            print(f"Loaded camera mapping from {CONFIG_FILE}: {CAMERA_TO_XCU}")
+        mapping = mapping_file.load()
+        if mapping is not None:
+            print(f"Loaded camera mapping from {CONFIG_FILE}: {mapping}")
         else:
-            CAMERA_TO_XCU = DEFAULT_CAMERA_TO_XCU
+            mapping = DEFAULT_CAMERA_TO_XCU
             # Save default mapping to the json file
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(CAMERA_TO_XCU, f, indent=4)
+            mapping_file.write(mapping)
             print(f"Created default camera mapping file: {CONFIG_FILE}")
     except Exception as e:
         print(f"Error loading camera mapping: {e}")
-        CAMERA_TO_XCU = DEFAULT_CAMERA_TO_XCU
-
-# load mapping
-CAMERA_TO_XCU = {}
+        mapping = DEFAULT_CAMERA_TO_XCU
+    state_store.update(mapping=mapping)
 
 # Authentication credentials
 VECTAR_USER = 'admin'
 VECTAR_PASS = 'password'
 
-# Cauth with Digest Authentication
-auth = HTTPDigestAuth(VECTAR_USER, VECTAR_PASS)
-
 # Headers
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
     'Accept': 'application/xml'
 }
 
-# Global variables to store the current state
-current_state = {
-    'program': [],  # List of program sources
-    'preview': None,  # Single preview source
-    'last_update': None,
-    'status': 'Not Connected'
-}
+# Switchers and gateways: the Vectar and gateway above, unless topology.json describes more
+topology = load_topology(TOPOLOGY_FILE, Topology(
+    [SwitcherConfig('vectar', VECTAR_IP, VECTAR_USER, VECTAR_PASS,
+                    notify_port=VECTAR_NOTIFY_PORT if VECTAR_NOTIFY_HOST else None,
+                    notify_host=VECTAR_NOTIFY_HOST)],
+    [GatewayConfig('gateway', DEFAULT_IP, DEFAULT_PORT, default_sessions(DEFAULT_IP, DEFAULT_PORT))]
+))
 
-# Track tally states (Global Variables)
-tally_states = {}
+# Program/preview, status and camera mapping, swapped in as a whole on every change so
+# the web handlers can read state_store.snapshot without locking
+state_store = StateStore(Snapshot())
 
-# Path to gv_tally_control.py
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-GV_TALLY_SCRIPT = os.path.join(SCRIPT_DIR, "gv_tally_control.py")
+# Pushes the state to every browser on /events when it changes, and the time of the last
+# switcher read with a heartbeat after 5 seconds without a change
+broadcaster = StateBroadcaster(heartbeat=5)
+
+def publish_state(**changes):
+    """Publish a new snapshot, and send it to the web clients if anything they show has changed"""
+    view = state_store.update(**changes).to_dict()
+    broadcaster.touch(view['last_update'])
+    broadcaster.publish(view, key=(view['program'], view['preview'], view['status']))
+
+# Combines the lamp states every switcher asks for, and serialises their updates
+tally_merge = TallyMerge([switcher.name for switcher in topology.switchers], topology.merge, topology.lamps)
+apply_lock = threading.Lock()
+
+# Latency of each stage between a cut on the Vectar and the commands being queued
+FETCH_SECONDS = REGISTRY.histogram('tally_fetch_seconds', 'Time to fetch the Vectar tally dictionary')
+PARSE_SECONDS = REGISTRY.histogram('tally_parse_seconds', 'Time to parse the Vectar tally dictionary')
+DIFF_SECONDS = REGISTRY.histogram('tally_diff_seconds', 'Time to diff program/preview into tally commands')
+FETCH_TO_ENQUEUE_SECONDS = REGISTRY.histogram(
+    'tally_fetch_to_enqueue_seconds', 'Time from the start of a Vectar fetch to its tally commands being queued')
+
+# Sends tally commands off the poll loop, one lane and connection per gateway
+dispatcher = SendDispatcher(topology.client_for, topology.lane_for)
+REGISTRY.gauge('tally_send_queue_depth', 'Tally commands waiting to be sent', dispatcher.queue_depth)
+
+# Every lamp change decided on and accepted is journaled; after a restart the warm start
+# only lets through the commands for lamps that are not already right. The dispatcher
+# only acks the commands the gateway confirmed, never those skipped for unknown sessions
+journal = TallyJournal(JOURNAL_FILE)
+dispatcher.add_ack_callback(journal.record_acked)
+warm_start = WarmStart({}, {})
+
+def load_tally_journal():
+    """Replay the journal, so the first updates after a restart only send corrections"""
+    global warm_start
+    warm_start = WarmStart(*journal.load(), timeout=WARM_START_TIMEOUT)
+    if not warm_start.done:
+        lit = sum(1 for lamps in warm_start.shown.values() if lamps)
+        print(f"Warm start: {lit} XCUs had lamps lit when the relay stopped")
 
 def send_tally_command(xcu, tally_type, state):
     """
-    Send tally command to a specific XCU using gv_tally_control.py
+    Queue a tally command for a specific XCU
     
     Args:
         xcu: XCU identifier (e.g., XCU-09)
@@ -95,206 +152,498 @@ def send_tally_command(xcu, tally_type, state):
         print(f"No XCU specified for tally command")
         return
     
-    # Convert boolean to on/off string
-    state_str = "on" if state else "off"
+    send_tally_commands([(xcu, tally_type, state)])
+
+def send_tally_commands(commands, origin=None):
+    """
+    Queue a whole set of tally changes for delivery, one write per gateway
     
-    cmd = [
-        "python", 
-        GV_TALLY_SCRIPT,
-        f"--xcu", xcu,
-        f"--{tally_type}", state_str
-    ]
+    Args:
+        commands: List of (xcu, tally_type, state) tuples
+        origin: time.monotonic() of the Vectar fetch that caused them
+    """
+    if not commands:
+        return
     
-    # Log command
-    print(f"Sending {tally_type} tally {state_str} command to {xcu}")
+    summary = ', '.join(f"{xcu} {tally_type} {'on' if state else 'off'}" for xcu, tally_type, state in commands)
+    print(f"Sending {len(commands)} tally changes: {summary}")
+    dispatcher.submit(commands, origin=origin)
+
+# Every tally change goes out once to the gateways and any TSL displays in the topology
+outputs = TallyOutputs([GatewaySink(send_tally_commands)] + [output.sender() for output in topology.tsl_outputs],
+                       topology.umd_map, UMD_REFRESH_INTERVAL)
+
+def parse_source_labels(xml):
+    """Get the friendly names for all inputs from a switcher dictionary"""
+    labels = {}
     
-    try:
-        # Execute command
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"Successfully sent {tally_type} tally {state_str} to {xcu}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error sending tally command: {e.stderr}")
-        return False
-
-def get_source_labels(session):
-    """Get the friendly names for all inputs from switcher endpoint"""
-    try:
-        response = session.get(SWITCHER_URL, auth=auth, headers=HEADERS, timeout=5)
-        if response.status_code == 200:
-            root = ET.fromstring(response.text)
-            labels = {}
-            
-            # Process inputs
-            for input_elem in root.findall('.//physical_input'):
-                input_num = input_elem.get('physical_input_number').lower()  # word styles etc.
-                label = input_elem.get('iso_label')
-                labels[input_num] = label
-                
-            return labels
-        else:
-            print(f"Error getting labels: HTTP {response.status_code}")
-            return {}
-    except Exception as e:
-        print(f"Error getting labels: {e}")
-        return {}
+    # Process inputs, the parser stops as soon as it is past them
+    for input_num, label in iter_physical_inputs(xml):
+        labels[input_num.lower()] = label  # word styles etc.
+        
+    return labels
 
-def get_tally_state(session, labels):
-    """Get the current tally state from tally endpoint"""
-    try:
-        response = session.get(TALLY_URL, auth=auth, headers=HEADERS, timeout=5)
-        if response.status_code == 200:
-            root = ET.fromstring(response.text)
-            
-            # Find all sources that are on program or preview
-            program_sources = []
-            preview_source = None
-            
-            for column in root.findall('.//column'):
-                name = column.get('name')
-                on_pgm = column.get('on_pgm') == 'true'
-                on_prev = column.get('on_prev') == 'true'
-                
-                # Get friendly name if someone has been kind enough to put them anywhere
-                friendly_name = labels.get(name, name)
-                
-                if on_pgm:
-                    program_sources.append({
-                        'source': name,
-                        'label': friendly_name
-                    })
-                if on_prev:
-                    preview_source = {
-                        'source': name,
-                        'label': friendly_name
-                    }
-            
-            return program_sources, preview_source
-        else:
-            print(f"Error getting tally: HTTP {response.status_code}")
-            return [], None
-    except Exception as e:
-        print(f"Error getting tally: {e}")
-        return [], None
-
-def initialize_tally_states():
-    """Initialize the tally states dictionary based on current camera mapping"""
-    global tally_states
-    tally_states = {}
-    for camera in CAMERA_TO_XCU:
-        tally_states[camera] = {
-            'red': False,
-            'green': False
-        }
+def get_tally_state(client, labels, url):
+    """
+    Get the current tally state from tally endpoint
+    
+    Returns None if the tally document has not changed since the last call.
+    Raises an exception if the Vectar could not be read, so the poller can back off
+    """
+    fetch_started = time.monotonic()
+    response = client.get_if_changed(url)
+    received = time.monotonic()
+    FETCH_SECONDS.observe(received - fetch_started)
+    if response is None:
+        return None
+    
+    # Find all sources that are on program or preview
+    program_sources = []
+    preview_source = None
+    
+    for name, on_pgm, on_prev in iter_tally_columns(response.content):
+        # Get friendly name if someone has been kind enough to put them anywhere
+        friendly_name = labels.get(name, name)
+        
+        if on_pgm:
+            program_sources.append({
+                'source': name,
+                'label': friendly_name
+            })
+        if on_prev:
+            preview_source = {
+                'source': name,
+                'label': friendly_name
+            }
+    
+    PARSE_SECONDS.observe(time.monotonic() - received)
+    return program_sources, preview_source
 
-def update_tally_state():
-    """Fetch and parse the XML data from Vectar"""
-    global tally_states
+def initialize_tally_states(mapping=None):
+    """
+    Initialize the tally state indexes based on current camera mapping
     
-    # initialize tally states dictionary
-    initialize_tally_states()
+    Args:
+        mapping: New camera mapping to publish first, swapped in together with the
+            indexes so no switcher update sees one without the other
+    """
+    global tally_merge
+    with apply_lock:
+        if mapping is not None:
+            state_store.update(mapping=mapping)
+        for feed in feeds:
+            feed.index = TallyIndex(feed.mapping, topology.lamps)
+        tally_merge = TallyMerge([feed.name for feed in feeds], topology.merge, topology.lamps)
     
-    while True:
-        try:
-            # all the coockies
-            session = requests.Session()
-            
-            # get labels then telly state
-            labels = get_source_labels(session)
-            program_sources, preview_source = get_tally_state(session, labels)
-            
+    # Once the new mapping has been applied, put right any lamp it left behind (after a
+    # restart the warm start does that instead, without re-sending every lamp)
+    if warm_start.done:
+        reconciler.request(delay=max(UPDATE_INTERVAL, 1))
+
+def remap_tally_states(mapping):
+    """
+    Switch to a new camera mapping without forgetting which lamps are lit
+    
+    Only the lamps the new mapping changes get commands: the XCUs it no longer
+    maps are switched off, and unchanged entries keep their state.
+    """
+    with apply_lock:
+        state_store.update(mapping=mapping)
+        commands = []
+        for feed in feeds:
+            commands += tally_merge.apply(feed.name, feed.index.remap(feed.mapping))
+        commands = journal_commands(commands)
+        program, preview = merge_sources()
+        # Queued under the lock, like a switcher update, so they go out in the order worked out
+        outputs.emit(commands, program, preview)
+
+def lamp_masks():
+    """Lamp bits every mapped XCU should show (call with apply_lock held)"""
+    if len(feeds) == 1:
+        return feeds[0].index.masks()
+    return {xcu: tally_merge.lit.get(xcu, 0) for feed in feeds for xcu in feed.index.slots}
+
+def journal_commands(commands):
+    """
+    Journal a cycle's lamp changes and return the ones to send (call with apply_lock held)
+    
+    During a warm start the changes for lamps already showing the right state
+    are dropped, and once every switcher has been read the lamps the last run
+    left wrong are corrected. A switcher that is still down after
+    WARM_START_TIMEOUT is not waited for: its cameras count as off air.
+    """
+    journal.record_desired(commands)
+    if warm_start.done:
+        return commands
+    commands = warm_start.filter(commands)
+    connected = all(feed.status == 'Connected' for feed in feeds)
+    if connected or warm_start.expired():
+        corrections = warm_start.finish(lamp_masks())
+        journal.record_desired(corrections)
+        waited = "" if connected else f" after {WARM_START_TIMEOUT} s without every switcher"
+        print(f"Warm start finished{waited}: {warm_start.skipped} lamp changes already shown, "
+              f"{len(corrections)} corrections")
+        commands += corrections
+    return commands
+
+def desired_tally_states():
+    """
+    What every mapped XCU's lamps should show, for the reconciler
+    
+    Returns None until a switcher has been read, so a relay that cannot reach
+    any Vectar leaves the lamps alone
+    """
+    with apply_lock:
+        if not any(feed.status == 'Connected' for feed in feeds):
+            return None
+        if len(feeds) == 1:
+            return feeds[0].index.states()
+        return tally_merge.states({xcu for feed in feeds for xcu in feed.index.slots})
+
+def overall_status():
+    """Work out the overall status from every switcher's status"""
+    if len(feeds) == 1:
+        return feeds[0].status
+    problems = [f"{feed.name}: {feed.status}" for feed in feeds if feed.status != 'Connected']
+    return '; '.join(problems) if problems else 'Connected'
+
+def merge_sources():
+    """Program sources of every switcher, and the preview of the highest priority one that has one"""
+    program_sources = []
+    preview_source = None
+    for feed in feeds:
+        for source in feed.program_sources:
+            program_sources.append(dict(source, switcher=feed.name) if len(feeds) > 1 else source)
+        if preview_source is None and feed.preview_source:
+            preview_source = dict(feed.preview_source, switcher=feed.name) if len(feeds) > 1 else feed.preview_source
+    return program_sources, preview_source
+
+def mark_connected(feed=None):
+    """Record a successful fetch that found nothing new"""
+    feed = feed or feeds[0]
+    with apply_lock:
+        feed.status = 'Connected'
+        publish_state(last_update=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), status=overall_status())
+
+def apply_tally_state(program_sources, preview_source, feed=None):
+    """Update the shared state and tally lights from a switcher's fetched program/preview state"""
+    feed = feed or feeds[0]
+    diff_started = time.monotonic()
+    try:
+        # Switchers are followed on their own threads, so take their updates one at a time
+        with apply_lock:
             # update global state
-            current_state['program'] = program_sources
-            current_state['preview'] = preview_source
-            current_state['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            current_state['status'] = 'Connected'
+            feed.program_sources = program_sources
+            feed.preview_source = preview_source
+            feed.status = 'Connected'
             
             # Ddbug output
-            print("\nCurrent State:")
+            print(f"\nCurrent State{f' ({feed.name})' if len(feeds) > 1 else ''}:")
             print(f"Program Sources: {[p['label'] for p in program_sources]}")
             print(f"Preview Source: {preview_source['label'] if preview_source else 'None'}")
+            program, preview = merge_sources()
+            publish_state(program=program, preview=preview, status=overall_status(),
+                          last_update=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
             
             # Update tally lights based on program and preview sources
             # Extract source names from program_sources
             program_source_names = [p['source'] for p in program_sources]
             preview_source_name = preview_source['source'] if preview_source else None
             
-            # Process each camera
-            for camera, xcu in CAMERA_TO_XCU.items():
-                should_be_red = camera in program_source_names
-                should_be_green = camera == preview_source_name
-                
-                # Check if rtally is red, does it need change
-                if tally_states[camera]['red'] != should_be_red:
-                    send_tally_command(xcu, 'red', should_be_red)
-                    tally_states[camera]['red'] = should_be_red
-                
-                # here is green data also becuase a function exists... don't know if I want it...
-                if tally_states[camera]['green'] != should_be_green:
-                    send_tally_command(xcu, 'green', should_be_green)
-                    tally_states[camera]['green'] = should_be_green
-                
-        except Exception as e:
-            print(f"Error updating state: {e}")
-            current_state['status'] = f'Error: {str(e)}'
+            # Collect every lamp change for this cycle so they go out together, merged
+            # with what the other switchers want
+            commands = tally_merge.apply(feed.name, feed.index.update(program_source_names, preview_source_name))
+            commands = journal_commands(commands)
+            DIFF_SECONDS.observe(time.monotonic() - diff_started)
+            
+            # Queue the whole diff before the lock is released: the dispatcher keeps only the
+            # latest state per lamp, so diffs queued out of order would leave a stale one lit.
+            # Queueing never blocks, the dispatcher commits it off the poll loop
+            outputs.emit(commands, program, preview, feed.cycle_started)
+        
+        if commands and feed.cycle_started is not None:
+            FETCH_TO_ENQUEUE_SECONDS.observe(time.monotonic() - feed.cycle_started)
+            
+    except Exception as e:
+        print(f"Error updating state: {e}")
+        feed.status = f'Error: {str(e)}'
+        publish_state(status=overall_status())
+
+def report_fetch_error(error, feed=None):
+    """Show a failed Vectar fetch in the shared state"""
+    feed = feed or feeds[0]
+    print(f"Error getting tally{f' from {feed.name}' if len(feeds) > 1 else ''}: {error}")
+    with apply_lock:
+        feed.status = f'Error: {str(error)}'
+        publish_state(status=overall_status())
+
+class SwitcherFeed:
+    """
+    Everything the relay keeps for one switcher: its persistent Vectar
+    connection, label cache, push/poll ingest loop and lamp index.
+    """
+    
+    def __init__(self, config):
+        """
+        Initialize the SwitcherFeed
+        
+        Args:
+            config: SwitcherConfig from the topology
+        """
+        self.config = config
+        self.name = config.name
+        self.tally_url = config.tally_url
+        
+        # Persistent Vectar connection with Digest Authentication, reused across polls
+        self.vectar = VectarClient(config.user, config.password, headers=HEADERS)
+        
+        # Source labels, refreshed in the background off the tally path
+        self.label_cache = LabelCache(self.vectar, config.switcher_url, parse_source_labels, ttl=LABEL_TTL)
+        
+        # Track tally states, indexed by source so each cut only touches what changed
+        self.index = TallyIndex({})
+        self.program_sources = []
+        self.preview_source = None
+        self.status = 'Not Connected'
+        
+        # Label cache version the last tally state was built with
+        self.labels_seen = None
+        
+        # When the fetch behind the current update started, for cut-to-lamp timing
+        self.cycle_started = None
         
-        # patience.....
-        time.sleep(UPDATE_INTERVAL)
+        # Switcher ingestion (push with adaptive polling fallback)
+        self.ingest = TallyIngest(
+            self.fetch,
+            lambda program_sources, preview_source: apply_tally_state(program_sources, preview_source, self),
+            notify_host=config.notify_host,
+            notify_port=config.notify_port or VECTAR_NOTIFY_PORT,
+            poll_interval=UPDATE_INTERVAL,
+            safety_interval=UPDATE_INTERVAL,
+            max_backoff=MAX_BACKOFF,
+            on_error=lambda error: report_fetch_error(error, self),
+            on_unchanged=lambda: mark_connected(self)
+        )
+    
+    @property
+    def mapping(self):
+        """This switcher's own camera mapping if the topology gives one, else the shared mapping"""
+        return self.config.mapping if self.config.mapping is not None else state_store.snapshot.mapping
+    
+    def fetch(self):
+        """
+        Fetch the current labels and tally state from the Vectar
+        
+        Returns None if nothing changed since the last fetch
+        """
+        self.cycle_started = time.monotonic()
+        
+        # cached labels then telly state, re-reading the tally if the labels changed
+        labels = self.label_cache.get()
+        if self.label_cache.updates != self.labels_seen:
+            self.labels_seen = self.label_cache.updates
+            self.vectar.invalidate(self.tally_url)
+        return get_tally_state(self.vectar, labels, self.tally_url)
+    
+    def stats(self):
+        """Ingest, Vectar and label counters for this switcher"""
+        return {
+            'status': self.status,
+            'ingest': self.ingest.stats(),
+            'vectar': self.vectar.stats(),
+            'labels': self.label_cache.stats()
+        }
+
+class TslFeed:
+    """
+    A switcher or router that sends its tally as TSL UMD messages, followed
+    the same way as a Vectar: its program/preview goes through the lamp index
+    and is merged with the other switchers.
+    """
+    
+    def __init__(self, config):
+        """
+        Initialize the TslFeed
+        
+        Args:
+            config: TslInputConfig from the topology
+        """
+        self.config = config
+        self.name = config.name
+        
+        # No Vectar connection or labels, the labels come in the UMD text
+        self.vectar = None
+        self.label_cache = None
+        
+        self.index = TallyIndex({})
+        self.program_sources = []
+        self.preview_source = None
+        self.status = 'Not Connected'
+        self.cycle_started = None
+        
+        self.ingest = TslReceiver(config.port, self._update, config.host, config.version, config.transport,
+                                  config.sources, on_unchanged=lambda: mark_connected(self))
+    
+    mapping = SwitcherFeed.mapping
+    
+    def _update(self, program_sources, preview_source):
+        self.cycle_started = time.monotonic()
+        apply_tally_state(program_sources, preview_source, self)
+    
+    def stats(self):
+        """Receive counters for this switcher"""
+        return {
+            'status': self.status,
+            'ingest': self.ingest.stats()
+        }
+
+# One feed per switcher, highest priority first
+feeds = [SwitcherFeed(switcher) if switcher.kind == 'vectar' else TslFeed(switcher) for switcher in topology.switchers]
+
+# The first switcher's connection, labels and ingest loop
+vectar = feeds[0].vectar
+label_cache = feeds[0].label_cache
+ingest = feeds[0].ingest
+
+# Re-sends the lamp states in the background, and straight after a gateway reconnect
+reconciler = Reconciler(desired_tally_states, dispatcher, RECONCILE_INTERVAL, RECONCILE_RATE,
+                        lamps=topology.lamps.names)
+
+def update_tally_state():
+    """Follow the Vectar tally state, pushed when available and polled otherwise"""
+    # initialize tally states dictionary
+    initialize_tally_states()
+    reconciler.start()
+    mapping_file.start()
+    dispatcher.open(gateway.name for gateway in topology.gateways)
+    
+    # Follow every switcher at once, each on its own thread
+    outputs.start()
+    for feed in feeds:
+        if feed.label_cache is not None:
+            feed.label_cache.start()
+    for feed in feeds[1:]:
+        feed.ingest.start()
+    feeds[0].ingest.run()
 
 @app.route('/')
 def index():
-    return render_template('index.html', state=current_state)
+    return render_template('index.html', state=state_store.snapshot.to_dict())
 
 @app.route('/status')
 def status():
-    return jsonify(current_state)
+    """Current program/preview and status, or 304 if the client's ETag is still current"""
+    snapshot = state_store.snapshot
+    if etag_matches(request.headers.get('If-None-Match'), snapshot.etag):
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.to_json(), mimetype='application/json')
+    response.set_etag(snapshot.etag, weak=True)
+    return response
+
+@app.route('/events')
+def events():
+    """Stream the state to the browser as server-sent events whenever it changes"""
+    return Response(
+        stream_with_context(broadcaster.listen()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def get_stats():
+    """Collect relay timing and counters from every component"""
+    return {
+        'ingest': ingest.stats(),
+        'vectar': vectar.stats() if vectar else None,
+        'labels': label_cache.stats() if label_cache else None,
+        'switchers': {feed.name: feed.stats() for feed in feeds},
+        'events': {'version': broadcaster.version, 'listeners': broadcaster.listeners},
+        'state': {'version': state_store.snapshot.version},
+        'dispatch': dispatcher.stats(),
+        'outputs': outputs.stats(),
+        'reconcile': reconciler.stats(),
+        'mapping_file': mapping_file.stats(),
+        'journal': dict(journal.stats(), warm_start=warm_start.stats()),
+        'sessions': {gateway.name: gateway.session_ids.stats() for gateway in topology.gateways}
+    }
+
+@app.route('/metrics')
+def metrics():
+    """Latency histograms and counters in the Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/stats')
+def stats():
+    """Relay timing and counters"""
+    return jsonify(get_stats())
 
 @app.route('/camera-mapping')
 def get_camera_mapping():
     """Get the current camera-to-XCU mapping"""
-    return jsonify(CAMERA_TO_XCU)
+    return jsonify(dict(state_store.snapshot.mapping))
 
-@app.route('/camera-mapping', methods=['POST'])
-def update_camera_mapping():
-    """Update the camera-to-XCU mapping"""
-    global CAMERA_TO_XCU
-    try:
-        # Get the updated mapping from request
-        new_mapping = request.json
+def set_camera_mapping(new_mapping, save=True):
+    """
+    Validate, apply and save a new camera-to-XCU mapping
+    
+    Args:
+        new_mapping: Dict of input name to XCU name
+        save: Write it to the mapping file (off the request thread)
     
+    Returns:
+        tuple: (response body, HTTP status code)
+    """
+    if not isinstance(new_mapping, dict):
+        return {'status': 'error', 'message': 'Mapping must be a JSON object'}, 400
+    try:
         for key, value in new_mapping.items():
             if not isinstance(key, str) or not isinstance(value, str):
-                return jsonify({'status': 'error', 'message': 'Invalid mapping format'}), 400
+                return {'status': 'error', 'message': 'Invalid mapping format'}, 400
             if not key.startswith('input'):
-                return jsonify({'status': 'error', 'message': 'Input keys must start with "input"'}), 400
+                return {'status': 'error', 'message': 'Input keys must start with "input"'}, 400
             if not value.startswith('XCU-'):
-                return jsonify({'status': 'error', 'message': 'XCU values must start with "XCU-"'}), 400
+                return {'status': 'error', 'message': 'XCU values must start with "XCU-"'}, 400
         
-        # update mapping
-        CAMERA_TO_XCU = new_mapping
+        # update the mapping, only switching the lamps it changes
+        remap_tally_states(new_mapping)
         
         # save mapping
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(CAMERA_TO_XCU, f, indent=4)
-        
-        # update tally states with new mapping
-        initialize_tally_states()
+        if save:
+            mapping_file.save(new_mapping)
         
-        return jsonify({'status': 'success', 'message': 'Camera mapping updated successfully'})
+        return {'status': 'success', 'message': 'Camera mapping updated successfully'}, 200
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return {'status': 'error', 'message': str(e)}, 500
+
+def reload_camera_mapping(new_mapping):
+    """
+    Apply a mapping edited in the mapping file
+    
+    Returns:
+        bool: True if the mapping was valid and applied
+    """
+    body, code = set_camera_mapping(new_mapping, save=False)
+    if code == 200:
+        print(f"Reloaded camera mapping from {CONFIG_FILE}: {new_mapping}")
+    else:
+        print(f"Not applying the camera mapping in {CONFIG_FILE}: {body['message']}")
+    return code == 200
+
+@app.route('/camera-mapping', methods=['POST'])
+def update_camera_mapping():
+    """Update the camera-to-XCU mapping"""
+    # None for a body that is not JSON, so it gets the same JSON error as any other bad mapping
+    body, code = set_camera_mapping(request.get_json(silent=True))
+    return jsonify(body), code
 
 if __name__ == '__main__':
-    # load camera mapping from the json
+    # load camera mapping from the json, and the lamp states the last run left
     load_camera_mapping()
+    load_tally_journal()
     
     # start the background thread for updating tally state
     update_thread = threading.Thread(target=update_tally_state, daemon=True)
     update_thread.start()
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # the reloader would start a second copy of the tally thread, so leave it off
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Async runtime for the Vectar Grass Valley Tally Relay
+
+Serves the same web interface and API as app.py, but on a single asyncio
+event loop (aiohttp) instead of the Werkzeug development server. The loop
+serves every web client, including the /events stream, and schedules the
+label refreshes. Everything that blocks runs off the loop: each switcher
+is followed by the same TallyIngest push/poll loop as in app.py, on its
+own thread, its label refreshes run on one I/O worker thread per switcher,
+and tally commands go out through the send dispatcher's gateway workers.
+
+Run it with:
+
+    python async_app.py --host 0.0.0.0 --port 5000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import app as relay
+from metrics import REGISTRY, CONTENT_TYPE
+from relay_state import etag_matches
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('async_app')
+
+INDEX_FILE = os.path.join(relay.SCRIPT_DIR, "templates", "index.html")
+
+async def run_blocking(executor, fn, *args):
+    """Run a blocking Vectar call on an I/O worker"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, fn, *args)
+
+async def refresh_labels(feed, executor):
+    """Keep one switcher's source labels fresh off the tally path, loading them straight away"""
+    while True:
+        await run_blocking(executor, feed.label_cache.refresh)
+        await asyncio.sleep(feed.label_cache.delay())
+
+async def index(request):
+    return web.FileResponse(INDEX_FILE)
+
+async def status(request):
+    """Current program/preview and status, or 304 if the client's ETag is still current"""
+    snapshot = relay.state_store.snapshot
+    headers = {'ETag': f'W/"{snapshot.etag}"'}
+    if etag_matches(request.headers.get('If-None-Match'), snapshot.etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(text=snapshot.to_json(), content_type='application/json', headers=headers)
+
+async def metrics(request):
+    return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+async def stats(request):
+    return web.json_response(relay.get_stats())
+
+async def events(request):
+    """Stream the state to the browser as server-sent events whenever it changes"""
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    await response.write(b"retry: 1000\n\n")
+    
+    changed = asyncio.Event()
+    request.app['listeners'].add(changed)
+    broadcaster = relay.broadcaster
+    with broadcaster.condition:
+        broadcaster.listeners += 1
+    try:
+        seen = 0
+        while not request.app['closing']:
+            version, message = broadcaster.latest()
+            if version == seen or message is None:
+                try:
+                    await asyncio.wait_for(changed.wait(), broadcaster.heartbeat)
+                except asyncio.TimeoutError:
+                    await response.write(broadcaster.heartbeat_frame().encode('utf-8'))
+                changed.clear()
+                continue
+            
+            seen = version
+            await response.write(f"id: {version}\ndata: {message}\n\n".encode('utf-8'))
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        request.app['listeners'].discard(changed)
+        with broadcaster.condition:
+            broadcaster.listeners -= 1
+    return response
+
+async def get_camera_mapping(request):
+    """Get the current camera-to-XCU mapping"""
+    return web.json_response(dict(relay.state_store.snapshot.mapping))
+
+async def update_camera_mapping(request):
+    """Update the camera-to-XCU mapping"""
+    try:
+        new_mapping = await request.json()
+    except ValueError:
+        return web.json_response({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    body, code = await run_blocking(request.app['io'], relay.set_camera_mapping, new_mapping)
+    return web.json_response(body, status=code)
+
+async def on_startup(web_app):
+    """Load the mapping and start the tally tasks"""
+    relay.load_camera_mapping()
+    relay.load_tally_journal()
+    relay.initialize_tally_states()
+    relay.reconciler.start()
+    relay.outputs.start()
+    relay.mapping_file.start()
+    relay.dispatcher.open(gateway.name for gateway in relay.topology.gateways)
+    
+    # Wake every /events handler when the relay publishes a change
+    loop = asyncio.get_running_loop()
+    
+    def wake_listeners():
+        for changed in web_app['listeners']:
+            changed.set()
+    
+    relay.broadcaster.add_callback(lambda: loop.call_soon_threadsafe(wake_listeners))
+    
+    # Each switcher's push/poll loop (or TSL receiver) has its own thread, and its label
+    # refreshes their own I/O worker, so a slow Vectar never holds up the others
+    for feed in relay.feeds:
+        if feed.label_cache is not None:
+            # Set before the ingest starts, so its polls never fetch the labels themselves
+            feed.label_cache.background = True
+            executor = web_app['feed_io'].get(feed.name)
+            if executor is None:
+                executor = web_app['feed_io'][feed.name] = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f'tally-io-{feed.name}')
+            web_app['tasks'].append(asyncio.create_task(refresh_labels(feed, executor)))
+        feed.ingest.start()
+    logger.info("Tally relay started")
+
+async def on_shutdown(web_app):
+    """Release the /events streams so the server can stop"""
+    web_app['closing'] = True
+    for changed in list(web_app['listeners']):
+        changed.set()
+
+async def on_cleanup(web_app):
+    """Stop the tally tasks and close the Vectar and gateway connections"""
+    for task in web_app['tasks']:
+        task.cancel()
+    await asyncio.gather(*web_app['tasks'], return_exceptions=True)
+    
+    web_app['io'].shutdown(wait=True)
+    for executor in web_app['feed_io'].values():
+        executor.shutdown(wait=True)
+    for feed in relay.feeds:
+        feed.ingest.stop()
+        if feed.vectar is not None:
+            feed.vectar.reset()
+    relay.reconciler.stop()
+    relay.outputs.stop()
+    relay.mapping_file.stop()
+    relay.dispatcher.stop()
+    relay.journal.close()
+    logger.info("Tally relay stopped")
+
+def create_app():
+    """Build the aiohttp application"""
+    web_app = web.Application()
+    web_app['io'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tally-io')
+    web_app['feed_io'] = {}
+    web_app['listeners'] = set()
+    web_app['closing'] = False
+    web_app['tasks'] = []
+    
+    web_app.router.add_get('/', index)
+    web_app.router.add_get('/status', status)
+    web_app.router.add_get('/events', events)
+    web_app.router.add_get('/stats', stats)
+    web_app.router.add_get('/metrics', metrics)
+    web_app.router.add_get('/camera-mapping', get_camera_mapping)
+    web_app.router.add_post('/camera-mapping', update_camera_mapping)
+    
+    web_app.on_startup.append(on_startup)
+    web_app.on_shutdown.append(on_shutdown)
+    web_app.on_cleanup.append(on_cleanup)
+    return web_app
+
+def main():
+    """Parse arguments and run the async server"""
+    parser = argparse.ArgumentParser(description='Vectar Grass Valley Tally Relay (async server)')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on (default: 5000)')
+    args = parser.parse_args()
+    
+    web.run_app(create_app(), host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
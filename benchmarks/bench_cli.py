@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark for command line tally changes: direct vs through the daemon.
+
+Times `gv_tally_control.py --xcu ... --red on` against a fake LDK gateway
+when every call connects and authenticates itself, when it forwards to a
+`--serve` daemon, and when a script writes straight to the daemon socket
+(one connection per command, and one persistent connection):
+
+    python benchmarks/bench_cli.py [--commands 50]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_gateway import FakeGateway
+from tally_daemon import format_command
+
+SCRIPT = os.path.join(ROOT, 'gv_tally_control.py')
+XCU = 'XCU-08'
+SESSION_ID = 'PH3XQD'
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def report(name, times, gateway, before):
+    """Print per-command timing and check every command reached the gateway"""
+    delivered = gateway.stats['values'] - before
+    print(f"{name:20s} mean {statistics.mean(times) * 1000:7.2f} ms, p50 {percentile(times, 50) * 1000:7.2f} ms, "
+          f"p99 {percentile(times, 99) * 1000:7.2f} ms ({delivered}/{len(times)} delivered)")
+
+def script_args(gateway, socket_path):
+    """Command line for the fake gateway, keeping discovered session IDs in memory, not in the repo"""
+    return [sys.executable, SCRIPT, '--ip', '127.0.0.1', '--port', str(gateway.port), '--socket', socket_path,
+            '--sessions-file', '']
+
+def run_cli(gateway, socket_path, count, extra):
+    """Time the command line script, alternating the red lamp"""
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        subprocess.run(
+            script_args(gateway, socket_path) + ['--xcu', XCU, '--red', 'on' if i % 2 else 'off'] + extra,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_socket(gateway, socket_path, count, persistent):
+    """Time commands written straight to the daemon socket"""
+    times = []
+    conn = None
+    for i in range(count):
+        start = time.perf_counter()
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.connect(socket_path)
+            reader = conn.makefile('rb')
+        conn.sendall(format_command(XCU, {'red': bool(i % 2)}, gateway=f"127.0.0.1:{gateway.port}").encode('utf-8'))
+        if reader.readline().strip() != b'OK':
+            raise RuntimeError("Daemon did not accept the command")
+        if not persistent:
+            conn.close()
+            conn = None
+        times.append(time.perf_counter() - start)
+    if conn is not None:
+        conn.close()
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description='Time command line tally changes with and without the daemon')
+    parser.add_argument('--commands', type=int, default=50, help='Commands per run (default: 50)')
+    args = parser.parse_args()
+    
+    gateway = FakeGateway(devices={XCU: SESSION_ID}).start()
+    socket_path = os.path.join(tempfile.mkdtemp(), 'bench_tally.sock')
+    
+    before = gateway.stats['values']
+    report('cli direct', run_cli(gateway, socket_path, args.commands, ['--no-daemon']), gateway, before)
+    
+    daemon = subprocess.Popen(
+        script_args(gateway, socket_path) + ['--serve'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError("Daemon did not start")
+        
+        before = gateway.stats['values']
+        report('cli via daemon', run_cli(gateway, socket_path, args.commands, []), gateway, before)
+        before = gateway.stats['values']
+        report('socket per command', run_socket(gateway, socket_path, args.commands, False), gateway, before)
+        before = gateway.stats['values']
+        report('socket persistent', run_socket(gateway, socket_path, args.commands, True), gateway, before)
+    finally:
+        daemon.terminate()
+        daemon.wait(timeout=5)
+        gateway.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: switcher cut to gateway ack.
+
+Runs the relay in-process between a fake Vectar and a fake LDK gateway,
+cuts through the cameras and reports cut-to-ack latency percentiles,
+delivered commands per second and CPU use. Either the app.py ingest loop
+(fetching from the fake Vectar) or a bare TallySender can be driven, and
+the gateway can be made slow or faulty:
+
+    python benchmarks/bench_end_to_end.py --target app
+    python benchmarks/bench_end_to_end.py --target sender --cameras 24
+    python benchmarks/bench_end_to_end.py --gateway-latency 0.02 --error-rate 0.05 --drop-rate 0.01
+
+The fakes run in the same process, so CPU figures include them and are
+best compared between runs rather than read as absolute costs. With
+--max-p99 the script exits non-zero when the p99 latency is over budget.
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gv_tally_control import GatewayClient, FUNCTION_IDS
+from fake_gateway import FakeGateway
+from fake_vectar import FakeVectar
+from session_cache import SessionCache
+from tally_dispatch import SendDispatcher
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+class AckWatcher:
+    """Waits for a particular function value to reach the fake gateway"""
+    
+    def __init__(self, gateway):
+        self.condition = threading.Condition()
+        self.expected = None
+        self.acked_at = None
+        gateway.add_callback(self.on_value)
+    
+    def expect(self, session_id, function_id, value):
+        with self.condition:
+            self.expected = (session_id, function_id, value)
+            self.acked_at = None
+    
+    def on_value(self, session_id, function_id, value, now):
+        with self.condition:
+            if (session_id, function_id, value) == self.expected:
+                self.acked_at = now
+                self.condition.notify_all()
+    
+    def wait(self, timeout):
+        """Seconds since perf_counter() when the expected value arrived, or None on timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.acked_at is not None, timeout)
+            return self.acked_at
+
+class AppTarget:
+    """Drives app.py: cuts happen on the fake Vectar and reach the relay through its ingest loop"""
+    
+    name = 'app'
+    
+    def __init__(self, vectar, gateway, mapping, sessions):
+        import app as relay
+        self.relay = relay
+        self.vectar = vectar
+        relay.topology.gateways[0].session_ids = sessions
+        relay.dispatcher.client_factory = lambda lane: GatewayClient(gateway.host, gateway.port, session_ids=sessions)
+        relay.feeds[0].label_cache.url = f"{vectar.base_url}/v1/dictionary?key=switcher"
+        relay.feeds[0].tally_url = f"{vectar.base_url}/v1/dictionary?key=tally"
+        relay.ingest.channel.host = vectar.host
+        relay.ingest.channel.port = vectar.notify_port
+        relay.load_camera_mapping = lambda: None
+        relay.initialize_tally_states(dict(mapping))
+        relay.label_cache.start()
+        relay.ingest.start()
+    
+    @property
+    def dispatcher(self):
+        return self.relay.dispatcher
+    
+    def cut(self, program, preview):
+        self.vectar.cut([program], preview)
+
+class SenderTarget:
+    """Drives a TallySender directly, skipping the switcher fetch"""
+    
+    name = 'sender'
+    
+    def __init__(self, vectar, gateway, mapping, sessions):
+        from tally_sender import TallySender
+        self.dispatcher = SendDispatcher(lambda lane: GatewayClient(gateway.host, gateway.port, session_ids=sessions))
+        self.sender = TallySender(dispatcher=self.dispatcher)
+        self.sender.camera_to_xcu = dict(mapping)
+    
+    def cut(self, program, preview):
+        self.sender.update_tally_state([program], preview)
+
+def wait_idle(target, gateway, timeout=10):
+    """Wait until nothing is queued and the gateway has stopped receiving values"""
+    deadline = time.monotonic() + timeout
+    last = -1
+    while time.monotonic() < deadline:
+        values = gateway.stats['values']
+        if target.dispatcher.queue_depth() == 0 and values == last:
+            return
+        last = values
+        time.sleep(0.1)
+
+def bench_latency(target, gateway, cameras, mapping, cuts, gap, timeout):
+    """Cut one camera at a time and time each until its red tally is acknowledged"""
+    watcher = AckWatcher(gateway)
+    latencies = []
+    missed = 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    
+    for i in range(cuts):
+        program = cameras[i % len(cameras)]
+        preview = cameras[(i + 1) % len(cameras)]
+        session_id = gateway.devices[mapping[program]]
+        watcher.expect(session_id, FUNCTION_IDS['red'], '1')
+        
+        start = time.perf_counter()
+        target.cut(program, preview)
+        acked_at = watcher.wait(timeout)
+        if acked_at is None:
+            missed += 1
+        else:
+            latencies.append(acked_at - start)
+        time.sleep(gap)
+    
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    return latencies, missed, cpu, wall
+
+def bench_throughput(target, gateway, cameras, rate, duration):
+    """
+    Cut at a fixed rate and count the function values delivered per second.
+    
+    Returns:
+        tuple: (cuts, values, coalesced, cpu_seconds, wall_seconds), where the wall
+            time runs until the last value reached the gateway
+    """
+    last_value = [None]
+    gateway.add_callback(lambda *args: last_value.__setitem__(0, args[-1]))
+    values_start = gateway.stats['values']
+    coalesced_start = target.dispatcher.coalesced()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    
+    cuts = int(rate * duration)
+    for i in range(cuts):
+        delay = wall_start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        target.cut(cameras[i % len(cameras)], cameras[(i + 1) % len(cameras)])
+    wait_idle(target, gateway)
+    
+    cpu = time.process_time() - cpu_start
+    wall = max((last_value[0] or time.perf_counter()) - wall_start, duration)
+    return cuts, gateway.stats['values'] - values_start, target.dispatcher.coalesced() - coalesced_start, cpu, wall
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end cut-to-ack benchmark against fake hardware')
+    parser.add_argument('--target', choices=['app', 'sender'], default='app',
+                        help='Drive the app.py ingest loop or a bare TallySender (default: app)')
+    parser.add_argument('--cameras', type=int, default=8, help='Mapped cameras, one XCU each (default: 8)')
+    parser.add_argument('--cuts', type=int, default=100, help='Paced cuts to time (default: 100)')
+    parser.add_argument('--gap', type=float, default=0.05, help='Seconds between paced cuts (default: 0.05)')
+    parser.add_argument('--rate', type=float, default=200, help='Cuts per second for the throughput run (default: 200)')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to run the throughput run (default: 5)')
+    parser.add_argument('--timeout', type=float, default=5, help='Seconds to wait for each ack (default: 5)')
+    parser.add_argument('--vectar-latency', type=float, default=0, help='Fake Vectar response delay in seconds')
+    parser.add_argument('--gateway-latency', type=float, default=0, help='Fake gateway ack delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of gateway commands rejected')
+    parser.add_argument('--silent-rate', type=float, default=0, help='Fraction of gateway commands not answered')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Fraction of gateway commands that drop the connection')
+    parser.add_argument('--max-p99', type=float, help='Fail if p99 cut-to-ack latency exceeds this many ms')
+    parser.add_argument('--verbose', action='store_true', help='Show the relay\'s own logging')
+    args = parser.parse_args()
+    
+    if args.cameras < 2:
+        parser.error('--cameras must be at least 2')
+    
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+    
+    vectar = FakeVectar(inputs=args.cameras)
+    vectar.latency = args.vectar_latency
+    vectar.start()
+    cameras = vectar.inputs
+    mapping = {source: f"XCU-{i:02d}" for i, source in enumerate(cameras, 1)}
+    gateway = FakeGateway(latency=args.gateway_latency, error_rate=args.error_rate,
+                          silent_rate=args.silent_rate, drop_rate=args.drop_rate,
+                          devices={xcu: f"BENCH{i:03d}" for i, xcu in enumerate(mapping.values(), 1)}).start()
+    
+    # The relay's own session IDs, saved or configured, have nothing to do with the fake gateway
+    sessions = SessionCache(gateway.devices)
+    
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        target = (AppTarget if args.target == 'app' else SenderTarget)(vectar, gateway, mapping, sessions)
+        # Let the relay connect to every XCU and settle before timing anything
+        for i in range(len(cameras)):
+            target.cut(cameras[i - 1], cameras[i])
+            wait_idle(target, gateway)
+        
+        latencies, missed, lat_cpu, lat_wall = bench_latency(
+            target, gateway, cameras, mapping, args.cuts, args.gap, args.timeout)
+        cuts, values, coalesced, load_cpu, load_wall = bench_throughput(
+            target, gateway, cameras, args.rate, args.duration)
+    
+    ms = [latency * 1000 for latency in latencies]
+    print(f"cut-to-ack [{target.name}] {len(ms)} cuts over {args.cameras} cameras, {missed} missed: "
+          f"p50 {percentile(ms, 50):.2f} ms, p90 {percentile(ms, 90):.2f} ms, "
+          f"p99 {percentile(ms, 99):.2f} ms, max {max(ms, default=0):.2f} ms")
+    print(f"throughput [{target.name}] {cuts} cuts at {args.rate:.0f}/s, {values} commands delivered in "
+          f"{load_wall:.2f} s ({values / load_wall:.0f} cmds/s), {coalesced} coalesced")
+    print(f"cpu        [{target.name}] paced {lat_cpu / lat_wall * 100:.1f}% "
+          f"({lat_cpu / max(args.cuts, 1) * 1000:.2f} ms/cut), under load {load_cpu / load_wall * 100:.1f}%")
+    print(f"gateway    {gateway.stats}")
+    
+    if args.max_p99 is not None and (missed or percentile(ms, 99) > args.max_p99):
+        print(f"FAIL: p99 over {args.max_p99} ms budget or missed acks")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
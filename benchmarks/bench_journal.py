@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the tally journal and warm start.
+
+Journals cuts through the cameras (desired states, then their acks) and
+times each append, then replays the journal as a restarted relay would,
+from a freshly compacted file and from one just short of compaction.
+Finally compares the commands a restart sends with and without the warm
+start when the program/preview moved on while the relay was down (cold
+counts the reconciler's first full pass, which puts the stale lamps right):
+
+    python benchmarks/bench_journal.py [--cameras 8 100 1000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tally_index import TallyIndex
+from tally_journal import TallyJournal, WarmStart
+
+def make_cuts(cameras, count):
+    """Program/preview states cutting through the cameras"""
+    return [([cameras[i % len(cameras)]], cameras[(i + 1) % len(cameras)]) for i in range(count)]
+
+def bench_append(path, mapping, cuts):
+    """Seconds per journaled cut, with its acks"""
+    journal = TallyJournal(path)
+    journal.load()
+    index = TallyIndex(mapping)
+    start = time.perf_counter()
+    for program, preview in cuts:
+        commands = index.update(program, preview)
+        journal.record_desired(commands)
+        journal.record_acked(commands)
+    elapsed = time.perf_counter() - start
+    journal.close()
+    return elapsed / len(cuts), journal.compactions
+
+def bench_replay(path, repeat):
+    """Seconds to replay the journal, without the compaction load() ends with"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        journal = TallyJournal(None)
+        journal.path = path
+        journal._compact = lambda: None
+        journal.load()
+    return (time.perf_counter() - start) / repeat, len(data)
+
+def restart_commands(path, mapping, program, preview):
+    """Commands a restarted relay sends for the first update, cold and warm"""
+    cold = TallyIndex(mapping)
+    cold_commands = cold.update(program, preview)
+    
+    # Cold, the lamps of the cameras that left program/preview while the relay was down stay lit
+    # until the reconciler's first full pass re-sends both lamps of every XCU
+    warm = WarmStart(*TallyJournal(path).load())
+    warm_commands = warm.filter(cold_commands)
+    warm_commands += warm.finish(cold.masks())
+    return len(cold_commands) + 2 * len(mapping), len(warm_commands)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the tally journal and compare cold and warm restarts')
+    parser.add_argument('--cameras', type=int, nargs='+', default=[8, 100, 1000],
+                        help='Camera counts to benchmark (default: 8 100 1000)')
+    parser.add_argument('--cuts', type=int, default=20000, help='Cuts journaled per run (default: 20000)')
+    args = parser.parse_args()
+    
+    directory = tempfile.mkdtemp()
+    for count in args.cameras:
+        cameras = [f"input{i}" for i in range(1, count + 1)]
+        mapping = {camera: f"XCU-{i:04d}" for i, camera in enumerate(cameras, 1)}
+        path = os.path.join(directory, f"journal-{count}.bin")
+        
+        # Several cameras on program at once, so the restart has lamps left lit
+        cuts = make_cuts(cameras, args.cuts)
+        cuts.append((cameras[:count // 4 or 1], cameras[-1]))
+        append_time, compactions = bench_append(path, mapping, cuts)
+        TallyJournal(path).load()
+        compacted_time, compacted_size = bench_replay(path, 20)
+        
+        # A journal just short of compaction
+        full_path = os.path.join(directory, f"journal-{count}-full.bin")
+        journal = TallyJournal(full_path)
+        journal.load()
+        index = TallyIndex(mapping)
+        while journal.size < journal.compact_bytes - 64:
+            program, preview = cuts[journal.records % len(cuts)]
+            commands = index.update(program, preview)
+            journal.record_desired(commands)
+            journal.record_acked(commands)
+        journal.close()
+        full_time, full_size = bench_replay(full_path, 20)
+        
+        cold, warm = restart_commands(path, mapping, cameras[1:count // 4 + 1], cameras[0])
+        print(f"{count:5d} cameras: append {append_time * 1e6:6.2f} us/cut ({compactions} compactions), "
+              f"replay {compacted_time * 1e3:6.2f} ms ({compacted_size} bytes) / {full_time * 1e3:6.2f} ms "
+              f"({full_size} bytes), restart commands cold {cold} vs warm {warm}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
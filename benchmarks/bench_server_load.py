@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the web server: /status request rate and /events fan-out latency.
+
+Runs either the threaded Flask app or the async (aiohttp) app in-process,
+fed by a fake Vectar, then hammers /status from several connections and
+times how long a state change takes to reach every /events listener.
+/status is timed both plain and as a conditional GET (If-None-Match with
+the ETag of the previous answer, so an unchanged state comes back as 304):
+
+    python benchmarks/bench_server_load.py --server flask
+    python benchmarks/bench_server_load.py --server async --clients 50
+"""
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as relay
+from fake_vectar import FakeVectar
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def start_server(kind, port):
+    """Start the chosen server in a background thread"""
+    if kind == 'flask':
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', port, relay.app, threaded=True)
+        relay.label_cache.start()
+        relay.ingest.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        from aiohttp import web
+        import async_app
+        threading.Thread(
+            target=web.run_app,
+            args=(async_app.create_app(),),
+            kwargs={'host': '127.0.0.1', 'port': port, 'handle_signals': False, 'print': None},
+            daemon=True
+        ).start()
+    
+    # Wait for it to come up
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/status')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+def bench_status(port, connections, duration, conditional=False):
+    """Hammer /status over keep-alive connections, optionally sending the last ETag back"""
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        local = []
+        etag = None
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            conn.request('GET', '/status', headers={'If-None-Match': etag} if conditional and etag else {})
+            response = conn.getresponse()
+            response.read()
+            etag = response.getheader('ETag')
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+    
+    threads = [threading.Thread(target=worker) for _ in range(connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+def bench_events(port, clients, changes):
+    """Time state changes from publish to arrival at every /events listener"""
+    published = {}
+    latencies = []
+    lock = threading.Lock()
+    ready = threading.Barrier(clients + 1)
+    
+    def listener():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('GET', '/events')
+        response = conn.getresponse()
+        ready.wait()
+        received = 0
+        while received < changes:
+            line = response.readline()
+            if not line.startswith(b'data: '):
+                continue
+            marker = json.loads(line[6:])['status']
+            if marker in published:
+                with lock:
+                    latencies.append(time.perf_counter() - published[marker])
+                received += 1
+        conn.close()
+    
+    threads = [threading.Thread(target=listener, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    time.sleep(0.2)
+    
+    for i in range(changes):
+        marker = f'Bench {i}'
+        published[marker] = time.perf_counter()
+        relay.publish_state(status=marker)
+        time.sleep(0.05)
+    for t in threads:
+        t.join(timeout=10)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description='Load benchmark for /status and /events')
+    parser.add_argument('--server', choices=['flask', 'async'], default='flask', help='Server to run (default: flask)')
+    parser.add_argument('--port', type=int, default=5099, help='Port to run the server on (default: 5099)')
+    parser.add_argument('--connections', type=int, default=8, help='Concurrent /status connections (default: 8)')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to hammer /status (default: 5)')
+    parser.add_argument('--clients', type=int, default=12, help='Concurrent /events listeners (default: 12)')
+    parser.add_argument('--changes', type=int, default=50, help='State changes to broadcast (default: 50)')
+    args = parser.parse_args()
+    
+    # A quiet fake Vectar with nothing mapped, so only the web server is under load
+    vectar = FakeVectar().start()
+    relay.feeds[0].label_cache.url = f"{vectar.base_url}/v1/dictionary?key=switcher"
+    relay.feeds[0].tally_url = f"{vectar.base_url}/v1/dictionary?key=tally"
+    relay.ingest.channel.host = vectar.host
+    relay.ingest.channel.port = vectar.notify_port
+    relay.load_camera_mapping = lambda: None
+    relay.initialize_tally_states({})
+    
+    start_server(args.server, args.port)
+    
+    for conditional in (False, True):
+        latencies = bench_status(args.port, args.connections, args.duration, conditional)
+        print(f"/status  [{args.server}{', 304' if conditional else ''}] {len(latencies) / args.duration:8.0f} req/s "
+              f"over {args.connections} connections, "
+          f"p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    
+    latencies = bench_events(args.port, args.clients, args.changes)
+    print(f"/events  [{args.server}] {len(latencies)} deliveries to {args.clients} clients, "
+          f"mean {statistics.mean(latencies) * 1000 if latencies else 0:.2f} ms, "
+          f"p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
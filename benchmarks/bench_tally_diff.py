@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark for tally diffing: full mapping scan vs the TallyIndex.
+
+The full scan is the diff app.py used to do, walking every mapped camera
+and its per-camera state dict on each update. The index only visits the
+sources that entered or left program/preview. Both are timed cutting
+through the cameras, and the memory of their lamp state is compared:
+
+    python benchmarks/bench_tally_diff.py [--cameras 8 100 1000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tally_index import TallyIndex
+
+class FullScan:
+    """The previous diff: one state dict per camera, every camera checked on every update"""
+    
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.states = {camera: {'red': False, 'green': False} for camera in mapping}
+    
+    def update(self, program_sources, preview_source):
+        commands = []
+        for camera, xcu in self.mapping.items():
+            should_be_red = camera in program_sources
+            should_be_green = camera == preview_source
+            if self.states[camera]['red'] != should_be_red:
+                commands.append((xcu, 'red', should_be_red))
+                self.states[camera]['red'] = should_be_red
+            if self.states[camera]['green'] != should_be_green:
+                commands.append((xcu, 'green', should_be_green))
+                self.states[camera]['green'] = should_be_green
+        return commands
+
+def make_cuts(cameras, count):
+    """Program/preview states cutting through the cameras, with a two-source mix every fourth cut"""
+    cuts = []
+    for i in range(count):
+        program = [cameras[i % len(cameras)]]
+        if i % 4 == 3:
+            program.append(cameras[(i + 2) % len(cameras)])
+        cuts.append((program, cameras[(i + 1) % len(cameras)]))
+    return cuts
+
+def bench(differ_class, mapping, cuts):
+    """Time updates per second through a differ, checking it lit the right lamps"""
+    differ = differ_class(mapping)
+    start = time.perf_counter()
+    commands = 0
+    for program, preview in cuts:
+        commands += len(differ.update(program, preview))
+    elapsed = time.perf_counter() - start
+    return elapsed / len(cuts), commands
+
+def state_size(differ_class, mapping):
+    """Bytes allocated for a differ's lamp state"""
+    tracemalloc.start()
+    differ = differ_class(mapping)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del differ
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare full-scan and indexed tally diffing')
+    parser.add_argument('--cameras', type=int, nargs='+', default=[8, 100, 1000],
+                        help='Camera counts to benchmark (default: 8 100 1000)')
+    parser.add_argument('--cuts', type=int, default=20000, help='Updates per run (default: 20000)')
+    args = parser.parse_args()
+    
+    for count in args.cameras:
+        cameras = [f"input{i}" for i in range(1, count + 1)]
+        mapping = {camera: f"XCU-{i:04d}" for i, camera in enumerate(cameras, 1)}
+        cuts = make_cuts(cameras, args.cuts)
+        
+        scan_time, scan_commands = bench(FullScan, mapping, cuts)
+        index_time, index_commands = bench(TallyIndex, mapping, cuts)
+        if scan_commands != index_commands:
+            print(f"WARNING: full scan sent {scan_commands} commands, index sent {index_commands}")
+        
+        print(f"{count:5d} cameras: full scan {scan_time * 1e6:9.2f} us/update, "
+              f"index {index_time * 1e6:6.2f} us/update ({scan_time / index_time:6.1f}x), "
+              f"state {state_size(FullScan, mapping) / count:5.0f} vs {state_size(TallyIndex, mapping) / count:5.0f} bytes/camera")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the TSL UMD outputs with hundreds of UMD indexes.
+
+Cuts through the sources with several TSL v5.0 UDP displays attached and
+times each cycle from program/preview to the packets being sent, once with
+the displays sharing the cycle's encoded frames and once with each display
+encoding for itself. Also times a full refresh of every UMD, and decoding
+the packets on a TslReceiver:
+
+    python benchmarks/bench_tsl.py [--umds 100 500 1000] [--sinks 4]
+"""
+
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tally_outputs import TallyOutputs
+from tsl_umd import TslSender, TslReceiver, encode_v5
+
+def make_cuts(sources, count):
+    """Program/preview states cutting through the sources, renaming one every tenth cut"""
+    cuts = []
+    for i in range(count):
+        program = [{'source': sources[i % len(sources)], 'label': f"CAM {i % len(sources)}"}]
+        if i % 4 == 3:
+            name = sources[(i + 2) % len(sources)]
+            program.append({'source': name, 'label': f"CAM {(i + 2) % len(sources)}"})
+        preview = {'source': sources[(i + 1) % len(sources)], 'label': f"CAM {(i + 1) % len(sources)}"}
+        if i % 10 == 9:
+            preview = dict(preview, label=f"ISO {i}")
+        cuts.append((program, preview))
+    return cuts
+
+def make_outputs(port, sinks, shared):
+    """TallyOutputs with UDP senders to one local port, sharing one encoding or each keeping its own"""
+    senders = [TslSender('127.0.0.1', port) for _ in range(sinks)]
+    if not shared:
+        for i, sender in enumerate(senders):
+            sender.key = sender.key + (i,)
+    return TallyOutputs(senders, refresh_interval=0)
+
+def bench_cycles(outputs, sources, cuts):
+    """Seconds per cycle, after lighting every UMD once"""
+    outputs.emit([], [{'source': source, 'label': source} for source in sources], None)
+    start = time.perf_counter()
+    for program, preview in cuts:
+        outputs.emit([], program, preview)
+    return (time.perf_counter() - start) / len(cuts)
+
+def bench_refresh(outputs, repeat):
+    """Seconds per full refresh, and the packets each sends per display"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        outputs.refresh()
+    return (time.perf_counter() - start) / repeat, len(encode_v5(outputs.table.messages()))
+
+def bench_receive(count, repeat):
+    """Seconds to decode and apply a full v5.0 state on a TslReceiver"""
+    receiver = TslReceiver(0, lambda program_sources, preview_source: None)
+    messages = [(index, index % 7 == 0, index % 7 == 1, f"CAM {index}") for index in range(1, count + 1)]
+    packets = encode_v5(messages)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        receiver.umds.clear()
+        for packet in packets:
+            receiver.apply(receiver.decode(packet))
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the TSL UMD outputs with many UMD indexes')
+    parser.add_argument('--umds', type=int, nargs='+', default=[100, 500, 1000],
+                        help='UMD counts to benchmark (default: 100 500 1000)')
+    parser.add_argument('--sinks', type=int, default=4, help='TSL displays to send to (default: 4)')
+    parser.add_argument('--cuts', type=int, default=5000, help='Cycles per run (default: 5000)')
+    args = parser.parse_args()
+    
+    # The packets go to a local port nobody reads, the kernel drops them once its buffer is full
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    port = sink.getsockname()[1]
+    
+    for count in args.umds:
+        sources = [f"input{i}" for i in range(1, count + 1)]
+        cuts = make_cuts(sources, args.cuts)
+        
+        shared = make_outputs(port, args.sinks, True)
+        own = make_outputs(port, args.sinks, False)
+        shared_time = bench_cycles(shared, sources, cuts)
+        own_time = bench_cycles(own, sources, cuts)
+        refresh_time, packets = bench_refresh(shared, 50)
+        receive_time = bench_receive(count, 50)
+        shared.stop()
+        own.stop()
+        
+        print(f"{count:5d} UMDs, {args.sinks} displays: shared encoding {shared_time * 1e6:7.1f} us/cycle, "
+              f"per display {own_time * 1e6:7.1f} us/cycle ({own_time / shared_time:4.2f}x), "
+              f"full refresh {refresh_time * 1e3:6.2f} ms ({packets} packets), "
+              f"receive {receive_time * 1e3:6.2f} ms")
+    sink.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
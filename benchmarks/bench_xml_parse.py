@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark the streaming Vectar dictionary parsers against the original
+ElementTree fromstring/findall implementation.
+
+Uses recorded dictionaries if given, otherwise generates large synthetic ones:
+
+    python benchmarks/bench_xml_parse.py
+    python benchmarks/bench_xml_parse.py --switcher switcher.xml --tally tally.xml
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vectar_client import iter_tally_columns, iter_physical_inputs
+
+def make_switcher(inputs, filler):
+    """Synthetic switcher dictionary: the inputs followed by a lot of other state"""
+    lines = ['<switcher_update>', '  <inputs>']
+    for i in range(1, inputs + 1):
+        lines.append(f'    <physical_input physical_input_number="Input{i}" iso_label="Camera {i}" '
+                     f'video_format="1080p50" connector="SDI {i}"/>')
+    lines.append('  </inputs>')
+    for section in range(filler):
+        lines.append(f'  <simulated_input index="{section}">')
+        for j in range(20):
+            lines.append(f'    <param name="param_{j}" value="{section * j}" min="0" max="100"/>')
+        lines.append('  </simulated_input>')
+    lines.append('</switcher_update>')
+    return '\n'.join(lines).encode('utf-8')
+
+def make_tally(columns):
+    """Synthetic tally dictionary"""
+    lines = ['<tally>']
+    for i in range(columns):
+        lines.append(f'  <column index="{i}" name="input{i + 1}" on_pgm="{str(i == 0).lower()}" '
+                     f'on_prev="{str(i == 1).lower()}"/>')
+    lines.append('</tally>')
+    return '\n'.join(lines).encode('utf-8')
+
+def labels_findall(xml):
+    root = ET.fromstring(xml)
+    return {e.get('physical_input_number').lower(): e.get('iso_label') for e in root.findall('.//physical_input')}
+
+def labels_streaming(xml):
+    return {num.lower(): label for num, label in iter_physical_inputs(xml)}
+
+def tally_findall(xml):
+    root = ET.fromstring(xml)
+    return [(c.get('name'), c.get('on_pgm') == 'true', c.get('on_prev') == 'true') for c in root.findall('.//column')]
+
+def tally_streaming(xml):
+    return list(iter_tally_columns(xml))
+
+def measure(fn, xml, repeat):
+    """Mean time per call in ms and peak allocation in KiB"""
+    fn(xml)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(xml)
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    
+    tracemalloc.start()
+    fn(xml)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Vectar dictionary parsing')
+    parser.add_argument('--switcher', help='Recorded switcher dictionary')
+    parser.add_argument('--tally', help='Recorded tally dictionary')
+    parser.add_argument('--repeat', type=int, default=50, help='Iterations per measurement (default: 50)')
+    args = parser.parse_args()
+    
+    if args.switcher:
+        with open(args.switcher, 'rb') as f:
+            switcher = f.read()
+    else:
+        switcher = make_switcher(inputs=44, filler=500)
+    if args.tally:
+        with open(args.tally, 'rb') as f:
+            tally = f.read()
+    else:
+        tally = make_tally(columns=200)
+    
+    assert labels_findall(switcher) == labels_streaming(switcher)
+    assert tally_findall(tally) == tally_streaming(tally)
+    
+    print(f"{'document':<10} {'size KiB':>9} {'parser':<10} {'ms/parse':>9} {'peak KiB':>9}")
+    for name, xml, old, new in (('switcher', switcher, labels_findall, labels_streaming),
+                                ('tally', tally, tally_findall, tally_streaming)):
+        for label, fn in (('findall', old), ('streaming', new)):
+            elapsed, peak = measure(fn, xml, args.repeat)
+            print(f"{name:<10} {len(xml) / 1024:>9.1f} {label:<10} {elapsed:>9.3f} {peak:>9.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Fake LDK Gateway
+
+A small stand-in for a Grass Valley LDK Gateway so the relay can be run
+and benchmarked without hardware. It speaks the gateway's XML protocol
+(application-authentication-request and function-value-change), records
+every function value it accepts, and can inject latency and faults. Given
+a set of basestations it also announces their session IDs, and rejects
+commands for sessions it does not have.
+"""
+
+import argparse
+import logging
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+
+from gv_tally_control import XMLFramer, parse_root
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('fake_gateway')
+
+DEVICE_PATTERN = re.compile(r'<device>(.*?)</device>', re.S)
+SESSION_PATTERN = re.compile(r'<sessionid>([^<]*)</sessionid>')
+FUNCTION_PATTERN = re.compile(r'<function id="([^"]*)">\s*<Value>([^<]*)</Value>')
+
+AUTH_REPLY = '<application-authentication-indication result="Ok"/>'
+OK_REPLY = '<function-value-indication result="Ok"/>'
+ERROR_REPLY = '<function-value-indication result="Error"/>'
+
+def format_device_list(devices, tag='device-list-indication'):
+    """Announce basestations as <device> elements with their session ID and name"""
+    lines = [f'<{tag}>']
+    for name, session_id in devices.items():
+        lines.append(f'  <device><sessionid>{session_id}</sessionid><name>{name}</name></device>')
+    lines.append(f'</{tag}>')
+    return '\n'.join(lines)
+
+def parse_changes(document):
+    """
+    Get the function values in a function-value-change message.
+    
+    Returns:
+        list: (session_id, function_id, value) tuples
+    """
+    changes = []
+    for device in DEVICE_PATTERN.findall(document):
+        session = SESSION_PATTERN.search(device)
+        session_id = session.group(1) if session else ""
+        for function_id, value in FUNCTION_PATTERN.findall(device):
+            changes.append((session_id, function_id, value))
+    return changes
+
+class FakeGateway:
+    """Fake LDK gateway with configurable reply latency and faults"""
+    
+    def __init__(self, host="127.0.0.1", port=0, latency=0, error_rate=0, silent_rate=0, drop_rate=0,
+                 devices=None):
+        """
+        Initialize the FakeGateway
+        
+        Args:
+            host: Address to bind to
+            port: Port to listen on (0 picks a free port)
+            latency: Seconds to wait before acknowledging each command
+            error_rate: Fraction of commands rejected with an error reply
+            silent_rate: Fraction of commands applied but never answered
+            drop_rate: Fraction of commands that make the gateway drop the connection unapplied
+            devices: Dict of XCU name to session ID to announce (None accepts any session and announces nothing)
+        """
+        self.host = host
+        self.latency = latency
+        self.error_rate = error_rate
+        self.silent_rate = silent_rate
+        self.drop_rate = drop_rate
+        self.devices = dict(devices) if devices is not None else None
+        
+        self.lock = threading.Lock()
+        self.values = {}  # Format: {(session_id, function_id): value}
+        self.callbacks = []
+        self.connections = {}  # Format: {socket: send lock}
+        
+        # Counters so clients can measure what reached the gateway
+        self.stats = {'connections': 0, 'authentications': 0, 'commands': 0, 'values': 0,
+                      'errors': 0, 'silent': 0, 'drops': 0, 'rejected': 0}
+        
+        self.server = socket.create_server((host, port))
+        self.port = self.server.getsockname()[1]
+    
+    def start(self):
+        """Start serving in a background thread"""
+        threading.Thread(target=self._accept, daemon=True).start()
+        logger.info(f"Fake gateway listening on {self.host}:{self.port}")
+        return self
+    
+    def stop(self):
+        """Stop serving and drop every connection"""
+        self.server.close()
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = {}
+    
+    def add_callback(self, callback):
+        """
+        Call a function for every function value the gateway accepts.
+        
+        Args:
+            callback: Callable taking (session_id, function_id, value, time.perf_counter()),
+                run on the connection thread before the ack is sent
+        """
+        self.callbacks.append(callback)
+    
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.connections[conn] = threading.Lock()
+                self.stats['connections'] += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+    
+    def _serve(self, conn):
+        framer = XMLFramer()
+        try:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                for document in framer.feed(data):
+                    reply = self._handle(document)
+                    if reply is False:
+                        return
+                    if reply:
+                        self._send(conn, reply)
+        except OSError:
+            return
+        finally:
+            with self.lock:
+                self.connections.pop(conn, None)
+            conn.close()
+    
+    def _send(self, conn, message):
+        with self.lock:
+            send_lock = self.connections.get(conn)
+        if send_lock is None:
+            return
+        with send_lock:
+            conn.sendall(message.encode('utf-8'))
+    
+    def announce(self, message):
+        """Send an unsolicited message to every connected client"""
+        with self.lock:
+            connections = list(self.connections)
+        for conn in connections:
+            try:
+                self._send(conn, message)
+            except OSError:
+                pass
+    
+    def reboot(self, xcu):
+        """
+        Simulate a basestation reboot: it comes back with a new session ID, which is announced.
+        
+        Returns:
+            str: The new session ID
+        """
+        session_id = os.urandom(3).hex().upper()
+        with self.lock:
+            self.devices[xcu] = session_id
+        self.announce(format_device_list({xcu: session_id}))
+        return session_id
+    
+    def remove(self, xcu):
+        """Simulate a basestation going away, and announce it"""
+        with self.lock:
+            session_id = self.devices.pop(xcu)
+        self.announce(format_device_list({xcu: session_id}, 'device-removed-indication'))
+    
+    def _handle(self, document):
+        """
+        Apply one message.
+        
+        Returns:
+            str: Reply to send, None to send nothing, or False to drop the connection
+        """
+        tag, _ = parse_root(document)
+        if tag == 'application-authentication-request':
+            with self.lock:
+                self.stats['authentications'] += 1
+            return AUTH_REPLY
+        if tag == 'device-list-request':
+            with self.lock:
+                return format_device_list(self.devices or {})
+        if tag != 'function-value-change':
+            logger.debug(f"Ignoring {tag} message")
+            return None
+        
+        with self.lock:
+            self.stats['commands'] += 1
+        
+        fault = random.random()
+        if fault < self.drop_rate:
+            with self.lock:
+                self.stats['drops'] += 1
+            return False
+        if self.latency:
+            time.sleep(self.latency)
+        if fault < self.drop_rate + self.error_rate:
+            with self.lock:
+                self.stats['errors'] += 1
+            return ERROR_REPLY
+        
+        changes = parse_changes(document)
+        with self.lock:
+            known = self.devices is None or all(c[0] in self.devices.values() for c in changes)
+            if not known:
+                self.stats['rejected'] += 1
+        if not known:
+            return ERROR_REPLY
+        
+        now = time.perf_counter()
+        with self.lock:
+            self.stats['values'] += len(changes)
+            for session_id, function_id, value in changes:
+                self.values[(session_id, function_id)] = value
+        for session_id, function_id, value in changes:
+            for callback in self.callbacks:
+                callback(session_id, function_id, value, now)
+        
+        if fault < self.drop_rate + self.error_rate + self.silent_rate:
+            with self.lock:
+                self.stats['silent'] += 1
+            return None
+        return OK_REPLY
+
+def main():
+    """Run a fake gateway that logs every tally change it receives"""
+    parser = argparse.ArgumentParser(description='Fake LDK Gateway for testing the tally relay without hardware')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind to (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds before each ack (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of commands rejected (default: 0)')
+    parser.add_argument('--silent-rate', type=float, default=0, help='Fraction of commands not answered (default: 0)')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Fraction of commands that drop the connection (default: 0)')
+    parser.add_argument('--devices', help='Basestations to announce, e.g. XCU-08=PH3XQD,XCU-09=4DIA2O (default: accept any session)')
+    args = parser.parse_args()
+    
+    devices = dict(item.split('=', 1) for item in args.devices.split(',')) if args.devices else None
+    gateway = FakeGateway(args.host, args.port, args.latency, args.error_rate, args.silent_rate, args.drop_rate, devices)
+    gateway.add_callback(lambda session_id, function_id, value, _: logger.info(
+        f"Session {session_id or '(default)'}: function {function_id} = {value}"))
+    gateway.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        gateway.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Fake Vectar
+
+A small stand-in for a Viz Vectar switcher so the relay can be run and
+tested without hardware. It serves the `tally` and `switcher` dictionaries
+over HTTP with Digest authentication, and pushes a notification on a TCP
+channel every time the tally state changes.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('fake_vectar')
+
+REALM = "Vectar"
+AUTH_FIELD = re.compile(r'(\w+)=(?:"([^"]*)"|([^,\s]*))')
+
+def md5(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+class FakeVectar:
+    """Scriptable fake Vectar with an HTTP API and a TCP notification channel"""
+    
+    def __init__(self, host="127.0.0.1", http_port=0, notify_port=0, inputs=8,
+                 user="admin", password="password"):
+        """
+        Initialize the FakeVectar
+        
+        Args:
+            host: Address to bind to
+            http_port: Port for the HTTP dictionary API (0 picks a free port)
+            notify_port: Port for the TCP notification channel (0 picks a free port, None disables it)
+            inputs: Number of physical inputs to report
+            user: Digest auth username
+            password: Digest auth password
+        """
+        self.host = host
+        self.inputs = [f"input{i}" for i in range(1, inputs + 1)]
+        self.labels = {name: f"Camera {i}" for i, name in enumerate(self.inputs, 1)}
+        self.user = user
+        self.password = password
+        self.nonce = md5(os.urandom(16).hex())
+        
+        self.lock = threading.Lock()
+        self.program = []
+        self.preview = None
+        self.latency = 0
+        self.etags = True
+        
+        # Counters so clients can measure how many round trips they cost
+        self.stats = {'requests': 0, 'challenges': 0, 'connections': 0, 'notifications': 0}
+        
+        self.http = ThreadingHTTPServer((host, http_port), self._handler_class())
+        self.http.daemon_threads = True
+        self.http_port = self.http.server_address[1]
+        
+        self.subscribers = []
+        self.notify_server = None
+        self.notify_port = None
+        if notify_port is not None:
+            self.notify_server = socket.create_server((host, notify_port))
+            self.notify_port = self.notify_server.getsockname()[1]
+    
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.http_port}"
+    
+    def start(self):
+        """Start serving in background threads"""
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        if self.notify_server:
+            threading.Thread(target=self._accept_subscribers, daemon=True).start()
+        logger.info(f"Fake Vectar serving {self.base_url} (notifications on port {self.notify_port})")
+        return self
+    
+    def stop(self):
+        """Stop serving and drop all subscribers"""
+        self.http.shutdown()
+        self.http.server_close()
+        if self.notify_server:
+            self.notify_server.close()
+        with self.lock:
+            for conn in self.subscribers:
+                conn.close()
+            self.subscribers = []
+    
+    def cut(self, program, preview=None):
+        """
+        Change the tally state and notify subscribers
+        
+        Args:
+            program: List of sources on program
+            preview: Source on preview
+        """
+        with self.lock:
+            self.program = list(program)
+            self.preview = preview
+        self.notify("tally")
+    
+    def set_label(self, source, label):
+        """Change the iso label of an input and notify subscribers"""
+        with self.lock:
+            self.labels[source] = label
+        self.notify("switcher")
+    
+    def notify(self, key):
+        """Push a change notification to every connected subscriber"""
+        message = f'<shortcut_states><shortcut_state name="{key}" value="changed"/></shortcut_states>\n'.encode('utf-8')
+        with self.lock:
+            for conn in list(self.subscribers):
+                try:
+                    conn.sendall(message)
+                    self.stats['notifications'] += 1
+                except OSError:
+                    self.subscribers.remove(conn)
+                    conn.close()
+    
+    def tally_xml(self):
+        """Render the tally dictionary"""
+        with self.lock:
+            columns = [
+                f'  <column index="{i}" name="{name}" on_pgm="{str(name in self.program).lower()}" '
+                f'on_prev="{str(name == self.preview).lower()}"/>'
+                for i, name in enumerate(self.inputs)
+            ]
+        return '<tally>\n' + '\n'.join(columns) + '\n</tally>'
+    
+    def switcher_xml(self):
+        """Render the switcher dictionary"""
+        with self.lock:
+            inputs = [
+                f'    <physical_input physical_input_number="{name.capitalize()}" iso_label="{self.labels[name]}"/>'
+                for name in self.inputs
+            ]
+        return '<switcher_update>\n  <inputs>\n' + '\n'.join(inputs) + '\n  </inputs>\n</switcher_update>'
+    
+    def _accept_subscribers(self):
+        while True:
+            try:
+                conn, _ = self.notify_server.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.subscribers.append(conn)
+    
+    def _check_auth(self, method, header):
+        if not header or not header.startswith('Digest '):
+            return False
+        fields = {k: a or b for k, a, b in AUTH_FIELD.findall(header[7:])}
+        if fields.get('username') != self.user or fields.get('nonce') != self.nonce:
+            return False
+        ha1 = md5(f"{self.user}:{REALM}:{self.password}")
+        ha2 = md5(f"{method}:{fields.get('uri')}")
+        if fields.get('qop'):
+            expected = md5(f"{ha1}:{self.nonce}:{fields.get('nc')}:{fields.get('cnonce')}:{fields.get('qop')}:{ha2}")
+        else:
+            expected = md5(f"{ha1}:{self.nonce}:{ha2}")
+        return fields.get('response') == expected
+    
+    def _handler_class(self):
+        vectar = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def setup(self):
+                super().setup()
+                with vectar.lock:
+                    vectar.stats['connections'] += 1
+            
+            def do_GET(self):
+                with vectar.lock:
+                    vectar.stats['requests'] += 1
+                
+                if not vectar._check_auth('GET', self.headers.get('Authorization')):
+                    with vectar.lock:
+                        vectar.stats['challenges'] += 1
+                    self.send_response(401)
+                    self.send_header('WWW-Authenticate',
+                                     f'Digest realm="{REALM}", nonce="{vectar.nonce}", qop="auth", algorithm=MD5')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                
+                url = urlsplit(self.path)
+                key = parse_qs(url.query).get('key', [''])[0]
+                if url.path != '/v1/dictionary' or key not in ('tally', 'switcher'):
+                    self.send_error(404)
+                    return
+                
+                if vectar.latency:
+                    time.sleep(vectar.latency)
+                
+                body = (vectar.tally_xml() if key == 'tally' else vectar.switcher_xml()).encode('utf-8')
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if vectar.etags and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                if vectar.etags:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+        
+        return Handler
+
+def main():
+    """Run a fake Vectar that cuts between its inputs on a timer"""
+    parser = argparse.ArgumentParser(description='Fake Vectar for testing the tally relay without hardware')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind to (default: 127.0.0.1)')
+    parser.add_argument('--http-port', type=int, default=8081, help='HTTP port (default: 8081)')
+    parser.add_argument('--notify-port', type=int, default=5951, help='TCP notification port (default: 5951)')
+    parser.add_argument('--inputs', type=int, default=8, help='Number of inputs (default: 8)')
+    parser.add_argument('--cycle', type=float, default=3, help='Seconds between automatic cuts (default: 3)')
+    args = parser.parse_args()
+    
+    vectar = FakeVectar(args.host, args.http_port, args.notify_port, args.inputs).start()
+    
+    # Cut through the inputs, keeping the next one on preview
+    i = 0
+    try:
+        while True:
+            program = vectar.inputs[i % len(vectar.inputs)]
+            preview = vectar.inputs[(i + 1) % len(vectar.inputs)]
+            logger.info(f"Cut: program={program}, preview={preview}")
+            vectar.cut([program], preview)
+            i += 1
+            time.sleep(args.cycle)
+    except KeyboardInterrupt:
+        vectar.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,11 +8,20 @@ Grass Valley LDK Gateway camera systems using XML commands.
 
 import socket
 import argparse
+import codecs
 import logging
+import os
+import re
+import signal
 import sys
+import threading
 import time
+from collections import deque
 from datetime import datetime
 
+from session_cache import SessionCache
+from tally_daemon import DEFAULT_SOCKET, FORWARD_TIMEOUT, TallyDaemon, format_command, forward
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +36,10 @@ logger = logging.getLogger('gv_tally_control')
 DEFAULT_IP = "PUT-GV-GATEWAY-IP-HERE"
 DEFAULT_PORT = 8080 # I think access IP will always be 8080, but check with nmap if unsure.
 
+# Seconds to connect and authenticate, and to wait for a command's ack
+DEFAULT_TIMEOUT = 2
+DEFAULT_ACK_TIMEOUT = 0.5
+
 # Map XCU names to their respective session IDs
 XCU_SESSION_IDS = {
     "XCU-08": "PH3XQD", # These are the basestation serial names, 
@@ -34,8 +47,15 @@ XCU_SESSION_IDS = {
     "XCU-10": "8KSIDK" # Yours will be unique
 }
 
-# Default session ID if XCU not found in the mapping
-DEFAULT_SESSION_ID = ""
+# Asks the gateway to announce the basestations it knows about, and the root of its answer
+DEVICE_QUERY = '<device-list-request/>'
+DEVICE_LIST_TAG = 'device-list-indication'
+
+# Root elements of announcements that a device has gone
+DEVICE_GONE_TAGS = ('device-removed-indication', 'device-disconnected-indication')
+
+# Seconds between session refreshes triggered by rejected commands
+SESSION_REFRESH_INTERVAL = 5
 
 # Function IDs for different tally types
 FUNCTION_IDS = {
@@ -44,6 +64,34 @@ FUNCTION_IDS = {
     "yellow": "8217" # Also never got yellow to work, but I found these values, so....
 }
 
+# Discovered session IDs are saved next to the script, one file per gateway
+SESSIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Session caches of the gateways clients were created for without their own
+_default_sessions = {}
+_default_sessions_lock = threading.Lock()
+
+def sessions_file(ip, port):
+    """File the discovered session IDs of one gateway are saved in"""
+    return os.path.join(SESSIONS_DIR, "session_ids_" + re.sub(r'[^\w.-]', '_', f"{ip}_{port}") + ".json")
+
+def default_sessions(ip, port):
+    """
+    The shared session cache of one gateway, seeded from XCU_SESSION_IDS.
+    
+    It is created, and the IDs saved by earlier runs read, the first time
+    it is asked for, so every client of the same gateway in a process
+    shares one cache.
+    
+    Returns:
+        SessionCache: The cache
+    """
+    with _default_sessions_lock:
+        cache = _default_sessions.get((ip, port))
+        if cache is None:
+            cache = _default_sessions[(ip, port)] = SessionCache(XCU_SESSION_IDS, sessions_file(ip, port))
+        return cache
+
 def format_authentication_request(name="TallySender"):
     """
     Format the XML authentication request.
@@ -73,153 +121,636 @@ def format_tally_command(session_id, function_id, value):
     Returns:
         str: Formatted XML tally command
     """
-    return (
-        f'<?xml version="2.0" encoding="UTF-8"?>\n'
-        f'<function-value-change>\n'
-        f'  <device>\n'
-        f'    <sessionid>{session_id}</sessionid>\n'
-        f'    <function id="{function_id}">\n'
-        f'      <Value>{value}</Value>\n'
-        f'    </function>\n'
-        f'  </device>\n'
-        f'</function-value-change>'
-    )
+    return format_batch_command([(session_id, function_id, value)])
 
-def send_command(ip, port, xml_command, timeout=2):
+def format_batch_command(changes):
     """
-    Send an XML command to the Grass Valley LDK Gateway.
+    Format a single function-value-change message covering several devices.
+    
+    Functions for the same session ID are grouped under one <device> element,
+    so the gateway receives the whole change set in one write.
     
     Args:
-        ip: IP address of the gateway
-        port: Port number of the gateway
-        xml_command: XML command to send
-        timeout: Socket timeout in seconds
+        changes: List of (session_id, function_id, value) tuples
         
     Returns:
-        str: Response from the gateway
+        str: Formatted XML command
+    """
+    devices = {}
+    for session_id, function_id, value in changes:
+        devices.setdefault(session_id, []).append((function_id, value))
+    
+    lines = [
+        '<?xml version="2.0" encoding="UTF-8"?>',
+        '<function-value-change>'
+    ]
+    for session_id, functions in devices.items():
+        lines.append('  <device>')
+        lines.append(f'    <sessionid>{session_id}</sessionid>')
+        for function_id, value in functions:
+            lines.append(f'    <function id="{function_id}">')
+            lines.append(f'      <Value>{value}</Value>')
+            lines.append('    </function>')
+        lines.append('  </device>')
+    lines.append('</function-value-change>')
+    return '\n'.join(lines)
+
+def is_ok_reply(response):
     """
-    logger.info(f"Connecting to {ip}:{port} via socket")
+    Check a gateway reply for success.
     
-    # Create socket
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(timeout)
+    The authentication indication sometimes arrives in place of the reply
+    to the following command, so it counts as success too.
+    """
+    return "result=\"Ok\"" in response or "<application-authentication-indication" in response
+
+# Largest message kept while waiting for the rest of it
+MAX_DOCUMENT_SIZE = 1 << 20
+
+# Any tag in a gateway message: (closing slash, name, attributes, self-closing slash)
+TAG_PATTERN = re.compile(r'<(/?)([A-Za-z_][\w:.-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*?)(/?)>')
+ATTRIBUTE_PATTERN = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+class XMLFramer:
+    """
+    Splits the gateway's byte stream into complete XML documents.
     
-    try:
-        # Connect to the gateway
-        s.connect((ip, port))
+    The gateway protocol has no length prefix, so a message is complete
+    when its root element closes. Partial messages are buffered until the
+    rest arrives, and several messages in one read are split apart. Text
+    and stray closing tags between messages are dropped, and so is a
+    message that grows past `max_size` without completing.
+    """
+    
+    def __init__(self, max_size=MAX_DOCUMENT_SIZE):
+        self.buffer = ""
+        self.max_size = max_size
+        self.dropped = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    def feed(self, data):
+        """
+        Add received bytes and return any documents they complete.
         
-        # Send the command
-        logger.info("Sending command via socket")
-        logger.debug(f"Command: {xml_command}")
-        s.sendall(xml_command.encode('utf-8'))
+        Args:
+            data: Bytes read from the socket
+            
+        Returns:
+            list: Complete documents as strings
+        """
+        self.buffer += self.decoder.decode(data)
+        documents = []
+        depth = 0
+        pos = 0
+        start = None
+        stop = 0  # Where the unprocessed input starts
         
-        # Receive the response
-        try:
-            response = s.recv(4096).decode('utf-8')
-            logger.debug(f"Response: {response}")
-            return response, s
-        except socket.timeout:
-            logger.warning("Socket timeout while receiving response")
-            return "", s
+        while True:
+            lt = self.buffer.find('<', pos)
+            if lt == -1:
+                stop = len(self.buffer)
+                break
+            stop = lt
+            
+            # Skip declarations, processing instructions and comments
+            if self.buffer.startswith('<?', lt) or self.buffer.startswith('<!', lt):
+                end_marker = '-->' if self.buffer.startswith('<!--', lt) else '>'
+                gt = self.buffer.find(end_marker, lt)
+                if gt == -1:
+                    break
+                if start is None:
+                    start = lt
+                pos = gt + len(end_marker)
+                continue
+            
+            match = TAG_PATTERN.match(self.buffer, lt)
+            if match is None:
+                # Tag not fully received yet (or garbage we skip past)
+                if self.buffer.find('>', lt) == -1:
+                    break
+                pos = lt + 1
+                continue
             
-    except Exception as e:
-        logger.error(f"Error sending command: {e}")
-        s.close()
-        return "", None
+            closing, _, _, self_closing = match.groups()
+            if closing and start is None:
+                # The end of a message that was dropped, or garbage
+                pos = match.end()
+                continue
+            if start is None:
+                start = lt
+            if closing:
+                depth -= 1
+            elif not self_closing:
+                depth += 1
+            pos = match.end()
+            
+            if depth <= 0:
+                documents.append(self.buffer[start:pos].strip())
+                self.buffer = self.buffer[pos:]
+                pos = 0
+                depth = 0
+                start = None
+        
+        if start is None:
+            self.buffer = self.buffer[stop:]
+        if len(self.buffer) > self.max_size:
+            self.dropped += 1
+            logger.warning(f"Dropping {len(self.buffer)} bytes from the gateway that are not a complete message")
+            self.buffer = ""
+        return documents
 
-def control_tally(ip, port, xcu_name, tally_type, state):
+DEVICE_PATTERN = re.compile(r'<device\b([^>]*)>(.*?)</device>', re.S)
+SESSION_ID_PATTERN = re.compile(r'<sessionid>\s*([^<\s]*)\s*</sessionid>', re.I)
+DEVICE_NAME_PATTERN = re.compile(r'<(name|devicename|label)>\s*([^<]*?)\s*</\1>', re.I)
+DEVICE_STATE_PATTERN = re.compile(r'<state>\s*([^<\s]*)\s*</state>', re.I)
+
+def parse_devices(document):
     """
-    Control a tally light.
+    Get the basestations described in a gateway message.
+    
+    Devices are <device> elements with a <sessionid> and a <name>, the
+    same shape the gateway uses in function-value-change. A device whose
+    state (element or attribute) is offline or removed is reported as gone.
     
     Args:
-        ip: IP address of the gateway
-        port: Port number of the gateway
-        xcu_name: XCU device name (e.g., XCU-01)
-        tally_type: Type of tally (red, green, yellow)
-        state: Desired state (on, off)
+        document: Complete XML document
         
     Returns:
-        bool: True if successful, False otherwise
+        list: (name, session_id, online) tuples
     """
-    # Get the session ID for the specified XCU
-    session_id = XCU_SESSION_IDS.get(xcu_name, DEFAULT_SESSION_ID)
-    logger.info(f"Using session ID {session_id} for {xcu_name}")
+    devices = []
+    for attributes, body in DEVICE_PATTERN.findall(document):
+        session = SESSION_ID_PATTERN.search(body)
+        name = DEVICE_NAME_PATTERN.search(body)
+        if not session or not name:
+            continue
+        state = DEVICE_STATE_PATTERN.search(body)
+        state = state.group(1) if state else dict(
+            (k, a or b) for k, a, b in ATTRIBUTE_PATTERN.findall(attributes)).get('state', '')
+        devices.append((name.group(2), session.group(1), state.lower() not in ('offline', 'removed', 'disconnected')))
+    return devices
+
+def parse_root(document):
+    """
+    Get the root element of a gateway message.
     
-    # Validate tally type
-    if tally_type not in FUNCTION_IDS:
-        logger.error(f"Invalid tally type: {tally_type}. Must be one of: {', '.join(FUNCTION_IDS.keys())}")
-        return False
+    Args:
+        document: Complete XML document
+        
+    Returns:
+        tuple: (tag, attributes dict), or (None, {}) if there is no element
+    """
+    for match in TAG_PATTERN.finditer(document):
+        if not match.group(1):
+            attributes = {k: a or b for k, a, b in ATTRIBUTE_PATTERN.findall(match.group(3))}
+            return match.group(2), attributes
+    return None, {}
+
+class GatewayClient:
+    """
+    Long-lived connection to a Grass Valley LDK Gateway.
     
-    # Validate state
-    if state.lower() not in ["on", "off"]:
-        logger.error(f"Invalid state: {state}. Must be 'on' or 'off'")
-        return False
+    Keeps one authenticated socket open and reuses it for every tally
+    command, reconnecting automatically if the gateway drops the link.
+    """
     
-    # Convert state to value
-    value = "1" if state.lower() == "on" else "0"
+    def __init__(self, ip=DEFAULT_IP, port=DEFAULT_PORT, name="TallySender",
+                 timeout=DEFAULT_TIMEOUT, ack_timeout=DEFAULT_ACK_TIMEOUT, session_ids=None, discover=False):
+        """
+        Initialize the GatewayClient
+        
+        Args:
+            ip: IP address of the gateway
+            port: Port number of the gateway
+            name: Application name to use for authentication
+            timeout: Socket connect and authentication timeout in seconds
+            ack_timeout: How long to wait for a response to a command
+            session_ids: SessionCache (or dict) of XCU session IDs for this gateway
+                (default: default_sessions(ip, port))
+            discover: Also ask the gateway for its basestations after connecting and after
+                a rejected command, instead of only learning them from its announcements
+                (a gateway that doesn't answer the query holds each connect up for ack_timeout)
+        """
+        self.ip = ip
+        self.port = port
+        self.name = name
+        self.timeout = timeout
+        self.ack_timeout = ack_timeout
+        if session_ids is None:
+            session_ids = default_sessions(ip, port)
+        elif not isinstance(session_ids, SessionCache):
+            session_ids = SessionCache(session_ids)
+        self.session_ids = session_ids
+        self.discover = discover
+        self.last_refresh = 0
+        self.skipped = 0
+        self.connects = 0
+        self.on_reset = None  # Called with the XCUs whose lamps may have been reset, None for all of them
+        self.sock = None
+        self.framer = None
+        self.inbox = deque()
+        self.lock = threading.Lock()
     
-    # Send authentication request
-    logger.info("Sending authentication request...")
-    auth_xml = format_authentication_request()
-    auth_response, socket = send_command(ip, port, auth_xml)
+    def connect(self):
+        """
+        Open the socket and authenticate with the gateway.
+        
+        Returns:
+            bool: True if connected, False otherwise
+        """
+        self.close()
+        logger.info(f"Connecting to {self.ip}:{self.port} via socket")
+        
+        try:
+            s = socket.create_connection((self.ip, self.port), timeout=self.timeout)
+        except OSError as e:
+            logger.error(f"Failed to connect to gateway: {e}")
+            return False
+        
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = s
+        self.framer = XMLFramer()
+        self.inbox.clear()
+        
+        try:
+            # Send authentication request
+            logger.info("Sending authentication request...")
+            s.sendall(format_authentication_request(self.name).encode('utf-8'))
+            
+            # Wait for the gateway to confirm the session instead of sleeping. It might not
+            # answer at all, or only after the next command, so no answer is not an error
+            reply = self._read_reply(self.timeout)
+            if reply is None:
+                logger.warning("No authentication response, continuing")
+            elif not is_ok_reply(reply):
+                logger.error(f"Authentication failed: {reply}")
+                self.close()
+                return False
+        except OSError as e:
+            logger.error(f"Error authenticating with gateway: {e}")
+            self.close()
+            return False
+        
+        logger.info("Authenticated with gateway")
+        if self.discover:
+            self._query_devices()
+        self.connects += 1
+        if self.on_reset:
+            # Whatever the lamps showed before may have been lost with the old connection
+            self.on_reset(None)
+        return True
     
-    if socket is None:
-        logger.error("Failed to connect to gateway")
-        return False
+    def close(self):
+        """Close the gateway socket if it is open"""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
     
-    # Check for successful authentication
-    # The gateway might not send a response immediately, or might send it after the next command
-    # I consider it a success if we don't get an error
-    if auth_response and "result=\"Ok\"" not in auth_response:
-        logger.error(f"Authentication failed: {auth_response}")
-        socket.close()
-        return False
+    @property
+    def connected(self):
+        """True while the gateway socket is open"""
+        return self.sock is not None
     
-    logger.info("Authentication request sent")
+    def _read_document(self, timeout):
+        """
+        Read the next complete message from the gateway.
+        
+        Args:
+            timeout: Maximum time to wait in seconds (0 to only take what has already arrived)
+            
+        Returns:
+            str: The message, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while not self.inbox:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Pick up anything already waiting without blocking, then put the timeout back
+                # so later sends and reads on a stalled gateway still give up
+                timeout = self.sock.gettimeout()
+                self.sock.setblocking(False)
+                try:
+                    data = self.sock.recv(65536)
+                except (BlockingIOError, InterruptedError):
+                    return None
+                finally:
+                    self.sock.settimeout(timeout)
+            else:
+                self.sock.settimeout(remaining)
+                try:
+                    data = self.sock.recv(65536)
+                except socket.timeout:
+                    return None
+            if not data:
+                raise ConnectionError("Gateway closed the connection")
+            self.inbox.extend(self.framer.feed(data))
+        
+        document = self.inbox.popleft()
+        logger.debug(f"Response: {document}")
+        return document
     
-    # Small delay to ensure authentication is processed
-    time.sleep(0.5)
+    def _read_reply(self, timeout):
+        """
+        Wait for the gateway's reply to the last request.
+        
+        Messages that are not replies (no result attribute) are handed to
+        handle_message and skipped.
+        
+        Returns:
+            str: The reply, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            document = self._read_document(max(0, deadline - time.monotonic()))
+            if document is None:
+                return None
+            tag, attributes = parse_root(document)
+            if 'result' in attributes or tag == 'application-authentication-indication':
+                return document
+            self.handle_message(tag, attributes, document)
     
-    # Send tally command using the same socket
-    logger.info(f"Sending {tally_type} tally {state} command to {xcu_name}...")
-    tally_xml = format_tally_command(
-        session_id=session_id,
-        function_id=FUNCTION_IDS[tally_type],
-        value=value
-    )
+    def handle_message(self, tag, attributes, document):
+        """
+        Handle an unsolicited message from the gateway.
+        
+        Device announcements update the session cache, so a basestation that
+        reboots with a new session ID is picked up without a restart.
+        
+        Args:
+            tag: Root element name
+            attributes: Root element attributes
+            document: Complete message
+        """
+        devices = parse_devices(document)
+        if not devices:
+            logger.debug(f"Unsolicited {tag} message from gateway")
+            return
+        learned = []
+        for name, session_id, online in devices:
+            if online and tag not in DEVICE_GONE_TAGS:
+                if self.session_ids.learn(name, session_id):
+                    learned.append(name)
+            else:
+                self.session_ids.forget(name, session_id)
+        
+        # A new session is a basestation that has (re)booted with its lamps off
+        if learned and self.on_reset:
+            self.on_reset(learned)
     
-    try:
-        logger.debug(f"Tally command: {tally_xml}")
-        socket.sendall(tally_xml.encode('utf-8'))
+    def _drain_messages(self):
+        """Handle every message that has already arrived (call with the lock held)"""
+        document = self._read_document(0)
+        while document is not None:
+            tag, attributes = parse_root(document)
+            if 'result' not in attributes:
+                self.handle_message(tag, attributes, document)
+            document = self._read_document(0)
+    
+    def sync_sessions(self):
+        """
+        Connect if needed and take in any device announcements waiting, so
+        session lookups reflect what the gateway has right now.
         
+        Returns:
+            bool: True if connected
+        """
+        with self.lock:
+            if self.sock is None:
+                return self.connect()
+            try:
+                self._drain_messages()
+            except OSError as e:
+                logger.warning(f"Gateway connection lost ({e})")
+                self.close()
+                return False
+            return True
+    
+    def _query_devices(self):
+        """Ask the gateway which basestations it has and learn their session IDs (call with the lock held)"""
+        self.last_refresh = time.monotonic()
         try:
-            tally_response = socket.recv(4096).decode('utf-8')
-            logger.debug(f"Tally response: {tally_response}")
+            self.sock.sendall(DEVICE_QUERY.encode('utf-8'))
+            deadline = time.monotonic() + self.ack_timeout
+            while True:
+                document = self._read_document(max(0, deadline - time.monotonic()))
+                if document is None:
+                    return
+                tag, attributes = parse_root(document)
+                if 'result' in attributes:
+                    # The gateway answered without a device list (e.g. it doesn't support the query)
+                    return
+                self.handle_message(tag, attributes, document)
+                if tag == DEVICE_LIST_TAG:
+                    return
+        except OSError as e:
+            logger.warning(f"Error querying gateway devices: {e}")
+            self.close()
+    
+    def refresh_sessions(self):
+        """
+        Re-read the gateway's basestations, at most every SESSION_REFRESH_INTERVAL seconds.
+        
+        Returns:
+            bool: True if the gateway was queried
+        """
+        with self.lock:
+            if not self.discover or time.monotonic() - self.last_refresh < SESSION_REFRESH_INTERVAL:
+                return False
+            if self.sock is None:
+                # Connecting queries the devices anyway
+                return self.connect()
+            self._query_devices()
+            return True
+    
+    def send_xml(self, xml_command):
+        """
+        Send an XML command over the persistent socket, reconnecting once on failure.
+        
+        Args:
+            xml_command: XML command to send
             
-            # Check if the response contains either an OK or the authentication indication
-            # (which sometimes comes after the tally command)
-            if "result=\"Ok\"" in tally_response or "<application-authentication-indication" in tally_response:
-                logger.info(f"Successfully set {tally_type} tally to {state}")
-                result = True
-            else:
-                logger.error(f"Failed to set tally: {tally_response}")
-                result = False
-                
-        except socket.timeout:
-            logger.warning("Socket timeout while receiving tally response")
-            # Assume success if we don't get an error response
-            logger.info(f"Assuming {tally_type} tally set to {state} (no error response)")
-            result = True
+        Returns:
+            tuple: (sent, response) where sent is False if the gateway was unreachable
+        """
+        with self.lock:
+            for attempt in range(2):
+                if self.sock is None and not self.connect():
+                    return False, ""
+                try:
+                    # Deal with anything that arrived since the last command, so it is not
+                    # mistaken for the reply to this one
+                    self._drain_messages()
+                    
+                    logger.debug(f"Command: {xml_command}")
+                    self.sock.sendall(xml_command.encode('utf-8'))
+                    return True, self._read_reply(self.ack_timeout) or ""
+                except OSError as e:
+                    logger.warning(f"Gateway connection lost ({e}), reconnecting")
+                    self.close()
+            return False, ""
+    
+    def send_value(self, session_id, function_id, value):
+        """
+        Set a single function value on a device.
+        
+        Args:
+            session_id: Session ID for the camera
+            function_id: Function ID to change
+            value: "1" for ON, "0" for OFF
             
-    except Exception as e:
-        logger.error(f"Error sending tally command: {e}")
-        result = False
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return self.send_values([(session_id, function_id, value)])
+    
+    def send_values(self, changes):
+        """
+        Set several function values in one function-value-change write.
         
-    finally:
-        # Close the socket
-        socket.close()
+        Args:
+            changes: List of (session_id, function_id, value) tuples
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not changes:
+            return True
+        
+        sent, response = self.send_xml(format_batch_command(changes))
+        if not sent:
+            return False
+        
+        # Check if the response contains either an OK or the authentication indication
+        # (which sometimes comes after the tally command)
+        # Assume success if we don't get a response at all
+        if response and not is_ok_reply(response):
+            logger.error(f"Failed to set function values: {response}")
+            # A rejected command may mean a basestation rebooted with a new session,
+            # so re-read the sessions before the retry
+            self.refresh_sessions()
+            return False
+        return True
+    
+    def set_tally(self, xcu, tally_type, on, session_id=None):
+        """
+        Control a tally light.
+        
+        Args:
+            xcu: XCU device name (e.g., XCU-01)
+            tally_type: Type of tally (red, green, yellow)
+            on: True for on, False for off
+            session_id: Override session ID (normally determined automatically from XCU)
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if tally_type not in FUNCTION_IDS:
+            logger.error(f"Invalid tally type: {tally_type}. Must be one of: {', '.join(FUNCTION_IDS.keys())}")
+            return False
+        
+        if session_id is None:
+            session_id = self.session_ids.get(xcu)
+        if session_id is None:
+            logger.error(f"No session ID known for {xcu}")
+            return False
+        state = "on" if on else "off"
+        logger.info(f"Sending {tally_type} tally {state} command to {xcu} (session {session_id})")
+        
+        if self.send_value(session_id, FUNCTION_IDS[tally_type], "1" if on else "0"):
+            logger.info(f"Successfully set {tally_type} tally to {state}")
+            return True
+        return False
+    
+    def set_lamps(self, xcu, lamps, session_id=None):
+        """
+        Set several lamps of one XCU in a single write.
+        
+        Args:
+            xcu: XCU device name (e.g., XCU-01)
+            lamps: Dict of tally type to True/False
+            session_id: Override session ID (normally determined automatically from XCU)
+        
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        invalid = [tally_type for tally_type in lamps if tally_type not in FUNCTION_IDS]
+        if invalid:
+            logger.error(f"Invalid tally type: {invalid[0]}. Must be one of: {', '.join(FUNCTION_IDS.keys())}")
+            return False
+        
+        if session_id is None:
+            self.sync_sessions()
+            session_id = self.session_ids.get(xcu)
+        if session_id is None:
+            logger.error(f"No session ID known for {xcu}")
+            return False
+        summary = ', '.join(f"{tally_type} {'on' if on else 'off'}" for tally_type, on in lamps.items())
+        logger.info(f"Sending {summary} to {xcu} (session {session_id})")
+        return self.send_values([
+            (session_id, FUNCTION_IDS[tally_type], "1" if on else "0") for tally_type, on in lamps.items()
+        ])
+    
+    def set_tallies(self, commands):
+        """
+        Commit several tally changes, for any number of XCUs, in a single write.
+        
+        Args:
+            commands: List of (xcu, tally_type, on) tuples
+            
+        Returns:
+            tuple: (success, skipped) where success is False if the write failed, and skipped
+                lists the commands that were not sent because their XCU has no known session
+        """
+        self.sync_sessions()
+        
+        changes = []
+        skipped = []
+        for xcu, tally_type, on in commands:
+            if tally_type not in FUNCTION_IDS:
+                logger.error(f"Invalid tally type: {tally_type}. Must be one of: {', '.join(FUNCTION_IDS.keys())}")
+                return False, []
+            
+            # Don't spend a round trip on a basestation the gateway doesn't have
+            session_id = self.session_ids.get(xcu)
+            if session_id is None:
+                self.skipped += 1
+                skipped.append((xcu, tally_type, on))
+                logger.warning(f"No session ID known for {xcu}, skipping its {tally_type} tally")
+                continue
+            changes.append((session_id, FUNCTION_IDS[tally_type], "1" if on else "0"))
+        
+        if not changes:
+            return True, skipped
+        logger.info(f"Sending {len(changes)} tally changes in one command")
+        return self.send_values(changes), skipped
+
+def control_tally(ip, port, xcu_name, tally_type, state):
+    """
+    Control a tally light with a one-off gateway connection.
+    
+    Args:
+        ip: IP address of the gateway
+        port: Port number of the gateway
+        xcu_name: XCU device name (e.g., XCU-01)
+        tally_type: Type of tally (red, green, yellow)
+        state: Desired state (on, off)
         
-    return result
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    # Validate state
+    if state.lower() not in ["on", "off"]:
+        logger.error(f"Invalid state: {state}. Must be 'on' or 'off'")
+        return False
+    
+    client = GatewayClient(ip, port)
+    try:
+        return client.set_tally(xcu_name, tally_type, state.lower() == "on")
+    finally:
+        client.close()
 
 def main():
     """Main function to parse arguments and control tally lights."""
@@ -243,6 +774,15 @@ def main():
                         help='Enable debug logging')
     parser.add_argument('--list-xcus', action='store_true',
                         help='List all known XCUs and their session IDs')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a daemon that keeps the gateway connection open for later commands')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help=f'Daemon socket path (default: {DEFAULT_SOCKET})')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Always connect to the gateway directly, even if a daemon is running')
+    parser.add_argument('--sessions-file',
+                        help='File to keep discovered session IDs in, empty to not keep them '
+                             '(default: session_ids_<ip>_<port>.json next to this script)')
     
     args = parser.parse_args()
     
@@ -250,11 +790,50 @@ def main():
     if args.debug:
         logger.setLevel(logging.DEBUG)
     
-    # List XCUs if requested
+    sessions = None
+    if args.sessions_file is not None:
+        sessions = SessionCache(XCU_SESSION_IDS, args.sessions_file or None)
+    
+    # List XCUs if requested, asking the gateway which ones it has
     if args.list_xcus:
+        client = GatewayClient(args.ip, args.port, session_ids=sessions, discover=True)
+        with client.lock:
+            client.connect()
+        client.close()
+        sessions = client.session_ids
         print("Known XCUs and their session IDs:")
-        for xcu, session_id in XCU_SESSION_IDS.items():
-            print(f"  {xcu}: {session_id}")
+        for xcu in sorted(set(sessions.static) | set(sessions.discovered) | set(sessions.saved)):
+            session_id = sessions.get(xcu)
+            if xcu in sessions.discovered:
+                source = "discovered"
+            elif xcu in sessions.static:
+                source = "configured"
+            else:
+                source = "saved"
+            print(f"  {xcu}: {session_id or '(gone)'} ({source})")
+        return 0
+    
+    # Hold the gateway connection open and take commands from the socket until stopped
+    if args.serve:
+        client = GatewayClient(args.ip, args.port, session_ids=sessions)
+        with client.lock:
+            client.connect()
+        daemon = TallyDaemon(client, args.socket)
+        try:
+            daemon.start()
+        except OSError as e:
+            logger.error(f"Could not start the tally daemon: {e}")
+            client.close()
+            return 1
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.stop()
+            client.close()
         return 0
     
     # Check if XCU is specified
@@ -265,104 +844,32 @@ def main():
     if not (args.red or args.green or args.yellow):
         parser.error("At least one tally control argument (--red, --green, --yellow) is required")
     
-    # Control tally lights
-    success = True
-    
-    # If a session ID is explicitly provided, use it instead of looking it up
     xcu_name = args.xcu if args.xcu else "Custom"
+    lamps = {
+        tally_type: getattr(args, tally_type) == "on"
+        for tally_type in ("red", "green", "yellow") if getattr(args, tally_type)
+    }
+    
+    # Hand the command to a running daemon, which already has the gateway connection
+    if not args.no_daemon:
+        # Give the daemon time to reconnect and authenticate, then write and wait for the ack, twice over
+        timeout = max(FORWARD_TIMEOUT, 2 * (2 * DEFAULT_TIMEOUT + DEFAULT_ACK_TIMEOUT))
+        reply = forward(format_command(xcu_name, lamps, args.session, f"{args.ip}:{args.port}"), args.socket, timeout)
+        if reply is not None:
+            if reply != 'OK':
+                logger.error(f"Tally daemon: {reply}")
+            return 0 if reply == 'OK' else 1
     
     # If a session ID is explicitly provided, override the XCU mapping
     if args.session:
-        # Create a temporary function to override the session ID lookup
-        def control_with_session_override(ip, port, tally_type, state):
-            logger.info(f"Using override session ID {args.session}")
-            # Validate tally type
-            if tally_type not in FUNCTION_IDS:
-                logger.error(f"Invalid tally type: {tally_type}")
-                return False
-            
-            # Send authentication request
-            logger.info("Sending authentication request...")
-            auth_xml = format_authentication_request()
-            auth_response, socket = send_command(ip, port, auth_xml)
-            
-            if socket is None:
-                logger.error("Failed to connect to gateway")
-                return False
-            
-            # Check for successful authentication
-            if auth_response and "result=\"Ok\"" not in auth_response:
-                logger.error(f"Authentication failed: {auth_response}")
-                socket.close()
-                return False
-            
-            logger.info("Authentication request sent")
-            
-            # Small delay to ensure authentication is processed
-            time.sleep(0.5)
-            
-            # Send tally command using the same socket
-            logger.info(f"Sending {tally_type} tally {state} command with session ID {args.session}...")
-            tally_xml = format_tally_command(
-                session_id=args.session,
-                function_id=FUNCTION_IDS[tally_type],
-                value="1" if state.lower() == "on" else "0"
-            )
-            
-            try:
-                logger.debug(f"Tally command: {tally_xml}")
-                socket.sendall(tally_xml.encode('utf-8'))
-                
-                try:
-                    tally_response = socket.recv(4096).decode('utf-8')
-                    logger.debug(f"Tally response: {tally_response}")
-                    
-                    if "result=\"Ok\"" in tally_response or "<application-authentication-indication" in tally_response:
-                        logger.info(f"Successfully set {tally_type} tally to {state}")
-                        result = True
-                    else:
-                        logger.error(f"Failed to set tally: {tally_response}")
-                        result = False
-                        
-                except socket.timeout:
-                    logger.warning("Socket timeout while receiving tally response")
-                    logger.info(f"Assuming {tally_type} tally set to {state} (no error response)")
-                    result = True
-                    
-            except Exception as e:
-                logger.error(f"Error sending tally command: {e}")
-                result = False
-                
-            finally:
-                socket.close()
-                
-            return result
-        
-        # Use the override function
-        if args.red:
-            if not control_with_session_override(args.ip, args.port, "red", args.red):
-                success = False
-        
-        if args.green:
-            if not control_with_session_override(args.ip, args.port, "green", args.green):
-                success = False
-        
-        if args.yellow:
-            if not control_with_session_override(args.ip, args.port, "yellow", args.yellow):
-                success = False
-    else:
-        # Use the standard control function with XCU mapping
-        if args.red:
-            if not control_tally(args.ip, args.port, xcu_name, "red", args.red):
-                success = False
-        
-        if args.green:
-            if not control_tally(args.ip, args.port, xcu_name, "green", args.green):
-                success = False
-        
-        if args.yellow:
-            if not control_tally(args.ip, args.port, xcu_name, "yellow", args.yellow):
-                success = False
+        logger.info(f"Using override session ID {args.session}")
+    
+    # Control tally lights in a single write over a one-off gateway connection
+    client = GatewayClient(args.ip, args.port, session_ids=sessions)
+    try:
+        success = client.set_lamps(xcu_name, lamps, session_id=args.session)
+    finally:
+        client.close()
     
     return 0 if success else 1
 
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+MappingFile - saves the camera mapping off the request path and follows edits to it
+
+A save hands the mapping to a writer thread, which writes it to a temp
+file and renames it over camera_mapping.json: a crash mid-write never
+leaves a half-written file, and a burst of saves is one write. The file
+is watched with inotify where available (Linux), or by polling its mtime
+elsewhere, and a mapping written by anyone but the relay is passed to
+on_change so it takes effect without a restart.
+"""
+
+import atexit
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+logger = logging.getLogger('mapping_file')
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def write_json(path, data):
+    """Write JSON to a file atomically, through a temp file renamed over it"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def inotify_watch(directory):
+    """
+    Watch a directory for files being written or renamed into it.
+    
+    Returns:
+        int: The inotify file descriptor, or None if inotify is not available
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def inotify_names(data):
+    """File names in a buffer of inotify events"""
+    names = []
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+        offset += length
+    return names
+
+class MappingFile:
+    """Background saving and change watching for one JSON mapping file"""
+    
+    def __init__(self, path, on_change, poll_interval=1, settle=0.1):
+        """
+        Initialize the MappingFile
+        
+        Args:
+            path: JSON file holding the mapping
+            on_change: Function taking the new mapping when the file is edited outside the relay,
+                called from the watcher thread, returning True if it applied the mapping
+            poll_interval: Seconds between mtime checks when inotify is not available
+            settle: Seconds to wait after a change for the writer to finish before reading
+        """
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.filename = os.path.basename(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.settle = settle
+        
+        # The mapping the relay is using and the last one written, so our own writes are not
+        # mistaken for edits
+        self.current = None
+        self.written = None
+        self.pending = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.writer = None
+        self.watcher = None
+        self.mode = None
+        
+        # Counters
+        self.writes = 0
+        self.reloads = 0
+        self.errors = 0
+    
+    def load(self):
+        """
+        Read the mapping from the file.
+        
+        Returns:
+            dict: The mapping, or None if the file does not exist
+        
+        Raises:
+            OSError, ValueError: If the file can't be read or is not valid JSON
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            mapping = json.load(f)
+        with self.lock:
+            self.current = self.written = mapping
+        return mapping
+    
+    def write(self, mapping):
+        """Write a mapping to the file now, on the calling thread"""
+        with self.lock:
+            self.current = mapping
+            self.pending = None
+        write_json(self.path, mapping)
+        with self.lock:
+            self.written = mapping
+        self.writes += 1
+    
+    def save(self, mapping):
+        """Queue a mapping to be written by the writer thread, replacing any still waiting"""
+        with self.lock:
+            self.current = self.pending = mapping
+        self.wake.set()
+    
+    def start(self):
+        """Start the writer and watcher threads"""
+        if self.running:
+            return
+        self.running = True
+        self.writer = threading.Thread(target=self._write_pending, daemon=True)
+        self.writer.start()
+        self.watcher = threading.Thread(target=self._watch, daemon=True)
+        self.watcher.start()
+        # A queued save must still reach the disk when the relay exits
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Stop the threads, writing out any save still waiting"""
+        if not self.running:
+            return
+        self.running = False
+        self.wake.set()
+        self.writer.join(timeout=5)
+    
+    def _write_pending(self):
+        """Writer loop: write the latest queued mapping"""
+        while True:
+            self.wake.wait(1)
+            self.wake.clear()
+            with self.lock:
+                mapping, self.pending = self.pending, None
+            if mapping is not None:
+                try:
+                    write_json(self.path, mapping)
+                    with self.lock:
+                        self.written = mapping
+                    self.writes += 1
+                except OSError as e:
+                    self.errors += 1
+                    logger.error(f"Error saving mapping to {self.path}: {e}")
+            if not self.running and self.pending is None:
+                return
+    
+    def _watch(self):
+        fd = inotify_watch(self.directory)
+        if fd is None:
+            self.mode = 'poll'
+            logger.info(f"Watching {self.path} every {self.poll_interval} s")
+            self._poll()
+            return
+        self.mode = 'inotify'
+        logger.info(f"Watching {self.path} with inotify")
+        try:
+            while self.running:
+                readable, _, _ = select.select([fd], [], [], 1)
+                if not readable:
+                    continue
+                try:
+                    names = inotify_names(os.read(fd, 4096))
+                except BlockingIOError:
+                    continue
+                if self.filename in names:
+                    time.sleep(self.settle)
+                    self.check()
+        finally:
+            os.close(fd)
+    
+    def _poll(self):
+        last = self._signature()
+        while self.running:
+            time.sleep(self.poll_interval)
+            signature = self._signature()
+            if signature != last:
+                last = signature
+                self.check()
+    
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def check(self):
+        """Read the file and pass the mapping to on_change if it was edited outside the relay"""
+        try:
+            with open(self.path, 'r') as f:
+                mapping = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            logger.warning(f"Ignoring unreadable mapping in {self.path}: {e}")
+            return
+        with self.lock:
+            if mapping == self.current or mapping == self.written:
+                return
+        self.reloads += 1
+        logger.info(f"{self.path} was edited, applying the new mapping")
+        try:
+            applied = self.on_change(mapping)
+        except Exception as e:
+            applied = False
+            logger.error(f"Error applying the mapping from {self.path}: {e}")
+        if not applied:
+            # Still using the old mapping, so an edit back to it is not a change
+            self.errors += 1
+            return
+        with self.lock:
+            self.current = self.written = mapping
+    
+    def stats(self):
+        """Write and reload counters in a JSON friendly form"""
+        return {
+            'mode': self.mode,
+            'writes': self.writes,
+            'reloads': self.reloads,
+            'errors': self.errors,
+            'pending': self.pending is not None
+        }
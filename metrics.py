@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Metrics - minimal Prometheus-style histograms and counters
+
+Instruments register themselves in REGISTRY, and REGISTRY.render()
+produces the Prometheus text exposition format served at /metrics.
+"""
+
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from sub-millisecond up to slow gateway timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [(self.name + _format_labels(self.labelnames, key), value) for key, value in items]
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.series = {}  # Format: {label values: [bucket counts..., sum, count]}
+        self.lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+    
+    def samples(self):
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.series.items()]
+        samples = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                samples.append((f'{self.name}_bucket{labels}', cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f'{self.name}_sum{labels}', series[-2]))
+            samples.append((f'{self.name}_count{labels}', series[-1]))
+        return samples
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+    
+    kind = 'gauge'
+    
+    def __init__(self, name, documentation, fn):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+    
+    def samples(self):
+        return [(self.name, self.fn())]
+
+class Registry:
+    """Collection of instruments rendered together"""
+    
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+    
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def gauge(self, name, documentation, fn):
+        """Register a gauge, replacing any earlier callback with the same name"""
+        metric = Gauge(name, documentation, fn)
+        with self.lock:
+            self.metrics[name] = metric
+        return metric
+    
+    def render(self):
+        """Render every instrument in the Prometheus text format"""
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample, value in metric.samples():
+                lines.append(f'{sample} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+# Shared registry for the whole relay
+REGISTRY = Registry()
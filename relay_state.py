@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+RelayState - versioned, read-only snapshots of what the relay shows
+
+The tally threads never change the state the web handlers read in place:
+they build a new Snapshot and swap it in whole. A handler reads
+`store.snapshot` once and gets a consistent view without taking a lock.
+
+The version and ETag only follow what the relay shows: the tally, labels,
+mapping and status. The time of the last switcher read changes on every
+poll and is left out, so a client polling /status gets 304 until a cut.
+"""
+
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+
+# Fields that make up the version and ETag, everything but last_update
+VERSIONED = ('program', 'preview', 'status', 'mapping')
+
+def freeze(source):
+    """A read-only copy of a source dict, or None"""
+    return None if source is None else MappingProxyType(dict(source))
+
+class Snapshot:
+    """One consistent, read-only view of the relay state"""
+    
+    __slots__ = ('version', 'program', 'preview', 'status', 'last_update', 'mapping', 'digest', '_json')
+    
+    def __init__(self, version=0, program=(), preview=None, status='Not Connected', last_update=None, mapping=None,
+                 digest=None):
+        """
+        Initialize the Snapshot
+        
+        Args:
+            version: Version number, one higher for every change to the versioned fields
+            program: Sources on program, as dicts with 'source' and 'label' keys
+            preview: Source on preview, or None
+            status: Connection status shown to the user
+            last_update: Time of the last successful switcher read, as text (not versioned)
+            mapping: Camera-to-XCU mapping
+            digest: Hash of the versioned fields, when it is already known
+        """
+        set_slot = object.__setattr__
+        set_slot(self, 'version', version)
+        set_slot(self, 'program', tuple(freeze(source) for source in program))
+        set_slot(self, 'preview', freeze(preview))
+        set_slot(self, 'status', status)
+        set_slot(self, 'last_update', last_update)
+        set_slot(self, 'mapping', MappingProxyType(dict(mapping or {})))
+        set_slot(self, 'digest', digest or self._digest())
+        set_slot(self, '_json', None)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is read-only, publish a new one instead")
+    
+    def _digest(self):
+        content = {
+            'program': [dict(source) for source in self.program],
+            'preview': dict(self.preview) if self.preview is not None else None,
+            'status': self.status,
+            'mapping': dict(self.mapping)
+        }
+        encoded = json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+    
+    def replace(self, **changes):
+        """
+        A new snapshot with some fields changed.
+        
+        It gets the next version number only if a versioned field changed:
+        a new last_update alone keeps the version and ETag.
+        
+        Returns:
+            Snapshot: The new snapshot
+        """
+        fields = {
+            'program': self.program,
+            'preview': self.preview,
+            'status': self.status,
+            'last_update': self.last_update,
+            'mapping': self.mapping
+        }
+        fields.update(changes)
+        if not any(name in changes for name in VERSIONED):
+            return Snapshot(self.version, digest=self.digest, **fields)
+        updated = Snapshot(self.version + 1, **fields)
+        if updated.digest == self.digest:
+            return Snapshot(self.version, digest=self.digest, **fields)
+        return updated
+    
+    @property
+    def etag(self):
+        """
+        Entity tag of the versioned fields, without the quotes.
+        
+        It is a hash of the content rather than the version number, so it
+        stays valid across restarts. Send it as a weak ETag: last_update in
+        the body can differ between two snapshots with the same tag.
+        """
+        return self.digest
+    
+    def to_dict(self):
+        """
+        The /status view in a JSON friendly form.
+        
+        Returns:
+            dict: program, preview, last_update, status and version
+        """
+        return {
+            'program': [dict(source) for source in self.program],
+            'preview': dict(self.preview) if self.preview is not None else None,
+            'last_update': self.last_update,
+            'status': self.status,
+            'version': self.version
+        }
+    
+    def to_json(self):
+        """The /status view as JSON, encoded once per snapshot"""
+        if self._json is None:
+            object.__setattr__(self, '_json', json.dumps(self.to_dict()))
+        return self._json
+
+class StateStore:
+    """
+    Holds the current Snapshot.
+    
+    Readers take `snapshot` with no locking. Writers are serialised, and a
+    write that changes nothing keeps the current snapshot.
+    """
+    
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot or Snapshot()
+        self.lock = threading.Lock()
+    
+    def update(self, **changes):
+        """
+        Publish a snapshot with some fields changed.
+        
+        Args:
+            **changes: Snapshot fields to change
+        
+        Returns:
+            Snapshot: The current snapshot after the update
+        """
+        with self.lock:
+            current = self.snapshot
+            updated = current.replace(**changes)
+            if all(getattr(updated, name) == getattr(current, name) for name in changes):
+                return current
+            self.snapshot = updated
+            return updated
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header matches an entity tag.
+    
+    Args:
+        if_none_match: Header value, or None
+        etag: Entity tag without the quotes
+    
+    Returns:
+        bool: True if the client already has this version
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate.strip('"') == etag:
+            return True
+    return False
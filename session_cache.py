@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+SessionCache - XCU name to gateway session ID lookups
+
+Session IDs come from three places: the device announcements the gateway
+sends while the relay runs, the hand-maintained XCU_SESSION_IDS table, and
+the announcements saved by earlier runs, in that order. An ID announced
+now is what the gateway has, so it wins; an ID saved by an earlier run may
+be stale, so it is only used for an XCU with no configured ID. Announced
+IDs are replaced or dropped as soon as the gateway reports that a
+basestation has rebooted or gone away.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger('session_cache')
+
+class SessionCache:
+    """Thread-safe XCU to session ID table with optional persistence"""
+    
+    def __init__(self, static=None, path=None):
+        """
+        Initialize the SessionCache
+        
+        Args:
+            static: Dict of configured XCU session IDs, used when nothing has been announced
+            path: JSON file to persist discovered session IDs in, one per gateway
+                (None to keep them in memory)
+        """
+        self.static = static if static is not None else {}
+        self.path = path
+        self.discovered = {}  # Announced since the relay started, format: {'XCU-08': 'PH3XQD'}
+        self.saved = {}  # Announced in earlier runs and not configured, same format
+        self.gone = set()  # Session IDs the gateway has reported gone, until they are announced again
+        self.lock = threading.Lock()
+        
+        # Lookup counters
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.invalidated = 0
+        
+        self.load()
+    
+    def load(self):
+        """Read the session IDs earlier runs discovered, skipping XCUs that have a configured one"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading session IDs from {self.path}: {e}")
+            return
+        with self.lock:
+            self.saved = {str(k): str(v) for k, v in saved.items() if str(k) not in self.static}
+        logger.info(f"Loaded {len(self.saved)} session IDs from {self.path}")
+    
+    def _save(self):
+        """Write the discovered session IDs to disk, atomically (call with the lock held)"""
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(dict(self.saved, **self.discovered), f, indent=4)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving session IDs to {self.path}: {e}")
+    
+    def get(self, xcu, default=None):
+        """
+        Session ID for an XCU.
+        
+        Returns:
+            str: The session ID announced since the relay started, else the configured one,
+                else the one an earlier run saved, else default
+        """
+        session_id = self.discovered.get(xcu) or self.static.get(xcu) or self.saved.get(xcu)
+        if session_id is None or session_id in self.gone:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return session_id
+    
+    def __contains__(self, xcu):
+        return xcu in self.discovered or xcu in self.static or xcu in self.saved
+    
+    def learn(self, xcu, session_id):
+        """
+        Record a session ID announced by the gateway.
+        
+        A different ID for a known XCU means the basestation rebooted, so the
+        old one is replaced. Any other XCU still holding this ID is dropped.
+        
+        Returns:
+            bool: True if the table changed
+        """
+        with self.lock:
+            if self.discovered.get(xcu) == session_id:
+                return False
+            if xcu in self.discovered:
+                self.invalidated += 1
+                logger.info(f"{xcu} session changed from {self.discovered[xcu]} to {session_id}")
+            else:
+                logger.info(f"Discovered {xcu} with session {session_id}")
+            for table in (self.discovered, self.saved):
+                for other in [k for k, v in table.items() if v == session_id and k != xcu]:
+                    del table[other]
+            self.saved.pop(xcu, None)
+            self.discovered[xcu] = session_id
+            self.gone.discard(session_id)
+            self.learned += 1
+            self._save()
+            return True
+    
+    def forget(self, xcu=None, session_id=None):
+        """
+        Drop a session that the gateway reports is gone.
+        
+        Args:
+            xcu: XCU name to drop
+            session_id: Session ID to drop, whichever XCU holds it
+        
+        Returns:
+            bool: True if the table changed
+        """
+        with self.lock:
+            # Only the announced session and the discovered one are known to be dead. A
+            # configured ID only goes with them if it is the one announced, and comes back
+            # as soon as the gateway announces it again
+            dead = {session_id, self.discovered.get(xcu), self.saved.get(xcu)} - {None}
+            changed = bool(dead - self.gone)
+            self.gone |= dead
+            
+            gone = []
+            for table in (self.discovered, self.saved):
+                for key in [k for k, v in table.items() if k == xcu or v in dead]:
+                    logger.info(f"{key} session {table[key]} is gone")
+                    del table[key]
+                    gone.append(key)
+            if gone:
+                self._save()
+            if changed or gone:
+                self.invalidated += 1
+            return changed or bool(gone)
+    
+    def stats(self):
+        """Lookup counters in a JSON friendly form"""
+        return {
+            'configured': len(self.static),
+            'discovered': len(self.discovered),
+            'saved': len(self.saved),
+            'hits': self.hits,
+            'misses': self.misses,
+            'learned': self.learned,
+            'invalidated': self.invalidated
+        }
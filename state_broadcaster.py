@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+StateBroadcaster - fans the relay state out to every web client
+"""
+
+import json
+import threading
+
+class StateBroadcaster:
+    """
+    Holds the latest state message and wakes every listener when it changes.
+    
+    There is one broadcaster for all clients: each published state is
+    encoded once, and listeners always get the newest message rather than
+    a backlog of stale ones.
+    """
+    
+    def __init__(self, heartbeat=15):
+        """
+        Initialize the StateBroadcaster
+        
+        Args:
+            heartbeat: Seconds of silence before listeners get a heartbeat with the last update time
+        """
+        self.heartbeat = heartbeat
+        self.condition = threading.Condition()
+        self.version = 0
+        self.message = None
+        self.key = None
+        self.last_update = None
+        self.listeners = 0
+        self.callbacks = []
+    
+    def add_callback(self, callback):
+        """
+        Call a function on every published change, for listeners that can't block on a thread.
+        
+        Args:
+            callback: Callable taking no arguments, run on the publishing thread
+        """
+        self.callbacks.append(callback)
+    
+    def publish(self, state, key=None):
+        """
+        Publish a new state if it differs from the last one.
+        
+        Args:
+            state: JSON serialisable state
+            key: Value used to decide whether the state changed (defaults to the state itself)
+        
+        Returns:
+            bool: True if listeners were woken
+        """
+        key = json.dumps(state if key is None else key, sort_keys=True)
+        with self.condition:
+            if key == self.key:
+                return False
+            self.key = key
+            self.message = json.dumps(state)
+            self.version += 1
+            self.condition.notify_all()
+        for callback in self.callbacks:
+            callback()
+        return True
+    
+    def touch(self, last_update):
+        """
+        Record the time of the last switcher read without waking anyone.
+        
+        It changes on every poll, so it is not a change worth pushing; the
+        heartbeats carry it instead.
+        """
+        self.last_update = last_update
+    
+    def heartbeat_frame(self):
+        """Keep-alive event carrying the time of the last switcher read"""
+        return f"event: heartbeat\ndata: {json.dumps({'last_update': self.last_update})}\n\n"
+    
+    def latest(self):
+        """
+        The newest published message.
+        
+        Returns:
+            tuple: (version, message)
+        """
+        with self.condition:
+            return self.version, self.message
+    
+    def listen(self):
+        """
+        Yield server-sent event frames for as long as the client stays connected.
+        
+        The current state is sent straight away, then every change after it.
+        """
+        with self.condition:
+            self.listeners += 1
+        try:
+            # Open the stream straight away and ask the browser to reconnect quickly if it drops
+            yield "retry: 1000\n\n"
+            
+            seen = 0
+            while True:
+                with self.condition:
+                    if self.version == seen:
+                        self.condition.wait(self.heartbeat)
+                    version, message = self.version, self.message
+                
+                if version == seen or message is None:
+                    yield self.heartbeat_frame()
+                    continue
+                
+                seen = version
+                yield f"id: {version}\ndata: {message}\n\n"
+        finally:
+            with self.condition:
+                self.listeners -= 1
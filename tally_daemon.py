@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+TallyDaemon - keeps a gateway connection open for command line tally changes
+
+`gv_tally_control.py --serve` runs one. Every later `gv_tally_control.py
+--xcu ... --red on` hands its command to the daemon over a Unix domain
+socket instead of connecting and authenticating with the gateway itself,
+and falls back to doing that when no daemon is running. A daemon that is
+running but doesn't answer in time is reported as an error rather than
+fallen back from, since it may still send the command.
+
+Scripts can also talk to the socket directly, one command per line:
+
+    xcu=XCU-08 red=on green=off
+    xcu=XCU-08 session=PH3XQD red=off
+    ping
+
+Each line is answered with `OK` or `ERR <reason>`. A command may name the
+gateway it is meant for (`gateway=10.0.0.5:8080`); a daemon serving a
+different gateway answers `WRONG-GATEWAY <ip:port>` without sending it.
+"""
+
+import logging
+import os
+import socket
+import tempfile
+import threading
+
+logger = logging.getLogger('tally_daemon')
+
+# Where the daemon listens unless told otherwise
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'gv_tally_control.sock')
+
+LAMP_STATES = {'on': True, 'off': False}
+
+# Seconds to wait for the daemon's reply, which comes after the gateway's ack
+# (and after a reconnect, if the gateway dropped the link)
+FORWARD_TIMEOUT = 10
+
+def format_command(xcu, lamps, session_id=None, gateway=None):
+    """
+    Encode a tally change as one daemon command line.
+    
+    Args:
+        xcu: XCU device name
+        lamps: Dict of tally type to True/False
+        session_id: Override session ID, or None
+        gateway: 'ip:port' of the gateway the command is meant for, or None for any
+    
+    Returns:
+        str: The command line, including the newline
+    """
+    fields = [f"xcu={xcu}"]
+    if session_id:
+        fields.append(f"session={session_id}")
+    if gateway:
+        fields.append(f"gateway={gateway}")
+    fields.extend(f"{tally_type}={'on' if on else 'off'}" for tally_type, on in lamps.items())
+    return ' '.join(fields) + '\n'
+
+def parse_command(line):
+    """
+    Decode a daemon command line.
+    
+    Returns:
+        tuple: (xcu, lamps, session_id, gateway)
+    
+    Raises:
+        ValueError: If the line is not a valid command
+    """
+    xcu = session_id = gateway = None
+    lamps = {}
+    for field in line.split():
+        key, sep, value = field.partition('=')
+        if not sep or not value:
+            raise ValueError(f"expected key=value, got {field!r}")
+        if key == 'xcu':
+            xcu = value
+        elif key == 'session':
+            session_id = value
+        elif key == 'gateway':
+            gateway = value
+        elif value.lower() in LAMP_STATES:
+            lamps[key] = LAMP_STATES[value.lower()]
+        else:
+            raise ValueError(f"{key} must be on or off, got {value!r}")
+    if not xcu and not session_id:
+        raise ValueError("xcu or session is required")
+    if not lamps:
+        raise ValueError("no tally changes")
+    return xcu or 'Custom', lamps, session_id, gateway
+
+def forward(line, path=DEFAULT_SOCKET, timeout=FORWARD_TIMEOUT):
+    """
+    Send a command line to a running daemon.
+    
+    Args:
+        line: Command line from format_command
+        path: Daemon socket path
+        timeout: Seconds to wait for the daemon's reply, longer than it takes
+            the daemon to reach the gateway and wait for the ack
+    
+    Returns:
+        str: The daemon's reply (`ERR <reason>` if it didn't answer), or None if
+            no daemon for this gateway is running and the command was not sent
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            try:
+                s.connect(path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Left behind by a daemon that has stopped
+                return None
+            s.sendall(line.encode('utf-8'))
+            reply = s.makefile('rb').readline().decode('utf-8').strip()
+    except socket.timeout:
+        return f"ERR no reply from the tally daemon within {timeout} s"
+    except OSError as e:
+        return f"ERR tally daemon: {e}"
+    if not reply:
+        return "ERR the tally daemon closed the connection without answering"
+    if reply.startswith('WRONG-GATEWAY'):
+        return None
+    return reply
+
+class TallyDaemon:
+    """Serves tally commands from a Unix domain socket through one GatewayClient"""
+    
+    def __init__(self, client, path=DEFAULT_SOCKET):
+        """
+        Initialize the TallyDaemon
+        
+        Args:
+            client: GatewayClient to send every command through
+            path: Unix domain socket path to listen on
+        """
+        self.client = client
+        self.path = path
+        self.gateway = f"{client.ip}:{client.port}"
+        self.sock = None
+        self.running = False
+        
+        # Counters
+        self.connections = 0
+        self.commands = 0
+        self.errors = 0
+    
+    def start(self):
+        """
+        Listen on the socket and serve clients in a background thread.
+        
+        Raises:
+            OSError: If another daemon is already listening on the socket
+        """
+        if os.path.exists(self.path):
+            # Left behind by a daemon that didn't shut down cleanly, unless one is still there
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise OSError(f"A tally daemon is already listening on {self.path}")
+            finally:
+                probe.close()
+        
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self.sock.listen(16)
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        logger.info(f"Serving tally commands for {self.gateway} on {self.path}")
+        return self
+    
+    def stop(self):
+        """Stop listening and remove the socket"""
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+    
+    def _accept(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+    
+    def _serve(self, conn):
+        """Answer every command line on one connection until the client hangs up"""
+        with conn:
+            reader = conn.makefile('rb')
+            for raw in reader:
+                line = raw.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                try:
+                    conn.sendall((self.handle(line) + '\n').encode('utf-8'))
+                except OSError:
+                    return
+    
+    def handle(self, line):
+        """
+        Run one command line.
+        
+        Returns:
+            str: The reply line, without the newline
+        """
+        if line == 'ping':
+            return 'OK'
+        try:
+            xcu, lamps, session_id, gateway = parse_command(line)
+        except ValueError as e:
+            self.errors += 1
+            return f"ERR {e}"
+        if gateway and gateway != self.gateway:
+            return f"WRONG-GATEWAY {self.gateway}"
+        
+        self.commands += 1
+        try:
+            if self.client.set_lamps(xcu, lamps, session_id=session_id):
+                return 'OK'
+        except Exception as e:
+            logger.error(f"Error sending tally command: {e}")
+        self.errors += 1
+        return f"ERR {xcu} not updated, see the daemon log"
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+SendDispatcher - delivers tally commands off the poll loop
+
+Commands are split into lanes, one per gateway, each with its own pending
+set, worker thread and authenticated gateway connection, so everything
+pending for a gateway goes out as one write. A gateway that stops
+answering only backs up its own lane. If the gateway rejects a write,
+each XCU in it is retried on its own: the others get through, and an XCU
+whose commands keep failing is written separately from then on until its
+commands are delivered or their deadline passes.
+
+A lane only keeps the latest desired state per (XCU, lamp), so a burst of
+cuts collapses into the minimal set of writes.
+"""
+
+import logging
+import threading
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger('tally_dispatch')
+
+# Latency metrics, per XCU
+GATEWAY_WRITE_SECONDS = REGISTRY.histogram(
+    'tally_gateway_write_seconds', 'Time for the gateway to accept a tally write', ['xcu'])
+QUEUE_TO_ACK_SECONDS = REGISTRY.histogram(
+    'tally_queue_to_ack_seconds', 'Time from a tally command being queued to the gateway ack', ['xcu'])
+CUT_TO_ACK_SECONDS = REGISTRY.histogram(
+    'tally_cut_to_ack_seconds', 'Time from the Vectar fetch that saw a change to the gateway ack', ['xcu'])
+COMMANDS_TOTAL = REGISTRY.counter(
+    'tally_commands_total', 'Tally commands by outcome', ['xcu', 'result'])
+
+class Lane:
+    """Pending states, worker and gateway connection for one group of XCUs"""
+    
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.condition = threading.Condition()
+        self.pending = {}  # Format: {('XCU-01', 'red'): (state, enqueued, deadline, origin)}
+        self.acked = {}  # Format: {('XCU-01', 'red'): True}, last state the gateway accepted
+        self.inflight = {}  # Format: {('XCU-01', 'red'): True}, states being written right now
+        self.xcus = set()
+        self.suspect = set()  # XCUs whose commands the gateway rejected, written on their own
+        self.last_connect = 0
+        self.thread = None
+        self.sent = 0
+        self.failed_attempts = 0
+        self.expired = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.reasserted = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+    
+    def put(self, xcu, tally_type, state, enqueued, deadline, origin):
+        """Set the desired state of a lamp, replacing any state still waiting to be sent"""
+        key = (xcu, tally_type)
+        with self.condition:
+            if key in self.pending:
+                self.coalesced += 1
+                COMMANDS_TOTAL.inc(xcu=xcu, result='coalesced')
+                # Back to what the lamp shows, or will once the write in flight lands, so
+                # neither command needs sending
+                if self.inflight.get(key, self.acked.get(key)) == state:
+                    del self.pending[key]
+                    self.coalesced += 1
+                    COMMANDS_TOTAL.inc(xcu=xcu, result='coalesced')
+                    return
+                # Keep the original enqueue time so latency covers the whole wait
+                enqueued = self.pending[key][1]
+            self.pending[key] = (state, enqueued, deadline, origin)
+            self.condition.notify()
+    
+    def put_background(self, xcu, tally_type, state, enqueued, deadline):
+        """Re-assert the state of a lamp, unless a live state is already waiting to be sent"""
+        key = (xcu, tally_type)
+        with self.condition:
+            if key in self.pending:
+                return
+            self.reasserted += 1
+            COMMANDS_TOTAL.inc(xcu=xcu, result='reasserted')
+            self.pending[key] = (state, enqueued, deadline, None)
+            self.condition.notify()
+    
+    def take(self, timeout):
+        """Wait for pending states and take them all as one batch"""
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            batch, self.pending = self.pending, {}
+            self.inflight = {key: item[0] for key, item in batch.items()}
+            return batch
+    
+    def split(self, batch):
+        """A batch as one write for the healthy XCUs, then one write per suspect XCU"""
+        if not self.suspect:
+            return [batch]
+        healthy = {}
+        suspects = {}
+        for key, item in batch.items():
+            if key[0] in self.suspect:
+                suspects.setdefault(key[0], {})[key] = item
+            else:
+                healthy[key] = item
+        return ([healthy] if healthy else []) + list(suspects.values())
+    
+    def put_back(self, batch, now):
+        """Return a failed batch, unless newer states have superseded it or it has expired"""
+        with self.condition:
+            for key, item in batch.items():
+                if key in self.pending:
+                    continue
+                if item[2] < now:
+                    self.expired += 1
+                    COMMANDS_TOTAL.inc(xcu=key[0], result='expired')
+                    continue
+                self.pending[key] = item
+
+class SendDispatcher:
+    """
+    Sends tally commands through per-lane worker threads.
+    
+    Each command carries a deadline: a worker keeps retrying failed commands
+    in the background until they are delivered, superseded by a newer state
+    for the same lamp, or the deadline passes.
+    """
+    
+    def __init__(self, client_factory, lane_key=None, deadline=5, retry_delay=0.5, reconnect_interval=5):
+        """
+        Initialize the SendDispatcher
+        
+        Args:
+            client_factory: Callable taking a lane name and returning a GatewayClient
+            lane_key: Callable mapping an XCU to its lane name, normally its gateway
+                (default: one lane for every XCU)
+            deadline: Seconds a command may wait for delivery before it is abandoned
+            retry_delay: Seconds between delivery attempts for a failing lane
+            reconnect_interval: Seconds between an idle lane's attempts to reconnect to its gateway
+        """
+        self.client_factory = client_factory
+        self.lane_key = lane_key or (lambda xcu: 'gateway')
+        self.deadline = deadline
+        self.retry_delay = retry_delay
+        self.reconnect_interval = reconnect_interval
+        self.lanes = {}
+        self.lock = threading.Lock()
+        self.running = True
+        self.last_live = 0
+        self.reset_callbacks = []
+        self.ack_callbacks = []
+    
+    def add_reset_callback(self, callback):
+        """
+        Register a function to be called when a lane's lamps may have been reset.
+        
+        That is whenever its gateway client (re)connects, or learns a new session
+        for a basestation that has rebooted.
+        
+        Args:
+            callback: Function taking the lane name and a list of XCUs (None for every
+                XCU in the lane), called from the lane's worker thread
+        """
+        self.reset_callbacks.append(callback)
+    
+    def add_ack_callback(self, callback):
+        """
+        Register a function to be called with every batch the gateway accepts.
+        
+        Args:
+            callback: Function taking a list of (xcu, tally_type, state) tuples, called
+                from the lane's worker thread
+        """
+        self.ack_callbacks.append(callback)
+    
+    def submit(self, commands, origin=None, background=False):
+        """
+        Queue tally commands for delivery and return immediately.
+        
+        Args:
+            commands: List of (xcu, tally_type, state) tuples
+            origin: time.monotonic() of the switcher fetch that caused them, for cut-to-ack timing
+            background: Re-assertions of states already sent, which never replace a live
+                command waiting for the same lamp
+        """
+        now = time.monotonic()
+        if not background:
+            self.last_live = now
+        for xcu, tally_type, state in commands:
+            lane = self._lane(self.lane_key(xcu))
+            lane.xcus.add(xcu)
+            if background:
+                lane.put_background(xcu, tally_type, state, now, now + self.deadline)
+            else:
+                lane.put(xcu, tally_type, state, now, now + self.deadline, origin)
+    
+    def open(self, names):
+        """
+        Start lanes before anything is sent through them, e.g. one per configured gateway.
+        
+        An idle lane keeps its gateway connection up and reads the device
+        announcements on it, so XCUs that only that gateway has are discovered
+        and routed to it.
+        """
+        for name in names:
+            self._lane(name)
+    
+    def idle_time(self):
+        """Seconds since live commands were last submitted"""
+        return time.monotonic() - self.last_live
+    
+    def lane_xcus(self, name):
+        """XCUs that have been sent through a lane"""
+        lane = self.lanes.get(name)
+        return set(lane.xcus) if lane else set()
+    
+    def _lane(self, name):
+        """Get or create the lane and its worker"""
+        with self.lock:
+            lane = self.lanes.get(name)
+            if lane is None:
+                lane = Lane(name, self.client_factory(name))
+                if hasattr(lane.client, 'on_reset'):
+                    lane.client.on_reset = lambda xcus, name=name: self._reset(name, xcus)
+                lane.thread = threading.Thread(target=self._run_lane, args=(lane,), daemon=True)
+                self.lanes[name] = lane
+                lane.thread.start()
+            return lane
+    
+    def _reset(self, name, xcus):
+        for callback in self.reset_callbacks:
+            try:
+                callback(name, xcus)
+            except Exception as e:
+                logger.error(f"Error in reset callback for {name}: {e}")
+    
+    def _run_lane(self, lane):
+        """Worker loop: deliver everything pending in one write, retrying failures"""
+        while self.running:
+            batch = lane.take(timeout=1)
+            if not batch:
+                self._idle(lane)
+                continue
+            
+            failed = {}
+            for part in lane.split(batch):
+                failed.update(self._deliver(lane, part))
+            if not failed:
+                continue
+            
+            lane.failed_attempts += 1
+            for xcu, _ in failed:
+                COMMANDS_TOTAL.inc(xcu=xcu, result='failed')
+            with lane.condition:
+                for key in failed:
+                    lane.acked.pop(key, None)
+                    lane.inflight.pop(key, None)
+            lane.put_back(failed, time.monotonic() + self.retry_delay)
+            time.sleep(self.retry_delay)
+    
+    def _idle(self, lane):
+        """Take in the announcements waiting on an idle lane's connection, reconnecting now and then"""
+        sync = getattr(lane.client, 'sync_sessions', None)
+        if sync is None:
+            return
+        now = time.monotonic()
+        if not lane.client.connected:
+            if now - lane.last_connect < self.reconnect_interval:
+                return
+            lane.last_connect = now
+        try:
+            sync()
+        except Exception as e:
+            logger.error(f"Error reading announcements from {lane.name}: {e}")
+    
+    def _deliver(self, lane, batch):
+        """
+        Send a batch in one write, retrying each XCU on its own if the gateway rejects it.
+        
+        Returns:
+            dict: The part of the batch that failed and should be retried
+        """
+        commands = [(xcu, tally_type, item[0]) for (xcu, tally_type), item in batch.items()]
+        xcus = {key[0] for key in batch}
+        start = time.perf_counter()
+        try:
+            success, skipped = lane.client.set_tallies(commands)
+        except Exception as e:
+            logger.error(f"Exception sending tally commands to {lane.name}: {e}")
+            success, skipped = False, []
+        
+        now = time.monotonic()
+        write_time = time.perf_counter() - start
+        
+        if success and skipped:
+            # Never sent, for XCUs with no known session: what their lamps show is unknown.
+            # They are not retried, the reconciler re-asserts them once the XCU is announced
+            skipped_keys = {(xcu, tally_type) for xcu, tally_type, _ in skipped}
+            with lane.condition:
+                for key in skipped_keys:
+                    lane.acked.pop(key, None)
+                    lane.inflight.pop(key, None)
+            lane.skipped += len(skipped_keys)
+            for xcu, _ in skipped_keys:
+                COMMANDS_TOTAL.inc(xcu=xcu, result='skipped')
+            batch = {key: item for key, item in batch.items() if key not in skipped_keys}
+            commands = [command for command in commands if (command[0], command[1]) not in skipped_keys]
+            xcus = {key[0] for key in batch}
+            if not batch:
+                return {}
+        
+        for xcu in xcus:
+            GATEWAY_WRITE_SECONDS.observe(write_time, xcu=xcu)
+        
+        if success:
+            for (xcu, _), item in batch.items():
+                COMMANDS_TOTAL.inc(xcu=xcu, result='sent')
+                QUEUE_TO_ACK_SECONDS.observe(now - item[1], xcu=xcu)
+                if item[3] is not None:
+                    CUT_TO_ACK_SECONDS.observe(now - item[3], xcu=xcu)
+            latency = now - min(item[1] for item in batch.values())
+            with lane.condition:
+                for key, item in batch.items():
+                    lane.acked[key] = item[0]
+                    lane.inflight.pop(key, None)
+            lane.suspect -= xcus
+            for callback in self.ack_callbacks:
+                try:
+                    callback(commands)
+                except Exception as e:
+                    logger.error(f"Error in ack callback for {lane.name}: {e}")
+            lane.sent += 1
+            lane.last_latency = latency
+            lane.max_latency = max(lane.max_latency, latency)
+            lane.total_latency += latency
+            logger.info(f"Committed {len(commands)} tally changes to {lane.name} in "
+                        f"{write_time * 1000:.1f} ms ({latency * 1000:.1f} ms after queueing)")
+            return {}
+        
+        # An unreachable gateway fails every XCU alike; a rejection may be down to one
+        # basestation (e.g. one whose session has gone), so find out which
+        if not getattr(lane.client, 'connected', False):
+            return batch
+        if len(xcus) == 1:
+            lane.suspect |= xcus
+            return batch
+        failed = {}
+        for xcu in sorted(xcus):
+            failed.update(self._deliver(lane, {key: item for key, item in batch.items() if key[0] == xcu}))
+        return failed
+    
+    def stop(self):
+        """Stop the workers and close their gateway connections"""
+        self.running = False
+        for lane in list(self.lanes.values()):
+            with lane.condition:
+                lane.condition.notify_all()
+            lane.thread.join(timeout=5)
+            lane.client.close()
+    
+    def queue_depth(self):
+        """Total lamp states waiting across all lanes"""
+        return sum(len(lane.pending) for lane in list(self.lanes.values()))
+    
+    def coalesced(self):
+        """Total commands that were never sent because a newer state replaced them"""
+        return sum(lane.coalesced for lane in list(self.lanes.values()))
+    
+    def reasserted(self):
+        """Total background re-assertions queued"""
+        return sum(lane.reasserted for lane in list(self.lanes.values()))
+    
+    def stats(self):
+        """Queue depth, coalescing and latency per lane in a JSON friendly form"""
+        lanes = {}
+        for name, lane in list(self.lanes.items()):
+            lanes[name] = {
+                'queue_depth': len(lane.pending),
+                'sent': lane.sent,
+                'failed_attempts': lane.failed_attempts,
+                'expired': lane.expired,
+                'skipped': lane.skipped,
+                'coalesced': lane.coalesced,
+                'reasserted': lane.reasserted,
+                'suspect': sorted(lane.suspect),
+                'last_latency_ms': round(lane.last_latency * 1000, 2),
+                'max_latency_ms': round(lane.max_latency * 1000, 2),
+                'mean_latency_ms': round(lane.total_latency / lane.sent * 1000, 2) if lane.sent else 0
+            }
+        return {'queue_depth': self.queue_depth(), 'coalesced': self.coalesced(),
+                'reasserted': self.reasserted(), 'lanes': lanes}
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+TallyIndex - incremental program/preview to lamp diffing
+
+The camera mapping is indexed once, from each source to the lamp slots of
+the XCUs it feeds. Each update then only visits the sources that entered
+or left program or preview, so a cut costs the same with 8 cameras as with
+1000.
+
+An XCU's lamps are one integer bitfield (RED | GREEN | YELLOW), worked out
+from its program/preview state through a LampTable, and a change is the
+XOR of the old and new masks.
+"""
+
+# Lamp bits, in the order their commands are sent
+RED = 1
+GREEN = 2
+YELLOW = 4
+LAMPS = (('red', RED), ('green', GREEN), ('yellow', YELLOW))
+LAMP_BITS = dict(LAMPS)
+
+# Tally bits: what an XCU's sources are on
+PROGRAM = 1
+PREVIEW = 2
+
+def lamp_mask(names):
+    """
+    Bitfield of some lamp names.
+    
+    Raises:
+        ValueError: If a name is not a lamp
+    """
+    mask = 0
+    for name in names:
+        if name not in LAMP_BITS:
+            raise ValueError(f"Unknown lamp {name!r}, must be one of: {', '.join(LAMP_BITS)}")
+        mask |= LAMP_BITS[name]
+    return mask
+
+# (tally_type, state) changes from every bitfield to every other, TRANSITIONS[old][new]
+TRANSITIONS = tuple(
+    tuple(tuple((name, bool(new & bit)) for name, bit in LAMPS if (old ^ new) & bit) for new in range(8))
+    for old in range(8)
+)
+
+def mask_commands(xcu, old, new):
+    """(xcu, tally_type, state) commands taking an XCU's lamps from one bitfield to another"""
+    return [(xcu, tally_type, state) for tally_type, state in TRANSITIONS[old][new]]
+
+class LampTable:
+    """
+    Which lamps an XCU shows for each program/preview state.
+    
+    The default lights red on program and green on preview, both when a
+    camera is on both. The 'program-priority' table only lights red then,
+    so a cut from preview to program is one red-on/green-off change.
+    """
+    
+    def __init__(self, program=RED, preview=GREEN, both=RED | GREEN):
+        """
+        Initialize the LampTable
+        
+        Args:
+            program: Lamp bits while on program only
+            preview: Lamp bits while on preview only
+            both: Lamp bits while on program and preview
+        """
+        # Indexed by the tally bits
+        self.table = (0, program, preview, both)
+        self.used = program | preview | both
+        self.names = tuple(name for name, bit in LAMPS if self.used & bit)
+        
+        # Lamp changes from every tally state to every other, steps[old][new]
+        self.steps = tuple(tuple(TRANSITIONS[old][new] for new in self.table) for old in self.table)
+    
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a table from its topology file entry.
+        
+        Args:
+            config: Name of a preset in LAMP_TABLES, or a dict with 'program', 'preview'
+                and 'both' lists of lamp names ('both' defaults to program and preview's lamps)
+        
+        Raises:
+            ValueError: If the entry is invalid
+        """
+        if isinstance(config, str):
+            if config not in LAMP_TABLES:
+                raise ValueError(f"Unknown lamp table {config!r}, must be one of: {', '.join(LAMP_TABLES)}")
+            return LAMP_TABLES[config]
+        program = lamp_mask(config.get('program', ['red']))
+        preview = lamp_mask(config.get('preview', ['green']))
+        return cls(program, preview, lamp_mask(config['both']) if 'both' in config else program | preview)
+    
+    def lamps_of(self, mask):
+        """A bitfield in a JSON friendly form, e.g. {'red': True, 'green': False}"""
+        return {name: bool(mask & LAMP_BITS[name]) for name in self.names}
+
+# Preset tables for the topology file
+LAMP_TABLES = {
+    'independent': LampTable(),
+    'program-priority': LampTable(both=RED),
+}
+
+class LampSlot:
+    """Tally bits of one XCU, and how many of its sources are on program/preview"""
+    
+    __slots__ = ('xcu', 'tally', 'program_refs', 'preview_refs')
+    
+    def __init__(self, xcu):
+        self.xcu = xcu
+        self.tally = 0
+        self.program_refs = 0
+        self.preview_refs = 0
+
+class TallyIndex:
+    """
+    Tracks which lamps are lit and works out the commands for each change.
+    
+    An XCU is on program while any source mapped to it is, and on preview
+    while any is; the lamp table decides what it shows for that.
+    """
+    
+    def __init__(self, mapping, table=None):
+        """
+        Initialize the TallyIndex
+        
+        Args:
+            mapping: Dict of source name to XCU name, or to a list of XCU names
+            table: LampTable (default: red on program, green on preview)
+        """
+        self.table = table or LAMP_TABLES['independent']
+        self._build(mapping)
+        
+        self.program = frozenset()
+        self.preview = frozenset()
+        
+        # The last program/preview given to update(), for remap()
+        self.on_air = ((), None)
+    
+    def _build(self, mapping):
+        """Index the mapping, with every lamp off"""
+        self.slots = {}  # Format: {'XCU-01': LampSlot}
+        self.sources = {}  # Format: {'input1': (LampSlot, ...)}
+        for source, xcus in mapping.items():
+            if isinstance(xcus, str):
+                xcus = [xcus]
+            slots = []
+            for xcu in xcus:
+                slot = self.slots.get(xcu)
+                if slot is None:
+                    slot = self.slots[xcu] = LampSlot(xcu)
+                slots.append(slot)
+            self.sources[source] = tuple(slots)
+    
+    def _mapped(self, sources):
+        """The given source names that are in the mapping"""
+        return frozenset(filter(self.sources.__contains__, sources))
+    
+    def update(self, program_sources, preview_source):
+        """
+        Apply a new program/preview state.
+        
+        Args:
+            program_sources: List of source names on program
+            preview_source: Source name on preview, or None
+        
+        Returns:
+            list: (xcu, tally_type, state) commands for every lamp that changed
+        """
+        self.on_air = (program_sources, preview_source)
+        program = self._mapped(program_sources)
+        preview = self._mapped((preview_source,)) if preview_source else frozenset()
+        
+        # Only the sources that changed can change a lamp
+        touched = {}
+        for source in program - self.program:
+            for slot in self.sources[source]:
+                slot.program_refs += 1
+                touched[slot.xcu] = slot
+        for source in self.program - program:
+            for slot in self.sources[source]:
+                slot.program_refs -= 1
+                touched[slot.xcu] = slot
+        for source in preview - self.preview:
+            for slot in self.sources[source]:
+                slot.preview_refs += 1
+                touched[slot.xcu] = slot
+        for source in self.preview - preview:
+            for slot in self.sources[source]:
+                slot.preview_refs -= 1
+                touched[slot.xcu] = slot
+        self.program = program
+        self.preview = preview
+        
+        steps = self.table.steps
+        commands = []
+        for slot in touched.values():
+            tally = (slot.program_refs > 0) | (slot.preview_refs > 0) << 1
+            if tally != slot.tally:
+                xcu = slot.xcu
+                for tally_type, state in steps[slot.tally][tally]:
+                    commands.append((xcu, tally_type, state))
+                slot.tally = tally
+        return commands
+    
+    def remap(self, mapping):
+        """
+        Switch to a new mapping without forgetting which lamps are lit.
+        
+        Every XCU the new mapping still has keeps its lamp state, and the last
+        program/preview is applied through the new mapping straight away.
+        
+        Args:
+            mapping: Dict of source name to XCU name, or to a list of XCU names
+        
+        Returns:
+            list: (xcu, tally_type, state) commands for the lamps the new mapping changes,
+                including switching off the XCUs it no longer maps
+        """
+        previous = {xcu: slot.tally for xcu, slot in self.slots.items()}
+        self._build(mapping)
+        
+        program_sources, preview_source = self.on_air
+        self.program = self._mapped(program_sources)
+        self.preview = self._mapped((preview_source,)) if preview_source else frozenset()
+        for source in self.program:
+            for slot in self.sources[source]:
+                slot.program_refs += 1
+        for source in self.preview:
+            for slot in self.sources[source]:
+                slot.preview_refs += 1
+        
+        steps = self.table.steps
+        commands = []
+        for xcu, slot in self.slots.items():
+            slot.tally = (slot.program_refs > 0) | (slot.preview_refs > 0) << 1
+            for tally_type, state in steps[previous.pop(xcu, 0)][slot.tally]:
+                commands.append((xcu, tally_type, state))
+        for xcu, tally in previous.items():
+            for tally_type, state in steps[tally][0]:
+                commands.append((xcu, tally_type, state))
+        return commands
+    
+    def masks(self):
+        """Current lamp bits, format: {'XCU-01': RED}"""
+        table = self.table.table
+        return {xcu: table[slot.tally] for xcu, slot in self.slots.items()}
+    
+    def states(self):
+        """
+        Current lamp states in a JSON friendly form.
+        
+        Returns:
+            dict: {'XCU-01': {'red': True, 'green': False}}
+        """
+        lamps_of = self.table.lamps_of
+        return {xcu: lamps_of(lamps) for xcu, lamps in self.masks().items()}
+
+class TallyMerge:
+    """
+    Combines the lamp states that several switchers ask for into one per XCU.
+    
+    Each switcher diffs its own program/preview through its own TallyIndex;
+    the merge keeps every switcher's lamp bits for the XCUs it has touched
+    and works out what the lamps should actually show.
+    
+    Policies:
+        any-program-wins: each lamp is on while any switcher lights it
+        priority: the first switcher (in priority order) that lights any of
+            the XCU's lamps decides all of them
+    """
+    
+    def __init__(self, switchers, policy='any-program-wins', table=None):
+        """
+        Initialize the TallyMerge
+        
+        Args:
+            switchers: Switcher names, highest priority first
+            policy: 'any-program-wins' or 'priority'
+            table: LampTable the switchers' indexes use, for states()
+        """
+        self.order = {name: i for i, name in enumerate(switchers)}
+        self.policy = policy
+        self.table = table or LAMP_TABLES['independent']
+        self.views = {}  # Format: {'XCU-01': [RED, 0, ...]}, lamp bits per switcher
+        self.lit = {}  # Format: {'XCU-01': RED}, what the lamps were last told
+    
+    def _merged(self, views):
+        if self.policy == 'priority':
+            for view in views:
+                if view:
+                    return view
+            return 0
+        merged = 0
+        for view in views:
+            merged |= view
+        return merged
+    
+    def apply(self, switcher, commands):
+        """
+        Merge one switcher's lamp changes.
+        
+        Args:
+            switcher: Name of the switcher the commands came from
+            commands: List of (xcu, tally_type, state) from that switcher's TallyIndex
+        
+        Returns:
+            list: (xcu, tally_type, state) commands for the lamps whose merged state changed
+        """
+        # A single switcher has nothing to merge with
+        if len(self.order) == 1:
+            return commands
+        
+        position = self.order[switcher]
+        touched = {}
+        for xcu, tally_type, state in commands:
+            views = self.views.get(xcu)
+            if views is None:
+                views = self.views[xcu] = [0] * len(self.order)
+            bit = LAMP_BITS[tally_type]
+            views[position] = views[position] | bit if state else views[position] & ~bit
+            touched[xcu] = views
+        
+        merged = []
+        for xcu, views in touched.items():
+            # Under the priority policy one lamp's change can flip the others, so diff the whole mask
+            lamps = self._merged(views)
+            lit = self.lit.get(xcu, 0)
+            if lamps != lit:
+                self.lit[xcu] = lamps
+                merged += mask_commands(xcu, lit, lamps)
+        return merged
+    
+    def states(self, xcus):
+        """
+        Merged lamp states of some XCUs in a JSON friendly form.
+        
+        Returns:
+            dict: {'XCU-01': {'red': True, 'green': False}}
+        """
+        lamps_of = self.table.lamps_of
+        return {xcu: lamps_of(self.lit.get(xcu, 0)) for xcu in xcus}
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Tally ingestion - gets tally state from the switcher into the relay
+
+The Vectar can push a notification over TCP whenever its state changes.
+When that channel is available the relay fetches the tally dictionary
+only when told something changed; otherwise it falls back to polling.
+Either way every fetched state goes to the same update callback.
+"""
+
+import logging
+import random
+import select
+import socket
+import threading
+import time
+
+logger = logging.getLogger('tally_ingest')
+
+# Vectar TCP notification channel
+DEFAULT_NOTIFY_PORT = 5951
+REGISTER_MESSAGE = '<register name="NTK_states"/>\n'
+
+class NotificationChannel:
+    """TCP connection to the switcher's change notification channel"""
+    
+    def __init__(self, host, port=DEFAULT_NOTIFY_PORT, timeout=2):
+        """
+        Initialize the NotificationChannel
+        
+        Args:
+            host: Switcher host name or IP
+            port: Notification port
+            timeout: Connect timeout in seconds
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+    
+    def connect(self):
+        """
+        Connect and register for state change notifications.
+        
+        Returns:
+            bool: True if connected, False otherwise
+        """
+        self.close()
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self.sock.sendall(REGISTER_MESSAGE.encode('utf-8'))
+        except OSError as e:
+            logger.info(f"Push notifications unavailable from {self.host}:{self.port}: {e}")
+            self.close()
+            return False
+        logger.info(f"Subscribed to push notifications from {self.host}:{self.port}")
+        return True
+    
+    def close(self):
+        """Close the notification socket if it is open"""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+    
+    def wait(self, timeout):
+        """
+        Wait for a change notification.
+        
+        Args:
+            timeout: Maximum time to wait in seconds
+        
+        Returns:
+            bool: True if a notification arrived, False on timeout
+        
+        Raises:
+            ConnectionError: If the switcher closed the channel
+        """
+        readable, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        if not readable:
+            return False
+        
+        # A single cut can produce several notifications, so drain them all
+        # and fetch once
+        while readable:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("Switcher closed the notification channel")
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        return True
+
+class PollScheduler:
+    """
+    Deadline-based tick scheduler.
+    
+    Ticks run at a fixed rate regardless of how long each fetch takes. When
+    the switcher errors the delay backs off exponentially with jitter, and
+    snaps back to the normal rate on the first successful tick.
+    """
+    
+    def __init__(self, interval=1, max_backoff=10, jitter=0.5):
+        """
+        Initialize the PollScheduler
+        
+        Args:
+            interval: Normal tick interval in seconds (down to 0.05)
+            max_backoff: Longest delay between ticks while failing, in seconds
+            jitter: Fraction of the backoff delay to randomise
+        """
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.failures = 0
+        self.deadline = None
+        
+        # Per-tick timing
+        self.ticks = 0
+        self.errors = 0
+        self.overruns = 0
+        self.last_duration = 0
+        self.last_lag = 0
+        self.max_duration = 0
+        self.last_delay = 0
+    
+    @property
+    def healthy(self):
+        return self.failures == 0
+    
+    def backoff(self):
+        """
+        Delay before the next tick while failing.
+        
+        Returns:
+            float: Delay in seconds
+        """
+        delay = min(self.max_backoff, self.interval * (2 ** self.failures))
+        return delay * (1 - self.jitter * random.random())
+    
+    def tick(self, fn):
+        """
+        Run one tick and work out when the next one is due.
+        
+        Args:
+            fn: Callable to run, raising on failure
+        
+        Returns:
+            float: Seconds to wait before the next tick
+        """
+        start = time.monotonic()
+        if self.deadline is None:
+            self.deadline = start
+        self.last_lag = max(0, start - self.deadline)
+        
+        try:
+            fn()
+            if self.failures:
+                logger.info(f"Switcher reachable again after {self.failures} failed attempts")
+            self.failures = 0
+        except Exception as e:
+            self.failures += 1
+            self.errors += 1
+            logger.error(f"Error ingesting tally state: {e}")
+        
+        now = time.monotonic()
+        self.ticks += 1
+        self.last_duration = now - start
+        self.max_duration = max(self.max_duration, self.last_duration)
+        
+        if self.healthy:
+            # Keep to the fixed cadence, compensating for how long the fetch took
+            self.deadline += self.interval
+            if self.deadline < now:
+                self.overruns += 1
+                self.deadline = now
+        else:
+            self.deadline = now + self.backoff()
+        
+        self.last_delay = self.deadline - now
+        return self.last_delay
+    
+    def stats(self):
+        """Per-tick timing in a JSON friendly form"""
+        return {
+            'interval': self.interval,
+            'ticks': self.ticks,
+            'errors': self.errors,
+            'consecutive_failures': self.failures,
+            'overruns': self.overruns,
+            'last_duration_ms': round(self.last_duration * 1000, 2),
+            'max_duration_ms': round(self.max_duration * 1000, 2),
+            'last_lag_ms': round(self.last_lag * 1000, 2),
+            'next_delay_ms': round(self.last_delay * 1000, 2)
+        }
+
+class TallyIngest:
+    """
+    Feeds switcher tally state to the relay, using push notifications when
+    available and falling back to polling when not.
+    """
+    
+    def __init__(self, fetch, on_update, notify_host=None, notify_port=DEFAULT_NOTIFY_PORT,
+                 poll_interval=1, safety_interval=5, push_retry=10, max_backoff=10, on_error=None,
+                 on_unchanged=None):
+        """
+        Initialize the TallyIngest
+        
+        Args:
+            fetch: Callable returning (program_sources, preview_source), or None if
+                nothing changed since the last fetch; raising on failure
+            on_update: Callable taking (program_sources, preview_source)
+            notify_host: Switcher host for push notifications (None to always poll)
+            notify_port: Switcher notification port
+            poll_interval: Polling interval in seconds when push is unavailable
+            safety_interval: Seconds without a notification before fetching anyway
+            push_retry: Seconds between attempts to re-establish push
+            max_backoff: Longest delay between fetches while the switcher is failing
+            on_error: Optional callable taking the exception when a fetch fails
+            on_unchanged: Optional callable run when a fetch finds nothing new
+        """
+        self.fetch = fetch
+        self.on_update = on_update
+        self.on_error = on_error
+        self.on_unchanged = on_unchanged
+        self.channel = NotificationChannel(notify_host, notify_port) if notify_host else None
+        self.scheduler = PollScheduler(poll_interval, max_backoff)
+        self.safety_interval = safety_interval
+        self.push_retry = push_retry
+        self.mode = 'poll'
+        self.running = False
+        self.thread = None
+        
+        # Push is retried on a helper thread, which sets push_ready and wakes the poll loop
+        self.wake = threading.Event()
+        self.push_ready = False
+        self.connector = None
+        self.push_attempts = 0
+    
+    def start(self):
+        """Run the ingestion loop in a background thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the ingestion loop"""
+        self.running = False
+        self.wake.set()
+        if self.channel:
+            self.channel.close()
+        if self.thread:
+            self.thread.join(timeout=5)
+    
+    def stats(self):
+        """Ingestion mode and per-tick timing"""
+        return dict(self.scheduler.stats(), mode=self.mode, push_attempts=self.push_attempts)
+    
+    def ingest(self):
+        """Fetch the current tally state once and hand it to the update callback"""
+        try:
+            result = self.fetch()
+        except Exception as e:
+            if self.on_error:
+                self.on_error(e)
+            raise
+        
+        # Nothing changed, so skip parsing and diffing entirely
+        if result is None:
+            if self.on_unchanged:
+                self.on_unchanged()
+            return
+        self.on_update(*result)
+    
+    def run(self):
+        """Ingestion loop: push when possible, poll otherwise"""
+        self.running = True
+        retry_at = time.monotonic()
+        while self.running:
+            if self.push_ready:
+                self.push_ready = False
+                self.mode = 'push'
+                self._run_push()
+                self.channel.close()
+                retry_at = time.monotonic() + self.push_retry
+            
+            self.mode = 'poll'
+            if self.channel and time.monotonic() >= retry_at and not self._connecting():
+                self._connect_push()
+                retry_at = time.monotonic() + self.push_retry
+            
+            # Poll on the scheduler's cadence, waking early once the push channel is up
+            delay = self.scheduler.tick(self.ingest)
+            self.wake.wait(delay)
+            self.wake.clear()
+    
+    def _connecting(self):
+        return self.connector is not None and self.connector.is_alive()
+    
+    def _connect_push(self):
+        """
+        Try to open the push channel on a helper thread.
+        
+        A firewalled notification port can hold the connect for its whole
+        timeout, which must not delay the polls the relay is falling back on.
+        """
+        def connect():
+            if not self.channel.connect():
+                return
+            if not self.running:
+                self.channel.close()
+                return
+            self.push_ready = True
+            self.wake.set()
+        
+        self.push_attempts += 1
+        self.connector = threading.Thread(target=connect, daemon=True)
+        self.connector.start()
+    
+    def _run_push(self):
+        """Fetch on every notification until the channel drops"""
+        # Catch up on anything that changed while we were not subscribed
+        delay = self.scheduler.tick(self.ingest)
+        while self.running:
+            try:
+                # Fetch on a notification, and also periodically in case one was missed.
+                # While the switcher is failing, retry on the backoff schedule instead.
+                self.channel.wait(self.safety_interval if self.scheduler.healthy else delay)
+            except (OSError, ValueError) as e:
+                if self.running:
+                    logger.warning(f"Push notification channel lost ({e}), falling back to polling")
+                return
+            
+            # Notifications are not paced, so restart the cadence from now
+            self.scheduler.deadline = None
+            delay = self.scheduler.tick(self.ingest)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+TallyJournal - append-only log of the lamp states the relay asked for and got
+
+Every lamp change the relay decides on (desired) and every one the gateway
+accepts (acked) is appended as a 4 byte record holding the XCU's whole
+lamp bitfield. When the log grows past a limit it is compacted to one
+desired and one acked record per XCU. On startup the log is replayed, so
+the relay knows which lamps it left lit and only has to send the
+corrections (WarmStart) instead of starting from all-off.
+
+Records are written straight to the file with os.write, so they survive
+the relay crashing; a torn record at the end of the file is dropped on
+replay.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+
+from tally_index import LAMPS, LAMP_BITS
+
+logger = logging.getLogger('tally_journal')
+
+MAGIC = b'TALLYJ1\n'
+
+# kind, value, XCU id: value is the name length for NAME records (name bytes follow),
+# else the lamp bitfield
+RECORD = struct.Struct('<BBH')
+NAME = 0
+DESIRED = 1
+ACKED = 2
+
+class TallyJournal:
+    """Desired and acknowledged lamp bitfields per XCU, logged to disk"""
+    
+    def __init__(self, path, compact_bytes=65536):
+        """
+        Initialize the TallyJournal
+        
+        Args:
+            path: Journal file, None to keep the states in memory only
+            compact_bytes: File size at which the log is compacted (replaying a full log of
+                64 KiB takes under 10 ms)
+        """
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.desired = {}  # Format: {'XCU-01': RED}
+        self.acked = {}  # Format: {'XCU-01': RED}
+        self.ids = {}  # Format: {'XCU-01': 0}
+        self.lock = threading.Lock()
+        self.fd = None
+        self.size = 0
+        
+        # Counters
+        self.records = 0
+        self.compactions = 0
+        self.errors = 0
+        self.load_seconds = 0
+    
+    def load(self):
+        """
+        Replay the journal and open it for appending.
+        
+        Returns:
+            tuple: (desired, acked) dicts of XCU to lamp bitfield from the last run
+        """
+        start = time.perf_counter()
+        data = b''
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                logger.error(f"Error reading tally journal {self.path}: {e}")
+        
+        names = {}
+        offset = len(MAGIC) if data.startswith(MAGIC) else len(data)
+        while offset + RECORD.size <= len(data):
+            kind, value, xcu_id = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + (value if kind == NAME else 0)
+            if end > len(data):
+                break
+            if kind == NAME:
+                names[xcu_id] = data[offset + RECORD.size:end].decode('utf-8', 'replace')
+            elif xcu_id in names and kind in (DESIRED, ACKED):
+                (self.desired if kind == DESIRED else self.acked)[names[xcu_id]] = value
+            else:
+                break
+            offset = end
+        if data and offset < len(data):
+            logger.warning(f"Dropping {len(data) - offset} unreadable bytes at the end of {self.path}")
+        
+        with self.lock:
+            # Start a fresh, compact log of what was replayed
+            self._compact()
+        self.load_seconds = time.perf_counter() - start
+        if self.desired or self.acked:
+            logger.info(f"Replayed the lamp states of {len(self.acked)} XCUs from {self.path} in "
+                        f"{self.load_seconds * 1000:.1f} ms")
+        return dict(self.desired), dict(self.acked)
+    
+    def _record(self, kind, xcu, lamps):
+        """Encode one state record, and the XCU's name first if it is new (call with the lock held)"""
+        xcu_id = self.ids.get(xcu)
+        data = b''
+        if xcu_id is None:
+            xcu_id = self.ids[xcu] = len(self.ids)
+            name = xcu.encode('utf-8')[:255]
+            data = RECORD.pack(NAME, len(name), xcu_id) + name
+        return data + RECORD.pack(kind, lamps, xcu_id)
+    
+    def _compact(self):
+        """Rewrite the journal as one record per lit state, missing XCUs are off (call with the lock held)"""
+        self.ids = {}
+        data = MAGIC + b''.join(
+            [self._record(DESIRED, xcu, lamps) for xcu, lamps in self.desired.items() if lamps] +
+            [self._record(ACKED, xcu, lamps) for xcu, lamps in self.acked.items() if lamps]
+        )
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.size = len(data)
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError as e:
+            self.errors += 1
+            logger.error(f"Error writing tally journal {self.path}: {e}")
+        self.compactions += 1
+    
+    def _apply(self, kind, states, commands):
+        """Fold commands into a state table and log the XCUs that changed"""
+        with self.lock:
+            changed = {}
+            for xcu, tally_type, state in commands:
+                lamps = changed.get(xcu, states.get(xcu, 0))
+                bit = LAMP_BITS[tally_type]
+                changed[xcu] = lamps | bit if state else lamps & ~bit
+            data = b''
+            for xcu, lamps in changed.items():
+                if states.get(xcu, 0) != lamps:
+                    states[xcu] = lamps
+                    data += self._record(kind, xcu, lamps)
+            if not data:
+                return
+            self.records += 1
+            if self.fd is None:
+                return
+            try:
+                os.write(self.fd, data)
+            except OSError as e:
+                self.errors += 1
+                logger.error(f"Error appending to tally journal {self.path}: {e}")
+                return
+            self.size += len(data)
+            # Compact on the acks, which come in on the lane workers, to keep the fsync
+            # off the switcher update path
+            if self.size >= self.compact_bytes * (1 if kind == ACKED else 2):
+                self._compact()
+    
+    def record_desired(self, commands):
+        """Log lamp changes the relay has decided on, as (xcu, tally_type, state) tuples"""
+        self._apply(DESIRED, self.desired, commands)
+    
+    def record_acked(self, commands):
+        """Log lamp changes the gateway has accepted, as (xcu, tally_type, state) tuples"""
+        self._apply(ACKED, self.acked, commands)
+    
+    def close(self):
+        """Close the journal file"""
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+    
+    def stats(self):
+        """Journal counters in a JSON friendly form"""
+        return {
+            'xcus': len(self.ids),
+            'bytes': self.size,
+            'appends': self.records,
+            'compactions': self.compactions,
+            'errors': self.errors,
+            'load_ms': round(self.load_seconds * 1000, 2)
+        }
+
+class WarmStart:
+    """
+    The lamps the previous run left lit, until the relay knows what they should show.
+    
+    Until then, commands for lamps already showing the wanted state are
+    dropped. Lamps whose last change was never acknowledged may or may
+    not have changed, so they are always sent. Once every switcher has been
+    read, or the timeout has passed with one still unreachable, finish()
+    works out the commands for the lamps still wrong, such as those left lit
+    for a camera that is no longer on air.
+    """
+    
+    def __init__(self, desired, acked, timeout=None):
+        """
+        Initialize the WarmStart
+        
+        Args:
+            desired: Dict of XCU to the lamp bitfield the previous run last asked for
+            acked: Dict of XCU to the lamp bitfield the gateway last accepted
+            timeout: Seconds after which to finish without waiting for every switcher,
+                None to always wait
+        """
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.shown = dict(acked)
+        self.unsure = {}
+        for xcu in set(desired) | set(acked):
+            unsure = desired.get(xcu, 0) ^ acked.get(xcu, 0)
+            if unsure:
+                self.unsure[xcu] = unsure
+        self.done = not self.shown and not self.unsure
+        self.skipped = 0
+        self.corrections = 0
+    
+    def expired(self):
+        """Whether the warm start has waited past its timeout"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+    
+    def filter(self, commands):
+        """The commands that would change a lamp, or might"""
+        kept = []
+        for xcu, tally_type, state in commands:
+            bit = LAMP_BITS[tally_type]
+            lamps = self.shown.get(xcu, 0)
+            unsure = self.unsure.get(xcu, 0)
+            if not unsure & bit and bool(lamps & bit) == state:
+                self.skipped += 1
+                continue
+            self.shown[xcu] = lamps | bit if state else lamps & ~bit
+            self.unsure[xcu] = unsure & ~bit
+            kept.append((xcu, tally_type, state))
+        return kept
+    
+    def finish(self, desired):
+        """
+        End the warm start.
+        
+        Args:
+            desired: Dict of XCU to the lamp bitfield it should show now (missing XCUs are off)
+        
+        Returns:
+            list: (xcu, tally_type, state) commands for every lamp that is, or may be, wrong
+        """
+        commands = []
+        for xcu in set(self.shown) | set(self.unsure) | set(desired):
+            lamps = desired.get(xcu, 0)
+            wrong = (self.shown.get(xcu, 0) ^ lamps) | self.unsure.get(xcu, 0)
+            commands += [(xcu, name, bool(lamps & bit)) for name, bit in LAMPS if wrong & bit]
+        self.corrections = len(commands)
+        self.done = True
+        self.shown = {}
+        self.unsure = {}
+        return commands
+    
+    def stats(self):
+        """Warm start counters in a JSON friendly form"""
+        return {'done': self.done, 'skipped': self.skipped, 'corrections': self.corrections}
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+TallyOutputs - fans each tally change out to every output protocol
+
+Every switcher update becomes one TallyCycle: the lamp commands for the
+GV gateway and the UMD messages for TSL displays, worked out once. Each
+output (sink) takes what it needs from the cycle, and encoded frames are
+cached on it, so sinks speaking the same protocol share one encoding.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger('tally_outputs')
+
+class TallyCycle:
+    """One tally change, in the form every sink needs"""
+    
+    __slots__ = ('commands', 'umds', 'origin', 'frames')
+    
+    def __init__(self, commands, umds, origin=None):
+        """
+        Initialize the TallyCycle
+        
+        Args:
+            commands: List of (xcu, tally_type, state) lamp changes
+            umds: List of (index, program, preview, text) for every UMD that changed
+            origin: time.monotonic() of the switcher read that caused it
+        """
+        self.commands = commands
+        self.umds = umds
+        self.origin = origin
+        self.frames = {}
+    
+    def encoded(self, key, encode):
+        """
+        The UMD messages encoded for one protocol, encoding them only once per cycle.
+        
+        Args:
+            key: Identifies the encoding, e.g. ('tsl', '5.0', 0)
+            encode: Function taking the UMD messages and returning the encoded frames
+        """
+        frames = self.frames.get(key)
+        if frames is None:
+            frames = self.frames[key] = encode(self.umds)
+        return frames
+
+class UmdTable:
+    """
+    Program/preview and label of every UMD index, and the diff for each change.
+    
+    Like the TallyIndex, an update only visits the sources that changed.
+    """
+    
+    def __init__(self, umd_map=None):
+        """
+        Initialize the UmdTable
+        
+        Args:
+            umd_map: Dict of source name to UMD index (default: inputN is index N)
+        """
+        self.umd_map = dict(umd_map or {})
+        self.states = {}  # Format: {3: (program, preview, text)}
+        self.program = frozenset()
+        self.preview = None
+        self.labels = {}
+    
+    def index_of(self, source):
+        """UMD index of a source, or None if it has none"""
+        index = self.umd_map.get(source)
+        if index is None and source.startswith('input') and source[5:].isdigit():
+            index = int(source[5:])
+        return index
+    
+    def update(self, program_sources, preview_source):
+        """
+        Apply a new program/preview state.
+        
+        Args:
+            program_sources: List of {'source', 'label'} dicts on program
+            preview_source: {'source', 'label'} dict on preview, or None
+        
+        Returns:
+            list: (index, program, preview, text) for every UMD whose tally or label changed
+        """
+        program = frozenset(source['source'] for source in program_sources)
+        preview = preview_source['source'] if preview_source else None
+        touched = set(program ^ self.program)
+        if preview != self.preview:
+            touched.update(name for name in (preview, self.preview) if name is not None)
+        for source in list(program_sources) + ([preview_source] if preview_source else []):
+            if self.labels.get(source['source']) != source['label']:
+                self.labels[source['source']] = source['label']
+                touched.add(source['source'])
+        self.program = program
+        self.preview = preview
+        
+        messages = []
+        for source in touched:
+            index = self.index_of(source)
+            if index is None:
+                continue
+            state = (source in program, source == preview, self.labels.get(source, source))
+            if self.states.get(index) != state:
+                self.states[index] = state
+                messages.append((index,) + state)
+        messages.sort()
+        return messages
+    
+    def messages(self):
+        """Every UMD's current state, for a full refresh"""
+        return [(index,) + state for index, state in sorted(self.states.items())]
+
+class GatewaySink:
+    """Sends a cycle's lamp commands to the GV gateways"""
+    
+    name = 'gateway'
+    
+    def __init__(self, send):
+        """
+        Initialize the GatewaySink
+        
+        Args:
+            send: Function taking (commands, origin), e.g. app.send_tally_commands
+        """
+        self.send_commands = send
+    
+    def send(self, cycle):
+        if cycle.commands:
+            self.send_commands(cycle.commands, origin=cycle.origin)
+    
+    def stats(self):
+        return {}
+
+class TallyOutputs:
+    """
+    Emits each tally change once to every sink.
+    
+    The UMD table is only kept when there is a sink that uses it. UMD
+    sinks also get a full refresh every `refresh_interval` seconds, so a
+    display that restarted or missed a UDP packet catches up.
+    """
+    
+    def __init__(self, sinks, umd_map=None, refresh_interval=5):
+        """
+        Initialize the TallyOutputs
+        
+        Args:
+            sinks: Objects with a send(cycle) method, e.g. GatewaySink and TslSender
+            umd_map: Dict of source name to UMD index for the UMD sinks
+            refresh_interval: Seconds between full refreshes of the UMD sinks (0 for none)
+        """
+        self.sinks = list(sinks)
+        self.table = UmdTable(umd_map)
+        self.umd_sinks = [sink for sink in self.sinks if hasattr(sink, 'attach')]
+        for sink in self.umd_sinks:
+            sink.attach(self.table)
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.cycles = 0
+    
+    def emit(self, commands, program_sources, preview_source, origin=None):
+        """
+        Work out one tally change and send it to every sink.
+        
+        Call in the order the changes happened. The change is worked out and
+        sent under one lock, as is a refresh: the gateway lanes keep only the
+        latest state per lamp and the UMD sinks only send changes, so sends
+        overtaking each other would leave a stale state showing. Sending never
+        blocks, TCP sinks and the gateway lanes have their own threads.
+        
+        Args:
+            commands: List of (xcu, tally_type, state) lamp changes
+            program_sources: Sources now on program, as {'source', 'label'} dicts
+            preview_source: Source now on preview, or None
+            origin: time.monotonic() of the switcher read that caused the change
+        
+        Returns:
+            TallyCycle: The change
+        """
+        with self.lock:
+            umds = self.table.update(program_sources, preview_source) if self.umd_sinks else []
+            cycle = TallyCycle(commands, umds, origin)
+            self._send(cycle, self.sinks)
+        return cycle
+    
+    def refresh(self):
+        """Send every UMD's state to the UMD sinks"""
+        with self.lock:
+            umds = self.table.messages()
+            if umds:
+                self._send(TallyCycle([], umds), self.umd_sinks)
+    
+    def _send(self, cycle, sinks):
+        self.cycles += 1
+        for sink in sinks:
+            try:
+                sink.send(cycle)
+            except Exception as e:
+                logger.error(f"Error sending tally to {sink.name}: {e}")
+    
+    def start(self):
+        """Refresh the UMD sinks periodically in a background thread"""
+        if not self.umd_sinks or not self.refresh_interval or (self.thread and self.thread.is_alive()):
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        while not self.stopped.wait(self.refresh_interval):
+            self.refresh()
+    
+    def stop(self):
+        """Stop the refresh thread and the sinks"""
+        self.stopped.set()
+        for sink in self.sinks:
+            if hasattr(sink, 'stop'):
+                sink.stop()
+    
+    def stats(self):
+        """Cycle count and per-sink counters in a JSON friendly form"""
+        return {
+            'cycles': self.cycles,
+            'umds': len(self.table.states),
+            'sinks': {sink.name: sink.stats() for sink in self.sinks}
+        }
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Reconciler - keeps the lamps matching the relay's tally state
+
+The relay only sends a command when the state changes, so a lamp that was
+reset by a basestation or gateway reboot, or missed a command, would stay
+wrong until the next cut. The reconciler slowly re-asserts every lamp in
+the background, and straight away for XCUs whose gateway connection has
+just been (re)established or whose basestation has come back with a new
+session.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tally_reconciler')
+
+class Reconciler:
+    """
+    Low priority background re-assertion of the desired lamp states.
+    
+    Re-assertions go through the send dispatcher as background commands:
+    they never replace a live command that is waiting, and a full pass
+    only touches an XCU once live traffic has been quiet for a while, at
+    no more than `rate` XCUs per second.
+    """
+    
+    def __init__(self, desired, dispatcher, interval=30, rate=10, quiet=0.5, read_state=None,
+                 lamps=('red', 'green')):
+        """
+        Initialize the Reconciler
+        
+        Args:
+            desired: Callable returning {'XCU-01': {'red': True, 'green': False}} for every mapped XCU,
+                or None while the desired state is not known yet
+            dispatcher: SendDispatcher to send re-assertions through
+            interval: Seconds between full passes (0 to only reconcile after resets)
+            rate: Most XCUs re-asserted per second during a full pass
+            quiet: Seconds without live commands before a full pass touches an XCU
+            read_state: Optional callable taking an XCU and returning its actual lamp states
+                (same form as desired), or None if they can't be read; lamps already
+                right are then not re-sent
+            lamps: Lamps switched off on XCUs that are no longer mapped
+        """
+        self.desired = desired
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.rate = rate
+        self.quiet = quiet
+        self.read_state = read_state
+        self.lamps = lamps
+        
+        self.known = set()  # Every XCU the relay has driven, so unmapped ones are switched off
+        self.retiring = {}  # Unmapped XCUs and their lamps not yet acknowledged off, format: {'XCU-01': {'red'}}
+        self.urgent = set()
+        self.full_pass_at = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.running = False
+        
+        # Counters
+        self.passes = 0
+        self.reasserted = 0
+        self.resets = 0
+        self.last_pass_duration = 0
+        
+        dispatcher.add_reset_callback(self.on_reset)
+        dispatcher.add_ack_callback(self.on_ack)
+    
+    def start(self):
+        """Run the reconciler in a background thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the reconciler"""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+    
+    def on_reset(self, lane, xcus):
+        """A lane reconnected or a basestation rebooted: re-assert those XCUs straight away"""
+        self.resets += 1
+        xcus = self.dispatcher.lane_xcus(lane) if xcus is None else xcus
+        if xcus:
+            self.request(xcus)
+    
+    def on_ack(self, commands):
+        """Forget unmapped XCUs once the gateway has accepted every one of their lamps off"""
+        with self.lock:
+            for xcu, tally_type, state in commands:
+                if state or xcu not in self.retiring:
+                    continue
+                self.retiring[xcu].discard(tally_type)
+                if not self.retiring[xcu]:
+                    self._retire(xcu)
+    
+    def _retire(self, xcu):
+        """Stop switching off an unmapped XCU (call with the lock held)"""
+        del self.retiring[xcu]
+        self.known.discard(xcu)
+    
+    def request(self, xcus=None, delay=0):
+        """
+        Reconcile soon instead of waiting for the next pass.
+        
+        Args:
+            xcus: XCUs to re-assert straight away (None for a full pass)
+            delay: Seconds to hold a full pass off, e.g. while a new mapping is being applied
+        """
+        with self.lock:
+            if xcus is None:
+                self.full_pass_at = max(self.full_pass_at or 0, time.monotonic() + delay)
+            else:
+                self.urgent.update(xcus)
+        self.wake.set()
+    
+    def _states(self):
+        """
+        Desired lamp states, with every XCU that is no longer mapped switched off.
+        
+        An unmapped XCU is only switched off until the gateway has accepted
+        that, so lamps set another way afterwards (e.g. from the command
+        line) are left alone.
+        """
+        desired = self.desired()
+        if desired is None:
+            return {}
+        with self.lock:
+            for xcu in desired:
+                self.retiring.pop(xcu, None)
+            self.known.update(desired)
+            for xcu in self.known - set(desired):
+                self.retiring.setdefault(xcu, set(self.lamps))
+                desired[xcu] = dict.fromkeys(self.lamps, False)
+        return desired
+    
+    def reconcile(self, xcus, desired):
+        """
+        Re-assert the lamps of some XCUs as background commands.
+        
+        Returns:
+            int: Number of commands queued
+        """
+        commands = []
+        for xcu in xcus:
+            lamps = desired.get(xcu)
+            if lamps is None:
+                continue
+            actual = self.read_state(xcu) if self.read_state else None
+            queued = len(commands)
+            for tally_type, state in lamps.items():
+                if actual is None or actual.get(tally_type) != state:
+                    commands.append((xcu, tally_type, state))
+            if len(commands) == queued and xcu in self.retiring:
+                # Read back as already off
+                with self.lock:
+                    if xcu in self.retiring:
+                        self._retire(xcu)
+        if commands:
+            self.dispatcher.submit(commands, background=True)
+            self.reasserted += len(commands)
+        return len(commands)
+    
+    def _take_urgent(self):
+        """XCUs waiting to be re-asserted straight away"""
+        with self.lock:
+            urgent, self.urgent = self.urgent, set()
+        if urgent:
+            logger.info(f"Re-asserting tally for {', '.join(sorted(urgent))}")
+        return urgent
+    
+    def _run(self):
+        if self.interval:
+            self.request(delay=self.interval)
+        while self.running:
+            with self.lock:
+                due = self.full_pass_at
+            self.wake.wait(None if due is None else max(0, due - time.monotonic()))
+            self.wake.clear()
+            if not self.running:
+                return
+            
+            try:
+                urgent = self._take_urgent()
+                if urgent:
+                    self.reconcile(urgent, self._states())
+                
+                with self.lock:
+                    due = self.full_pass_at is not None and time.monotonic() >= self.full_pass_at
+                    if due:
+                        self.full_pass_at = None
+                if due:
+                    self._full_pass()
+                    if self.interval:
+                        self.request(delay=self.interval)
+            except Exception as e:
+                logger.error(f"Error reconciling tally: {e}")
+    
+    def _full_pass(self):
+        """Re-assert every lamp, one XCU at a time, yielding to live traffic"""
+        started = time.monotonic()
+        
+        # One snapshot of the desired states for the whole pass. Only live commands
+        # change what a lamp should show, so it is taken again only after some have
+        # gone out, and a stale state is never re-asserted over a newer one
+        taken = time.monotonic()
+        desired = self._states()
+        xcus = sorted(desired)
+        for xcu in xcus:
+            # Let live cuts go first, and pick up resets as they happen
+            while self.running and self.dispatcher.idle_time() < self.quiet:
+                time.sleep(self.quiet)
+            if not self.running:
+                return
+            if self.dispatcher.last_live >= taken:
+                taken = time.monotonic()
+                desired = self._states()
+            urgent = self._take_urgent()
+            if urgent:
+                self.reconcile(urgent, desired)
+            self.reconcile([xcu], desired)
+            time.sleep(1 / self.rate)
+        
+        self.passes += 1
+        self.last_pass_duration = time.monotonic() - started
+        logger.debug(f"Reconciled {len(xcus)} XCUs in {self.last_pass_duration:.1f} s")
+    
+    def stats(self):
+        """Pass counters in a JSON friendly form"""
+        return {
+            'interval': self.interval,
+            'rate': self.rate,
+            'passes': self.passes,
+            'reasserted': self.reasserted,
+            'resets': self.resets,
+            'known_xcus': len(self.known),
+            'last_pass_duration_s': round(self.last_pass_duration, 2)
+        }
@@ -7,11 +7,12 @@ import threading
 import time
 import requests
 import logging
-import subprocess
-import os
-import sys
 from datetime import datetime
 
+from gv_tally_control import GatewayClient
+from tally_dispatch import SendDispatcher
+from tally_index import TallyIndex
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,25 +23,53 @@ logger = logging.getLogger('tally_sender')
 class TallySender:
     """Handles sending tally commands to camera control units"""
     
-    def __init__(self, controllers=None):
+    def __init__(self, controllers=None, dispatcher=None, lamp_table=None):
         """
         Initialize the TallySender
         
         Args:
             controllers: List of controller configurations
+            dispatcher: SendDispatcher to send commands through (one is created if not given)
+            lamp_table: LampTable deciding the lamps for program/preview (default: red/green)
         """
         self.controllers = controllers or []
-        self.camera_to_xcu = {}
+        self.lamp_table = lamp_table
+        self.dispatcher = dispatcher or SendDispatcher(lambda lane: GatewayClient())
         self.monitor_thread = None
         self.running = False
         self.current_program_sources = []
         self.current_preview_source = None
         
-        # Track which XCUs have tally on to avoid duplicate commands
-        self.xcu_tally_state = {}  # Format: {'XCU-01': {'red': True, 'green': False}}
+        # Held from diffing to queueing, so a mapping change and a monitor update can't
+        # queue their commands in the opposite order to the one they were worked out in
+        self.lock = threading.Lock()
+        
+        # Track which XCUs have tally on to avoid duplicate commands, indexed by source
+        self.camera_to_xcu = {}
         
         logger.info(f"TallySender initialized with {len(self.controllers)} controllers")
     
+    @property
+    def camera_to_xcu(self):
+        """Source to XCU mapping"""
+        return self._camera_to_xcu
+    
+    @camera_to_xcu.setter
+    def camera_to_xcu(self, mapping):
+        # Assign a new mapping rather than editing it in place: the index is remapped
+        # here, keeping the lamps it doesn't change and switching off unmapped XCUs
+        with self.lock:
+            self._camera_to_xcu = mapping
+            if hasattr(self, 'index'):
+                self.send_tally_commands(self.index.remap(mapping))
+            else:
+                self.index = TallyIndex(mapping, self.lamp_table)
+    
+    @property
+    def xcu_tally_state(self):
+        """Current lamp states, format: {'XCU-01': {'red': True, 'green': False}}"""
+        return self.index.states()
+    
     def start_monitoring(self, status_url, interval=1):
         """
         Start monitoring the status URL for tally changes
@@ -113,54 +142,25 @@ class TallySender:
             program_sources: List of sources currently on program
             preview_source: Source currently on preview
         """
-        # Track which XCUs should have tally on
-        target_state = {}
-        
-        # Process program sources (red tally)
-        for source in program_sources:
-            if source in self.camera_to_xcu:
-                xcu = self.camera_to_xcu[source]
-                if xcu not in target_state:
-                    target_state[xcu] = {'red': True, 'green': False}
-                else:
-                    target_state[xcu]['red'] = True
-        
-        # Process preview source (green tally) - NOTE, I never got this to work
-        if preview_source and preview_source in self.camera_to_xcu:
-            xcu = self.camera_to_xcu[preview_source]
-            if xcu not in target_state:
-                target_state[xcu] = {'red': False, 'green': True}
-            else:
-                target_state[xcu]['green'] = True
-        
-        # Compare with current state and send commands for changes
-        for xcu, state in target_state.items():
-            # Initialize XCU state if not present
-            if xcu not in self.xcu_tally_state:
-                self.xcu_tally_state[xcu] = {'red': False, 'green': False}
-            
-            # Check if red tally state changed
-            if state['red'] != self.xcu_tally_state[xcu]['red']:
-                self.send_tally_command(xcu, 'red', state['red'])
-                self.xcu_tally_state[xcu]['red'] = state['red']
+        with self.lock:
+            # Only the sources that entered or left program/preview are looked at
+            commands = self.index.update(program_sources, preview_source)
             
-            # Check if green tally state changed
-            if state['green'] != self.xcu_tally_state[xcu]['green']:
-                self.send_tally_command(xcu, 'green', state['green'])
-                self.xcu_tally_state[xcu]['green'] = state['green']
+            # Queue the whole diff for delivery
+            self.send_tally_commands(commands)
+    
+    def send_tally_commands(self, commands):
+        """
+        Queue a set of tally commands for delivery without blocking the monitor loop
         
-        # Turn off tally for XCUs not in target_state
-        for xcu in list(self.xcu_tally_state.keys()):
-            if xcu not in target_state:
-                # Turn off red tally if it was on
-                if self.xcu_tally_state[xcu]['red']:
-                    self.send_tally_command(xcu, 'red', False)
-                    self.xcu_tally_state[xcu]['red'] = False
-                
-                # Turn off green tally if it was on
-                if self.xcu_tally_state[xcu]['green']:
-                    self.send_tally_command(xcu, 'green', False)
-                    self.xcu_tally_state[xcu]['green'] = False
+        Args:
+            commands: List of (xcu, tally_type, state) tuples
+        """
+        if not commands:
+            return
+        
+        logger.info(f"Sending {len(commands)} tally changes")
+        self.dispatcher.submit(commands)
     
     def send_tally_command(self, xcu, tally_type, state):
         """
@@ -171,31 +171,4 @@ class TallySender:
             tally_type: Type of tally (red, green)
             state: Tally state (True for on, False for off)
         """
-        state_str = "on" if state else "off"
-        logger.info(f"Sending {tally_type} tally {state_str} command to {xcu}")
-        
-        # Build command
-        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gv_tally_control.py")
-        command = [
-            sys.executable, 
-            script_path,
-            "--xcu", xcu,
-            f"--{tally_type}", state_str
-        ]
-        
-        # Execute command
-        try:
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                check=False  # Don't raise exception on non-zero exit
-            )
-            
-            if result.returncode == 0:
-                logger.info(f"Successfully sent {tally_type} tally {state_str} to {xcu}")
-            else:
-                logger.error(f"Error sending tally command: {result.stderr}")
-                
-        except Exception as e:
-            logger.error(f"Exception sending tally command: {e}")
+        self.send_tally_commands([(xcu, tally_type, state)])
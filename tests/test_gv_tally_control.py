@@ -0,0 +1,77 @@
+"""Tests for the gateway client helpers and the XML framing"""
+
+import socket
+
+import gv_tally_control
+from gv_tally_control import GatewayClient, XMLFramer, default_sessions, sessions_file
+
+def test_default_sessions_are_kept_per_gateway(tmp_path, monkeypatch):
+    monkeypatch.setattr(gv_tally_control, 'SESSIONS_DIR', str(tmp_path))
+    monkeypatch.setattr(gv_tally_control, '_default_sessions', {})
+    
+    first = default_sessions('10.0.0.5', 8080)
+    second = default_sessions('10.0.0.6', 8080)
+    
+    assert first is default_sessions('10.0.0.5', 8080)
+    assert first is not second
+    first.learn('XCU-11', 'AAA')
+    assert second.get('XCU-11') is None
+    assert sessions_file('10.0.0.5', 8080) == str(tmp_path / 'session_ids_10.0.0.5_8080.json')
+    assert sessions_file('fe80::1', 8080) == str(tmp_path / 'session_ids_fe80__1_8080.json')
+
+def test_framer_joins_a_document_split_across_reads():
+    framer = XMLFramer()
+    message = '<reply result="Ok"><detail>é</detail></reply>'.encode('utf-8')
+    
+    # Split inside a tag and inside a multi-byte character
+    assert framer.feed(message[:9]) == []
+    assert framer.feed(message[9:28]) == []
+    assert framer.feed(message[28:]) == ['<reply result="Ok"><detail>é</detail></reply>']
+    assert framer.buffer == ''
+
+def test_framer_splits_several_documents_in_one_read():
+    framer = XMLFramer()
+    
+    documents = framer.feed(b'<a result="Ok"/>\n<b><c>1</c></b><d>2</d><e>')
+    
+    assert documents == ['<a result="Ok"/>', '<b><c>1</c></b>', '<d>2</d>']
+    assert framer.feed(b'3</e>') == ['<e>3</e>']
+
+def test_framer_keeps_the_declaration_with_its_document():
+    framer = XMLFramer()
+    
+    documents = framer.feed(b'<?xml version="2.0" encoding="UTF-8"?>\n<!-- note > here -->\n<x result="Ok"/>')
+    
+    assert documents == ['<?xml version="2.0" encoding="UTF-8"?>\n<!-- note > here -->\n<x result="Ok"/>']
+
+def test_framer_skips_garbage_between_documents():
+    framer = XMLFramer()
+    
+    assert framer.feed(b'noise < not a tag </stray> <ok/>trailing text') == ['<ok/>']
+    assert framer.buffer == ''
+    assert framer.feed(b'<next/>') == ['<next/>']
+
+def test_framer_drops_an_oversized_document():
+    framer = XMLFramer(max_size=64)
+    
+    assert framer.feed(b'<huge>' + b'x' * 100) == []
+    assert framer.dropped == 1
+    assert framer.buffer == ''
+    # The rest of the dropped message is skipped and the next one comes through
+    assert framer.feed(b'</huge><ok/>') == ['<ok/>']
+
+def test_read_without_waiting_keeps_the_socket_timeout():
+    ours, theirs = socket.socketpair()
+    client = GatewayClient('127.0.0.1', 0, session_ids={})
+    client.sock = ours
+    client.framer = XMLFramer()
+    ours.settimeout(2)
+    try:
+        assert client._read_document(0) is None
+        assert ours.gettimeout() == 2
+        
+        theirs.sendall(b'<ok/>')
+        assert client._read_document(1) == '<ok/>'
+    finally:
+        ours.close()
+        theirs.close()
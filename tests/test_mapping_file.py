@@ -0,0 +1,61 @@
+"""Tests for the mapping file watcher"""
+
+import json
+
+from mapping_file import MappingFile
+
+def edit(path, mapping):
+    with open(path, 'w') as f:
+        json.dump(mapping, f)
+
+def test_rejected_edit_is_not_taken_as_current(tmp_path):
+    path = str(tmp_path / 'camera_mapping.json')
+    good = {'input1': 'XCU-01'}
+    applied = []
+    
+    def on_change(mapping):
+        if not all(value.startswith('XCU-') for value in mapping.values()):
+            return False
+        applied.append(mapping)
+        return True
+    
+    mapping_file = MappingFile(path, on_change)
+    mapping_file.write(good)
+    
+    edit(path, {'input1': 'CAM-01'})
+    mapping_file.check()
+    assert applied == []
+    assert mapping_file.current == good
+    
+    # Put back, then a valid edit that is applied
+    edit(path, good)
+    mapping_file.check()
+    edit(path, {'input1': 'XCU-02'})
+    mapping_file.check()
+    assert applied == [{'input1': 'XCU-02'}]
+    assert mapping_file.current == {'input1': 'XCU-02'}
+    assert mapping_file.reloads == 2
+    assert mapping_file.errors == 1
+
+def test_edit_back_to_the_saved_mapping_is_applied(tmp_path):
+    path = str(tmp_path / 'camera_mapping.json')
+    applied = []
+    
+    def on_change(mapping):
+        if mapping.get('input1') == 'XCU-99':
+            raise RuntimeError('gateway down')
+        applied.append(mapping)
+        return True
+    
+    mapping_file = MappingFile(path, on_change)
+    mapping_file.write({'input1': 'XCU-01'})
+    
+    edit(path, {'input1': 'XCU-02'})
+    mapping_file.check()
+    edit(path, {'input1': 'XCU-99'})
+    mapping_file.check()
+    edit(path, {'input1': 'XCU-01'})
+    mapping_file.check()
+    
+    assert applied == [{'input1': 'XCU-02'}, {'input1': 'XCU-01'}]
+    assert mapping_file.current == {'input1': 'XCU-01'}
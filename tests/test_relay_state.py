@@ -0,0 +1,50 @@
+"""Tests for the versioned relay state snapshots"""
+
+from relay_state import Snapshot, StateStore, etag_matches
+
+PROGRAM = [{'source': 'input1', 'label': 'Cam 1'}]
+
+def test_last_update_alone_keeps_the_version_and_etag():
+    store = StateStore()
+    first = store.update(program=PROGRAM, status='Connected', last_update='2026-10-17 10:00:00')
+    
+    second = store.update(last_update='2026-10-17 10:00:01')
+    
+    assert second is store.snapshot
+    assert second.last_update == '2026-10-17 10:00:01'
+    assert second.version == first.version
+    assert second.etag == first.etag
+
+def test_tally_label_and_mapping_changes_bump_the_version():
+    store = StateStore()
+    first = store.update(program=PROGRAM)
+    
+    relabelled = store.update(program=[{'source': 'input1', 'label': 'Wide'}])
+    assert relabelled.version == first.version + 1
+    assert relabelled.etag != first.etag
+    
+    remapped = store.update(mapping={'input1': 'XCU-01'})
+    assert remapped.version == relabelled.version + 1
+    assert remapped.etag != relabelled.etag
+
+def test_same_content_has_the_same_etag():
+    store = StateStore()
+    first = store.update(program=PROGRAM, preview={'source': 'input2', 'label': 'Cam 2'})
+    store.update(preview=None)
+    back = store.update(preview={'source': 'input2', 'label': 'Cam 2'})
+    
+    assert back.etag == first.etag
+    assert back.etag == Snapshot(program=PROGRAM, preview={'source': 'input2', 'label': 'Cam 2'}).etag
+
+def test_unchanged_update_keeps_the_snapshot():
+    store = StateStore()
+    first = store.update(status='Connected')
+    
+    assert store.update(status='Connected') is first
+
+def test_etag_matches_weak_and_listed_tags():
+    assert etag_matches('W/"abc"', 'abc')
+    assert etag_matches('"xyz", "abc"', 'abc')
+    assert etag_matches('*', 'abc')
+    assert not etag_matches('"xyz"', 'abc')
+    assert not etag_matches(None, 'abc')
@@ -0,0 +1,63 @@
+"""Tests for the XCU session ID cache"""
+
+from session_cache import SessionCache
+
+def test_discovered_id_wins_over_configured():
+    cache = SessionCache({'XCU-08': 'PH3XQD'})
+    
+    assert cache.learn('XCU-08', 'NEW001')
+    assert cache.get('XCU-08') == 'NEW001'
+    assert not cache.learn('XCU-08', 'NEW001')
+
+def test_forgetting_a_discovered_id_falls_back_to_the_configured_one():
+    cache = SessionCache({'XCU-08': 'PH3XQD'})
+    cache.learn('XCU-08', 'NEW001')
+    
+    assert cache.forget('XCU-08', 'NEW001')
+    assert cache.get('XCU-08') == 'PH3XQD'
+
+def test_configured_id_announced_gone_comes_back_when_announced_again():
+    cache = SessionCache({'XCU-08': 'PH3XQD'})
+    
+    assert cache.forget('XCU-08', 'PH3XQD')
+    assert cache.get('XCU-08') is None
+    
+    cache.learn('XCU-08', 'PH3XQD')
+    assert cache.get('XCU-08') == 'PH3XQD'
+
+def test_learning_an_id_drops_the_xcu_that_held_it():
+    cache = SessionCache()
+    cache.learn('XCU-08', 'AAA')
+    cache.learn('XCU-09', 'AAA')
+    
+    assert cache.get('XCU-08') is None
+    assert cache.get('XCU-09') == 'AAA'
+
+def test_configured_id_wins_over_one_saved_by_an_earlier_run(tmp_path):
+    path = str(tmp_path / 'session_ids.json')
+    SessionCache({}, path).learn('XCU-08', 'STALE1')
+    
+    cache = SessionCache({'XCU-08': 'BENCH008'}, path)
+    
+    assert cache.get('XCU-08') == 'BENCH008'
+    assert cache.learn('XCU-08', 'NEW001')
+    assert cache.get('XCU-08') == 'NEW001'
+
+def test_saved_id_is_used_for_an_unconfigured_xcu(tmp_path):
+    path = str(tmp_path / 'session_ids.json')
+    SessionCache({}, path).learn('XCU-11', 'SAVED1')
+    
+    cache = SessionCache({'XCU-08': 'PH3XQD'}, path)
+    
+    assert 'XCU-11' in cache
+    assert cache.get('XCU-11') == 'SAVED1'
+    assert cache.forget('XCU-11', 'SAVED1')
+    assert cache.get('XCU-11') is None
+    assert SessionCache({}, path).get('XCU-11') is None
+
+def test_cache_without_a_path_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = SessionCache({'XCU-08': 'PH3XQD'})
+    cache.learn('XCU-09', 'AAA')
+    
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,22 @@
+"""Tests for the web client state broadcaster"""
+
+from state_broadcaster import StateBroadcaster
+
+def test_unchanged_state_is_not_pushed_again():
+    broadcaster = StateBroadcaster()
+    
+    assert broadcaster.publish({'program': ['input1'], 'last_update': 'a'}, key=['input1'])
+    assert not broadcaster.publish({'program': ['input1'], 'last_update': 'b'}, key=['input1'])
+    assert broadcaster.latest()[0] == 1
+
+def test_heartbeat_carries_the_last_update_time():
+    broadcaster = StateBroadcaster(heartbeat=0.01)
+    broadcaster.publish({'program': []})
+    broadcaster.touch('2026-10-17 10:00:00')
+    frames = broadcaster.listen()
+    
+    assert next(frames) == "retry: 1000\n\n"
+    assert next(frames) == 'id: 1\ndata: {"program": []}\n\n'
+    assert next(frames) == 'event: heartbeat\ndata: {"last_update": "2026-10-17 10:00:00"}\n\n'
+    frames.close()
+    assert broadcaster.listeners == 0
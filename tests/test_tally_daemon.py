@@ -0,0 +1,112 @@
+"""Tests for the command line tally daemon"""
+
+import socket
+import threading
+
+import pytest
+
+from tally_daemon import TallyDaemon, format_command, forward, parse_command
+
+class FakeClient:
+    """Records the lamps the daemon sets; set ok to False to have every write fail"""
+    
+    def __init__(self, ip='10.0.0.5', port=8080):
+        self.ip = ip
+        self.port = port
+        self.ok = True
+        self.calls = []
+    
+    def set_lamps(self, xcu, lamps, session_id=None):
+        self.calls.append((xcu, lamps, session_id))
+        return self.ok
+
+def test_format_and_parse_round_trip():
+    line = format_command('XCU-08', {'red': True, 'green': False}, session_id='PH3XQD', gateway='10.0.0.5:8080')
+    
+    assert line == 'xcu=XCU-08 session=PH3XQD gateway=10.0.0.5:8080 red=on green=off\n'
+    assert parse_command(line) == ('XCU-08', {'red': True, 'green': False}, 'PH3XQD', '10.0.0.5:8080')
+
+def test_parse_command_without_an_xcu_uses_the_session():
+    assert parse_command('session=PH3XQD red=OFF') == ('Custom', {'red': False}, 'PH3XQD', None)
+
+@pytest.mark.parametrize('line', [
+    'red=on',
+    'xcu=XCU-08',
+    'xcu=XCU-08 red',
+    'xcu=XCU-08 red=',
+    'xcu=XCU-08 red=maybe',
+])
+def test_parse_command_rejects_bad_lines(line):
+    with pytest.raises(ValueError):
+        parse_command(line)
+
+def test_handle_sends_the_lamps():
+    client = FakeClient()
+    daemon = TallyDaemon(client)
+    
+    assert daemon.handle('xcu=XCU-08 red=on gateway=10.0.0.5:8080') == 'OK'
+    assert daemon.handle('ping') == 'OK'
+    assert client.calls == [('XCU-08', {'red': True}, None)]
+    assert daemon.commands == 1
+
+def test_handle_reports_errors():
+    client = FakeClient()
+    daemon = TallyDaemon(client)
+    
+    assert daemon.handle('xcu=XCU-08').startswith('ERR ')
+    client.ok = False
+    assert daemon.handle('xcu=XCU-08 red=off').startswith('ERR XCU-08')
+    assert daemon.errors == 2
+
+def test_handle_refuses_commands_for_another_gateway():
+    client = FakeClient()
+    daemon = TallyDaemon(client)
+    
+    assert daemon.handle('xcu=XCU-08 red=on gateway=10.0.0.6:8080') == 'WRONG-GATEWAY 10.0.0.5:8080'
+    assert client.calls == []
+
+def test_forward_through_a_running_daemon(tmp_path):
+    path = str(tmp_path / 'tally.sock')
+    client = FakeClient()
+    daemon = TallyDaemon(client, path).start()
+    try:
+        assert forward(format_command('XCU-08', {'red': True}, gateway='10.0.0.5:8080'), path) == 'OK'
+        assert forward(format_command('XCU-08', {'red': True}, gateway='10.0.0.6:8080'), path) is None
+    finally:
+        daemon.stop()
+    
+    assert client.calls == [('XCU-08', {'red': True}, None)]
+
+def test_forward_falls_back_only_when_no_daemon_is_listening(tmp_path):
+    path = str(tmp_path / 'tally.sock')
+    line = format_command('XCU-08', {'red': True})
+    
+    assert forward(line, path) is None
+    
+    # Socket left behind by a daemon that has stopped
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    assert forward(line, path) is None
+
+def test_forward_reports_a_slow_daemon_as_an_error(tmp_path):
+    path = str(tmp_path / 'tally.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    done = threading.Event()
+    
+    def accept():
+        # Take the command but never answer it, like a daemon stuck on the gateway
+        conn, _ = server.accept()
+        done.wait(5)
+        conn.close()
+    
+    threading.Thread(target=accept, daemon=True).start()
+    try:
+        reply = forward(format_command('XCU-08', {'red': True}), path, timeout=0.2)
+    finally:
+        done.set()
+        server.close()
+    
+    assert reply.startswith('ERR ')
@@ -0,0 +1,181 @@
+"""Tests for the send lanes' coalescing and the dispatcher's delivery"""
+
+import threading
+import time
+
+from tally_dispatch import Lane, SendDispatcher
+from tally_index import RED
+from tally_journal import TallyJournal
+
+KEY = ('XCU-01', 'red')
+
+def put(lane, state, xcu='XCU-01', tally_type='red', enqueued=0):
+    lane.put(xcu, tally_type, state, enqueued, enqueued + 5, None)
+
+def test_put_keeps_latest_state_and_first_enqueue_time():
+    lane = Lane('gateway', None)
+    put(lane, True, enqueued=1)
+    put(lane, False, enqueued=2)
+    
+    assert lane.take(0) == {KEY: (False, 1, 7, None)}
+    assert lane.coalesced == 1
+
+def test_put_drops_state_back_to_acked():
+    lane = Lane('gateway', None)
+    lane.acked[KEY] = True
+    put(lane, False)
+    put(lane, True)
+    
+    assert lane.take(0) == {}
+    assert lane.coalesced == 2
+
+def test_put_compares_with_state_in_flight():
+    lane = Lane('gateway', None)
+    lane.acked[KEY] = True
+    put(lane, False)
+    assert lane.take(0)[KEY][0] is False
+    
+    # Off is being written: on, off, on must still end with on queued
+    put(lane, True)
+    put(lane, False)
+    put(lane, True)
+    assert lane.take(0)[KEY][0] is True
+
+def test_put_back_keeps_newer_states_and_drops_expired():
+    lane = Lane('gateway', None)
+    put(lane, True)
+    put(lane, True, xcu='XCU-02')
+    batch = lane.take(0)
+    put(lane, False)
+    
+    lane.put_back(batch, now=1)
+    assert lane.take(0) == {KEY: (False, 0, 5, None), ('XCU-02', 'red'): (True, 0, 5, None)}
+    
+    lane.put_back({KEY: (True, 0, 5, None)}, now=6)
+    assert lane.take(0) == {}
+    assert lane.expired == 1
+
+def test_put_background_never_replaces_live_state():
+    lane = Lane('gateway', None)
+    put(lane, False)
+    lane.put_background('XCU-01', 'red', True, 0, 5)
+    lane.put_background('XCU-02', 'red', True, 0, 5)
+    
+    batch = lane.take(0)
+    assert batch[KEY][0] is False
+    assert batch[('XCU-02', 'red')][0] is True
+
+class SlowClient:
+    """Gateway client that takes a while to accept each write, optionally rejecting some XCUs"""
+    
+    connected = True
+    
+    def __init__(self, delay=0.05, reject=(), unknown=()):
+        self.delay = delay
+        self.reject = set(reject)
+        self.unknown = set(unknown)
+        self.writes = []
+        self.shown = {}
+        self.started = threading.Event()
+    
+    def set_tallies(self, commands):
+        self.started.set()
+        time.sleep(self.delay)
+        skipped = [command for command in commands if command[0] in self.unknown]
+        commands = [command for command in commands if command[0] not in self.unknown]
+        self.writes.append(list(commands))
+        if any(xcu in self.reject for xcu, _, _ in commands):
+            return False, skipped
+        for xcu, tally_type, state in commands:
+            self.shown[(xcu, tally_type)] = state
+        return True, skipped
+    
+    def close(self):
+        pass
+
+def wait_idle(dispatcher, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        lanes = list(dispatcher.lanes.values())
+        if all(not lane.pending and not lane.inflight for lane in lanes):
+            return
+        time.sleep(0.01)
+    raise AssertionError("dispatcher did not go idle")
+
+def test_lamp_ends_in_last_state_submitted_while_a_write_is_in_flight():
+    client = SlowClient()
+    dispatcher = SendDispatcher(lambda lane: client)
+    try:
+        dispatcher.submit([('XCU-01', 'red', True)])
+        wait_idle(dispatcher)
+        
+        client.started.clear()
+        dispatcher.submit([('XCU-01', 'red', False)])
+        client.started.wait(1)
+        for state in (True, False, True):
+            dispatcher.submit([('XCU-01', 'red', state)])
+        wait_idle(dispatcher)
+        
+        assert client.shown[KEY] is True
+    finally:
+        dispatcher.stop()
+
+def test_lanes_are_per_gateway_and_batch_every_xcu():
+    clients = {}
+    
+    def factory(name):
+        clients[name] = SlowClient(delay=0)
+        return clients[name]
+    
+    dispatcher = SendDispatcher(factory, lane_key=lambda xcu: 'a' if xcu < 'XCU-05' else 'b')
+    try:
+        dispatcher.submit([('XCU-01', 'red', True), ('XCU-02', 'red', True), ('XCU-07', 'green', True)])
+        wait_idle(dispatcher)
+        
+        assert sorted(clients) == ['a', 'b']
+        assert [len(write) for write in clients['a'].writes] == [2]
+        assert [len(write) for write in clients['b'].writes] == [1]
+    finally:
+        dispatcher.stop()
+
+def test_rejected_xcu_does_not_hold_up_the_others():
+    client = SlowClient(delay=0, reject={'XCU-03'})
+    dispatcher = SendDispatcher(lambda lane: client, deadline=0.3, retry_delay=0.05)
+    try:
+        dispatcher.submit([('XCU-01', 'red', True), ('XCU-02', 'red', True), ('XCU-03', 'red', True)])
+        time.sleep(0.1)
+        assert client.shown == {('XCU-01', 'red'): True, ('XCU-02', 'red'): True}
+        assert dispatcher.stats()['lanes']['gateway']['suspect'] == ['XCU-03']
+        
+        # The suspect XCU is written on its own, so the next change is one write that succeeds
+        client.writes.clear()
+        dispatcher.submit([('XCU-01', 'red', False)])
+        time.sleep(0.1)
+        assert [('XCU-01', 'red', False)] in client.writes
+        assert client.shown[KEY] is False
+        
+        wait_idle(dispatcher)
+        assert dispatcher.stats()['lanes']['gateway']['expired'] == 1
+    finally:
+        dispatcher.stop()
+
+def test_commands_skipped_for_unknown_sessions_are_not_acked():
+    client = SlowClient(delay=0, unknown={'XCU-09'})
+    dispatcher = SendDispatcher(lambda lane: client)
+    acks = []
+    journal = TallyJournal(None)
+    dispatcher.add_ack_callback(acks.extend)
+    dispatcher.add_ack_callback(journal.record_acked)
+    try:
+        dispatcher.submit([('XCU-01', 'red', True), ('XCU-09', 'red', True)])
+        wait_idle(dispatcher)
+        
+        lane = dispatcher.lanes['gateway']
+        assert acks == [('XCU-01', 'red', True)]
+        # Never journaled as shown, so a warm start after a restart still sends it
+        assert journal.acked == {'XCU-01': RED}
+        assert lane.acked == {KEY: True}
+        assert lane.skipped == 1
+        assert client.writes == [[('XCU-01', 'red', True)]]
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,97 @@
+"""Tests for the source-indexed lamp diffing"""
+
+from tally_index import TallyIndex
+
+MAPPING = {'input1': 'XCU-01', 'input2': 'XCU-02', 'input3': 'XCU-03'}
+
+def test_update_lights_program_and_preview():
+    index = TallyIndex(MAPPING)
+    
+    commands = index.update(['input1'], 'input2')
+    
+    assert sorted(commands) == [('XCU-01', 'red', True), ('XCU-02', 'green', True)]
+    assert index.states() == {
+        'XCU-01': {'red': True, 'green': False},
+        'XCU-02': {'red': False, 'green': True},
+        'XCU-03': {'red': False, 'green': False},
+    }
+
+def test_update_only_sends_what_changed():
+    index = TallyIndex(MAPPING)
+    index.update(['input1'], 'input2')
+    
+    assert index.update(['input1'], 'input2') == []
+    assert sorted(index.update(['input2'], 'input3')) == [
+        ('XCU-01', 'red', False),
+        ('XCU-02', 'green', False),
+        ('XCU-02', 'red', True),
+        ('XCU-03', 'green', True),
+    ]
+
+def test_update_ignores_unmapped_sources():
+    index = TallyIndex(MAPPING)
+    
+    assert index.update(['input9', 'ddr1'], 'input9') == []
+    assert index.update(['input1', 'ddr1'], None) == [('XCU-01', 'red', True)]
+
+def test_xcu_stays_lit_while_any_of_its_sources_is_on_air():
+    index = TallyIndex({'input1': 'XCU-01', 'input2': 'XCU-01', 'input3': ['XCU-01', 'XCU-02']})
+    
+    assert index.update(['input1', 'input2'], None) == [('XCU-01', 'red', True)]
+    assert index.update(['input2'], None) == []
+    assert index.update([], 'input3') == [
+        ('XCU-01', 'red', False),
+        ('XCU-01', 'green', True),
+        ('XCU-02', 'green', True),
+    ]
+
+def test_source_on_program_and_preview_lights_both_lamps():
+    index = TallyIndex(MAPPING)
+    
+    assert sorted(index.update(['input1'], 'input1')) == [('XCU-01', 'green', True), ('XCU-01', 'red', True)]
+    assert index.update(['input1'], None) == [('XCU-01', 'green', False)]
+
+def test_remap_keeps_lamps_of_xcus_still_mapped():
+    index = TallyIndex(MAPPING)
+    index.update(['input1'], 'input2')
+    
+    commands = index.remap({'input1': 'XCU-01', 'input2': 'XCU-02', 'input4': 'XCU-04'})
+    
+    # XCU-03 was dark and XCU-04's source is off air, so nothing changes
+    assert commands == []
+    assert index.states()['XCU-01'] == {'red': True, 'green': False}
+    assert index.states()['XCU-02'] == {'red': False, 'green': True}
+
+def test_remap_moves_the_lamps_with_the_source():
+    index = TallyIndex(MAPPING)
+    index.update(['input1'], 'input2')
+    
+    commands = index.remap({'input1': 'XCU-02', 'input2': 'XCU-01', 'input3': 'XCU-03'})
+    
+    assert sorted(commands) == [
+        ('XCU-01', 'green', True),
+        ('XCU-01', 'red', False),
+        ('XCU-02', 'green', False),
+        ('XCU-02', 'red', True),
+    ]
+
+def test_remap_switches_off_xcus_no_longer_mapped():
+    index = TallyIndex(MAPPING)
+    index.update(['input3'], 'input1')
+    
+    commands = index.remap({'input1': 'XCU-01'})
+    
+    assert commands == [('XCU-03', 'red', False)]
+    assert index.states() == {'XCU-01': {'red': False, 'green': True}}
+
+def test_update_after_remap_diffs_against_the_new_mapping():
+    index = TallyIndex(MAPPING)
+    index.update(['input1'], None)
+    
+    assert index.remap({'input1': ['XCU-01', 'XCU-05']}) == [('XCU-05', 'red', True)]
+    assert sorted(index.update([], 'input1')) == [
+        ('XCU-01', 'green', True),
+        ('XCU-01', 'red', False),
+        ('XCU-05', 'green', True),
+        ('XCU-05', 'red', False),
+    ]
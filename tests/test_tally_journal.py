@@ -0,0 +1,106 @@
+"""Tests for the lamp state journal and the warm start"""
+
+import os
+
+from tally_index import GREEN, RED
+from tally_journal import MAGIC, TallyJournal, WarmStart
+
+def reopen(path):
+    journal = TallyJournal(path)
+    return journal, journal.load()
+
+def test_replay_restores_desired_and_acked(tmp_path):
+    path = str(tmp_path / 'journal.bin')
+    journal, loaded = reopen(path)
+    assert loaded == ({}, {})
+    
+    journal.record_desired([('XCU-01', 'red', True), ('XCU-02', 'green', True)])
+    journal.record_acked([('XCU-01', 'red', True)])
+    journal.record_desired([('XCU-02', 'green', False), ('XCU-02', 'red', True)])
+    journal.close()
+    
+    journal, (desired, acked) = reopen(path)
+    assert desired == {'XCU-01': RED, 'XCU-02': RED}
+    assert acked == {'XCU-01': RED}
+
+def test_torn_record_at_the_end_is_dropped(tmp_path):
+    path = str(tmp_path / 'journal.bin')
+    journal, _ = reopen(path)
+    journal.record_desired([('XCU-01', 'red', True)])
+    journal.record_acked([('XCU-01', 'red', True)])
+    journal.close()
+    intact = os.path.getsize(path)
+    
+    # A crash part way through appending XCU-02's name and state
+    journal, _ = reopen(path)
+    journal.record_desired([('XCU-02', 'green', True)])
+    journal.close()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)
+    
+    journal, (desired, acked) = reopen(path)
+    assert desired == {'XCU-01': RED}
+    assert acked == {'XCU-01': RED}
+    # The file is rewritten without the torn bytes, so new records append cleanly
+    assert os.path.getsize(path) == intact
+    journal.record_acked([('XCU-01', 'green', True)])
+    journal.close()
+    assert reopen(path)[1] == ({'XCU-01': RED}, {'XCU-01': RED | GREEN})
+
+def test_file_without_the_header_is_ignored(tmp_path):
+    path = tmp_path / 'journal.bin'
+    path.write_bytes(b'not a journal at all')
+    
+    journal, loaded = reopen(str(path))
+    
+    assert loaded == ({}, {})
+    assert path.read_bytes() == MAGIC
+
+def test_compaction_keeps_one_record_per_lit_state(tmp_path):
+    path = str(tmp_path / 'journal.bin')
+    journal = TallyJournal(path, compact_bytes=64)
+    journal.load()
+    
+    for _ in range(50):
+        journal.record_acked([('XCU-01', 'red', True), ('XCU-02', 'green', True)])
+        journal.record_acked([('XCU-01', 'red', False), ('XCU-02', 'green', False)])
+    journal.record_acked([('XCU-03', 'red', True)])
+    journal.close()
+    
+    assert journal.compactions > 1
+    assert os.path.getsize(path) < 128
+    assert reopen(path)[1] == ({}, {'XCU-03': RED})
+
+def test_warm_start_drops_commands_for_lamps_already_shown():
+    warm = WarmStart({'XCU-01': RED}, {'XCU-01': RED})
+    
+    assert warm.filter([('XCU-01', 'red', True), ('XCU-02', 'red', False)]) == []
+    assert warm.filter([('XCU-01', 'red', False)]) == [('XCU-01', 'red', False)]
+    assert warm.skipped == 2
+
+def test_warm_start_always_sends_lamps_never_acknowledged():
+    warm = WarmStart({'XCU-01': RED | GREEN}, {'XCU-01': RED})
+    
+    assert warm.filter([('XCU-01', 'green', True)]) == [('XCU-01', 'green', True)]
+    assert warm.filter([('XCU-01', 'green', True)]) == []
+
+def test_warm_start_finish_corrects_what_is_still_wrong():
+    warm = WarmStart({'XCU-01': RED, 'XCU-02': GREEN | RED}, {'XCU-01': RED, 'XCU-02': GREEN})
+    
+    commands = warm.finish({'XCU-03': GREEN})
+    
+    assert sorted(commands) == [
+        ('XCU-01', 'red', False),
+        ('XCU-02', 'green', False),
+        ('XCU-02', 'red', False),
+        ('XCU-03', 'green', True),
+    ]
+    assert warm.done
+
+def test_warm_start_without_a_journal_is_done():
+    assert WarmStart({}, {}).done
+
+def test_warm_start_expires_after_its_timeout():
+    assert not WarmStart({'XCU-01': RED}, {'XCU-01': RED}).expired()
+    assert not WarmStart({'XCU-01': RED}, {'XCU-01': RED}, timeout=60).expired()
+    assert WarmStart({'XCU-01': RED}, {'XCU-01': RED}, timeout=0).expired()
@@ -0,0 +1,121 @@
+"""Tests for the background lamp re-assertion"""
+
+import time
+
+from tally_reconciler import Reconciler
+
+class FakeDispatcher:
+    """Records what the reconciler queues; live traffic is simulated by setting last_live"""
+    
+    def __init__(self):
+        self.last_live = 0
+        self.submitted = []
+        self.on_submit = None
+        self.ack_callbacks = []
+        self.acking = True
+    
+    def add_reset_callback(self, callback):
+        pass
+    
+    def add_ack_callback(self, callback):
+        self.ack_callbacks.append(callback)
+    
+    def idle_time(self):
+        return time.monotonic() - self.last_live
+    
+    def lane_xcus(self, name):
+        return set()
+    
+    def submit(self, commands, origin=None, background=False):
+        assert background
+        self.submitted += commands
+        if self.acking:
+            for callback in self.ack_callbacks:
+                callback(commands)
+        if self.on_submit:
+            self.on_submit()
+
+def make_desired(count):
+    states = {f"XCU-{i:03d}": {'red': i == 1, 'green': False} for i in range(count)}
+    calls = []
+    
+    def desired():
+        calls.append(1)
+        return {xcu: dict(lamps) for xcu, lamps in states.items()}
+    
+    return states, calls, desired
+
+def test_full_pass_takes_one_snapshot_when_nothing_changes():
+    states, calls, desired = make_desired(50)
+    dispatcher = FakeDispatcher()
+    reconciler = Reconciler(desired, dispatcher, rate=100000, quiet=0)
+    reconciler.running = True
+    
+    reconciler._full_pass()
+    
+    assert len(calls) == 1
+    assert len(dispatcher.submitted) == 100
+    assert ('XCU-001', 'red', True) in dispatcher.submitted
+
+def test_full_pass_takes_a_new_snapshot_after_live_commands():
+    states, calls, desired = make_desired(4)
+    dispatcher = FakeDispatcher()
+    reconciler = Reconciler(desired, dispatcher, rate=100000, quiet=0)
+    reconciler.running = True
+    
+    def cut():
+        # A live cut lights XCU-003 while the pass is at XCU-000
+        if len(dispatcher.submitted) == 2:
+            states['XCU-003']['red'] = True
+            dispatcher.last_live = time.monotonic()
+    
+    dispatcher.on_submit = cut
+    reconciler._full_pass()
+    
+    assert len(calls) == 2
+    assert ('XCU-003', 'red', True) in dispatcher.submitted
+    assert ('XCU-003', 'red', False) not in dispatcher.submitted
+
+def test_unmapped_xcus_are_switched_off():
+    states, calls, desired = make_desired(2)
+    dispatcher = FakeDispatcher()
+    reconciler = Reconciler(desired, dispatcher, rate=100000, quiet=0)
+    reconciler.running = True
+    reconciler._full_pass()
+    
+    del states['XCU-001']
+    dispatcher.submitted.clear()
+    reconciler._full_pass()
+    
+    assert ('XCU-001', 'red', False) in dispatcher.submitted
+    assert ('XCU-001', 'green', False) in dispatcher.submitted
+    
+    # Acknowledged off, so later passes leave XCU-001 alone
+    dispatcher.submitted.clear()
+    reconciler._full_pass()
+    
+    assert [command for command in dispatcher.submitted if command[0] == 'XCU-001'] == []
+    assert reconciler.known == {'XCU-000'}
+
+def test_unmapped_xcu_is_switched_off_until_acknowledged():
+    states, calls, desired = make_desired(2)
+    dispatcher = FakeDispatcher()
+    reconciler = Reconciler(desired, dispatcher, rate=100000, quiet=0)
+    reconciler.running = True
+    reconciler._full_pass()
+    
+    del states['XCU-001']
+    dispatcher.acking = False
+    reconciler._full_pass()
+    dispatcher.submitted.clear()
+    reconciler._full_pass()
+    
+    assert ('XCU-001', 'red', False) in dispatcher.submitted
+    
+    # Mapped again before the off was acknowledged: it is driven as usual
+    states['XCU-001'] = {'red': True, 'green': False}
+    dispatcher.submitted.clear()
+    reconciler._full_pass()
+    
+    assert ('XCU-001', 'red', True) in dispatcher.submitted
+    assert reconciler.retiring == {}
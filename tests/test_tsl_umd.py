@@ -0,0 +1,88 @@
+"""Tests for the TSL UMD v3.1 and v5.0 codecs"""
+
+import pytest
+
+from tsl_umd import (TcpUnwrapper, TslReceiver, V5_MAX_PACKET, decode_v31, decode_v5, encode_v31, encode_v5,
+                     v31_message, wrap_tcp)
+
+MESSAGES = [
+    (0, False, False, 'Black'),
+    (1, True, False, 'Cam 1'),
+    (2, False, True, 'Cam 2'),
+    (3, True, True, 'Cam 3'),
+]
+
+def test_v31_round_trip():
+    (payload,) = encode_v31(MESSAGES)
+    
+    assert len(payload) == 18 * len(MESSAGES)
+    assert decode_v31(payload) == MESSAGES
+
+def test_v31_cuts_text_and_leaves_out_addresses_it_cannot_reach():
+    (payload,) = encode_v31([(5, True, False, 'A very long camera name'), (200, True, False, 'Too high')])
+    
+    assert decode_v31(payload) == [(5, True, False, 'A very long came')]
+    assert encode_v31([(127, True, False, 'x')]) == []
+    with pytest.raises(ValueError):
+        v31_message(127, True, False)
+
+def test_v31_decode_skips_bytes_that_are_not_a_message():
+    payload = b'\x00\x01' + v31_message(7, False, True, 'Cam 7')
+    
+    assert decode_v31(payload) == [(7, False, True, 'Cam 7')]
+
+def test_v5_round_trip():
+    (packet,) = encode_v5(MESSAGES + [(4000, True, False, 'Remote')], screen=2)
+    
+    assert decode_v5(packet) == MESSAGES + [(4000, True, False, 'Remote')]
+
+def test_v5_splits_packets_at_the_size_limit():
+    messages = [(index, index % 2 == 0, False, f"Camera {index:04d}") for index in range(500)]
+    
+    packets = encode_v5(messages)
+    
+    assert len(packets) > 1
+    assert all(len(packet) <= V5_MAX_PACKET for packet in packets)
+    assert [message for packet in packets for message in decode_v5(packet)] == messages
+
+def test_v5_decode_rejects_a_short_packet():
+    with pytest.raises(ValueError):
+        decode_v5(b'\x01')
+
+def test_v5_tcp_framing_round_trip_with_escaped_bytes():
+    # Index 254 and its length bytes put DLE (0xFE) bytes in the packet
+    packets = encode_v5([(254, True, False, 'x' * 254), (1, False, True, 'Cam 1')])
+    stream = b''.join(wrap_tcp(packet) for packet in packets)
+    unwrapper = TcpUnwrapper()
+    
+    # Fed a few bytes at a time, as TCP may deliver it
+    received = []
+    for pos in range(0, len(stream), 7):
+        received += unwrapper.feed(stream[pos:pos + 7])
+    
+    assert received == packets
+
+@pytest.mark.parametrize('version, encode', [('3.1', encode_v31), ('5.0', encode_v5)])
+def test_receiver_reports_program_and_preview(version, encode):
+    updates = []
+    receiver = TslReceiver(0, lambda program, preview: updates.append((program, preview)), version=version,
+                           sources={3: 'ddr1'})
+    
+    for packet in encode(MESSAGES):
+        receiver.apply(receiver.decode(packet))
+    
+    program, preview = updates[-1]
+    assert program == [{'source': 'input1', 'label': 'Cam 1'}, {'source': 'ddr1', 'label': 'Cam 3'}]
+    assert preview == {'source': 'input2', 'label': 'Cam 2'}
+
+def test_receiver_only_reports_changes():
+    updates = []
+    unchanged = []
+    receiver = TslReceiver(0, lambda program, preview: updates.append(program),
+                           on_unchanged=lambda: unchanged.append(1))
+    (packet,) = encode_v5(MESSAGES)
+    
+    assert receiver.apply(receiver.decode(packet))
+    assert not receiver.apply(receiver.decode(packet))
+    assert len(updates) == 1
+    assert len(unchanged) == 1
@@ -0,0 +1,56 @@
+"""Tests for the switcher label cache"""
+
+import time
+
+from vectar_client import LabelCache
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+
+class FlakyClient:
+    """Switcher client that fails until told otherwise, counting its fetches"""
+    
+    def __init__(self):
+        self.up = False
+        self.fetches = 0
+    
+    def get_if_changed(self, url):
+        self.fetches += 1
+        if not self.up:
+            raise ConnectionError("switcher unreachable")
+        return Response(b'input1=Cam 1')
+    
+    def invalidate(self, url):
+        pass
+
+def parse(content):
+    return dict([content.decode().split('=')])
+
+def test_unloaded_labels_are_fetched_at_most_every_retry_interval():
+    client = FlakyClient()
+    cache = LabelCache(client, 'url', parse, retry_interval=60)
+    
+    for _ in range(10):
+        assert cache.get() == {}
+    assert client.fetches == 1
+    
+    client.up = True
+    cache.last_attempt = time.monotonic() - 60
+    assert cache.get() == {'input1': 'Cam 1'}
+    assert cache.get() == {'input1': 'Cam 1'}
+    assert client.fetches == 2
+
+def test_get_never_fetches_with_a_background_refresher():
+    client = FlakyClient()
+    cache = LabelCache(client, 'url', parse)
+    cache.background = True
+    
+    assert cache.get() == {}
+    assert client.fetches == 0
+    assert cache.delay() == cache.retry_interval
+    
+    client.up = True
+    cache.refresh()
+    assert cache.get() == {'input1': 'Cam 1'}
+    assert cache.delay() == cache.ttl
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Topology - which switchers feed the relay and which gateways drive which XCUs
+
+By default the relay follows one Vectar (VECTAR_IP in app.py) and sends
+everything to one GV Gateway (DEFAULT_IP / XCU_SESSION_IDS in
+gv_tally_control.py). A topology file describes larger setups instead:
+several switchers whose tally is merged (Vectars, or TSL UMD sources), several
+gateways, each with its own XCUs, and TSL UMD displays to send the tally
+to. See topology.example.json.
+"""
+
+import json
+import os
+from urllib.parse import urlsplit
+
+from gv_tally_control import GatewayClient
+from session_cache import SessionCache
+from tally_index import LampTable
+from tsl_umd import VERSIONS as TSL_VERSIONS, TRANSPORTS as TSL_TRANSPORTS, TslSender
+
+# Discovered session IDs are saved next to the scripts, one file per gateway
+SESSIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# How the tally of several switchers is combined for an XCU
+MERGE_POLICIES = ('any-program-wins', 'priority')
+
+class SwitcherConfig:
+    """One Vectar feeding the relay"""
+    
+    kind = 'vectar'
+    
+    def __init__(self, name, host, user='admin', password='password', notify_port=5951, mapping=None,
+                 scheme='http', notify_host=None):
+        """
+        Initialize the SwitcherConfig
+        
+        Args:
+            name: Name shown in the status and stats
+            host: Host name or IP, with an optional :port for the HTTP API
+            user: Digest auth username
+            password: Digest auth password
+            notify_port: TCP notification port (None to always poll)
+            mapping: Source to XCU mapping for this switcher (None to use the shared camera mapping)
+            scheme: URL scheme of the HTTP API
+            notify_host: Host for push notifications (default: the HTTP API host)
+        """
+        self.name = name
+        self.host = host
+        self.user = user
+        self.password = password
+        self.notify_port = notify_port
+        self.mapping = mapping
+        self.scheme = scheme
+        self._notify_host = notify_host
+    
+    @property
+    def switcher_url(self):
+        return f"{self.scheme}://{self.host}/v1/dictionary?key=switcher"
+    
+    @property
+    def tally_url(self):
+        return f"{self.scheme}://{self.host}/v1/dictionary?key=tally"
+    
+    @property
+    def notify_host(self):
+        """Host for push notifications, or None if they are disabled"""
+        if self.notify_port is None:
+            return None
+        return self._notify_host or urlsplit(self.tally_url).hostname
+
+class TslInputConfig:
+    """A TSL UMD source (router, other switcher) feeding the relay instead of a Vectar"""
+    
+    kind = 'tsl'
+    
+    def __init__(self, name, port, version='5.0', transport='udp', host='0.0.0.0', sources=None, mapping=None):
+        """
+        Initialize the TslInputConfig
+        
+        Args:
+            name: Name shown in the status and stats
+            port: Port to listen on for TSL messages
+            version: TSL version, '3.1' or '5.0'
+            transport: 'udp' or 'tcp'
+            host: Address to listen on
+            sources: Dict of UMD index to source name (default: index N is inputN)
+            mapping: Source to XCU mapping for this source (None to use the shared camera mapping)
+        """
+        if version not in TSL_VERSIONS:
+            raise ValueError(f"Unknown TSL version {version!r}, must be one of: {', '.join(TSL_VERSIONS)}")
+        if transport not in TSL_TRANSPORTS:
+            raise ValueError(f"Unknown TSL transport {transport!r}, must be one of: {', '.join(TSL_TRANSPORTS)}")
+        self.name = name
+        self.port = port
+        self.version = version
+        self.transport = transport
+        self.host = host
+        self.sources = sources
+        self.mapping = mapping
+
+class TslOutputConfig:
+    """A TSL UMD display, router or multiviewer the relay sends its tally to"""
+    
+    def __init__(self, host, port, version='5.0', transport='udp', screen=0):
+        """
+        Initialize the TslOutputConfig
+        
+        Args:
+            host: Display host
+            port: Its TSL port
+            version: TSL version, '3.1' or '5.0'
+            transport: 'udp' or 'tcp'
+            screen: v5.0 screen index
+        """
+        if version not in TSL_VERSIONS:
+            raise ValueError(f"Unknown TSL version {version!r}, must be one of: {', '.join(TSL_VERSIONS)}")
+        if transport not in TSL_TRANSPORTS:
+            raise ValueError(f"Unknown TSL transport {transport!r}, must be one of: {', '.join(TSL_TRANSPORTS)}")
+        self.host = host
+        self.port = port
+        self.version = version
+        self.transport = transport
+        self.screen = screen
+    
+    def sender(self):
+        """A TslSender for this display"""
+        return TslSender(self.host, self.port, self.version, self.transport, self.screen)
+
+class GatewayConfig:
+    """One GV LDK Gateway and the XCUs it drives"""
+    
+    def __init__(self, name, ip, port=8080, session_ids=None, discover=False):
+        """
+        Initialize the GatewayConfig
+        
+        Args:
+            name: Name for logs and stats
+            ip: Gateway IP address
+            port: Gateway port
+            session_ids: SessionCache, or dict of configured XCU session IDs for the XCUs on
+                this gateway (a cache persisted as session_ids_<name>.json is built around it)
+            discover: Ask the gateway for its basestations on every connect, not only
+                listen to its announcements
+        """
+        self.name = name
+        self.ip = ip
+        self.port = port
+        self.discover = discover
+        if not isinstance(session_ids, SessionCache):
+            session_ids = SessionCache(session_ids, os.path.join(SESSIONS_DIR, f"session_ids_{name}.json"))
+        self.session_ids = session_ids
+
+class Topology:
+    """Switchers, gateways, TSL outputs, the merge policy between the switchers and the lamp table"""
+    
+    def __init__(self, switchers, gateways, merge='any-program-wins', tsl_outputs=None, umd_map=None, lamps=None):
+        """
+        Initialize the Topology
+        
+        Args:
+            switchers: List of SwitcherConfig or TslInputConfig, highest priority first
+            gateways: List of GatewayConfig, the first one takes any XCU not listed elsewhere
+            merge: Merge policy, one of MERGE_POLICIES
+            tsl_outputs: List of TslOutputConfig
+            umd_map: Dict of source name to UMD index for the TSL outputs (default: inputN is index N)
+            lamps: LampTable for every XCU (default: red on program, green on preview)
+        """
+        if not switchers:
+            raise ValueError("At least one switcher is required")
+        if not gateways:
+            raise ValueError("At least one gateway is required")
+        if merge not in MERGE_POLICIES:
+            raise ValueError(f"Unknown merge policy {merge!r}, must be one of: {', '.join(MERGE_POLICIES)}")
+        names = [s.name for s in switchers]
+        if len(set(names)) != len(names):
+            raise ValueError("Switcher names must be unique")
+        names = [g.name for g in gateways]
+        if len(set(names)) != len(names):
+            raise ValueError("Gateway names must be unique")
+        
+        self.switchers = switchers
+        self.gateways = gateways
+        self.merge = merge
+        self.tsl_outputs = tsl_outputs or []
+        self.umd_map = umd_map or {}
+        self.lamps = lamps or LampTable.from_config('independent')
+    
+    def gateway_for(self, xcu):
+        """
+        Gateway that drives an XCU, looked up on every send so an XCU follows
+        the gateway that announces it.
+        
+        Returns:
+            GatewayConfig: The first gateway that has announced the XCU, else the first
+                that lists it, else the first gateway
+        """
+        for gateway in self.gateways:
+            if xcu in gateway.session_ids.discovered:
+                return gateway
+        for gateway in self.gateways:
+            if xcu in gateway.session_ids:
+                return gateway
+        return self.gateways[0]
+    
+    def lane_for(self, xcu):
+        """SendDispatcher lane key: the name of the gateway that drives an XCU"""
+        return self.gateway_for(xcu).name
+    
+    def client_for(self, name):
+        """SendDispatcher client factory: the connection for the lane of one gateway"""
+        gateway = next(gateway for gateway in self.gateways if gateway.name == name)
+        return GatewayClient(gateway.ip, gateway.port, session_ids=gateway.session_ids, discover=gateway.discover)
+
+def tsl_version(value):
+    """TSL version from a topology file, which may give it as a number (5 or 3.1)"""
+    try:
+        return f"{float(value):.1f}"
+    except (TypeError, ValueError):
+        return str(value)
+
+def parse_switcher(s):
+    """A SwitcherConfig or TslInputConfig from its topology file entry"""
+    if s.get('type', 'vectar') == 'tsl':
+        return TslInputConfig(
+            s['name'], s['port'], tsl_version(s.get('version', '5.0')), s.get('transport', 'udp'),
+            s.get('host', '0.0.0.0'), s.get('sources'), s.get('mapping'))
+    return SwitcherConfig(
+        s['name'], s['host'], s.get('user', 'admin'), s.get('password', 'password'),
+        s.get('notify_port', 5951), s.get('mapping'), s.get('scheme', 'http'), s.get('notify_host'))
+
+def parse_topology(config):
+    """
+    Build a Topology from a parsed topology file.
+    
+    Args:
+        config: Dict with 'switchers', 'gateways' and optional 'merge', 'tsl_outputs', 'umd_map' and
+            'lamps' keys
+    
+    Returns:
+        Topology: The topology
+    
+    Raises:
+        ValueError: If the configuration is invalid
+    """
+    try:
+        switchers = [parse_switcher(s) for s in config['switchers']]
+        gateways = [
+            GatewayConfig(g['name'], g['ip'], g.get('port', 8080), g.get('xcus', {}), bool(g.get('discover', False)))
+            for g in config['gateways']
+        ]
+        tsl_outputs = [
+            TslOutputConfig(o['host'], o['port'], tsl_version(o.get('version', '5.0')), o.get('transport', 'udp'),
+                            o.get('screen', 0))
+            for o in config.get('tsl_outputs', [])
+        ]
+        umd_map = {str(source): int(index) for source, index in config.get('umd_map', {}).items()}
+        lamps = LampTable.from_config(config.get('lamps', 'independent'))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid topology: missing or malformed {e}")
+    return Topology(switchers, gateways, config.get('merge', 'any-program-wins'), tsl_outputs, umd_map, lamps)
+
+def load_topology(path, default):
+    """
+    Load the topology file, or use the single switcher/gateway default if there is none.
+    
+    Args:
+        path: Topology file path
+        default: Topology to use when the file does not exist or is invalid
+    
+    Returns:
+        Topology: The topology
+    """
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r') as f:
+            topology = parse_topology(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f"Error loading topology from {path}: {e}, using the default single switcher and gateway")
+        return default
+    print(f"Loaded topology from {path}: {len(topology.switchers)} switchers, {len(topology.gateways)} gateways, "
+          f"{len(topology.tsl_outputs)} TSL outputs, merge {topology.merge}, lamps {', '.join(topology.lamps.names)}")
+    return topology
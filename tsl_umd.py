@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+TSL UMD - tally to and from routers, multiviewers and other switchers
+
+Speaks TSL UMD v3.1 (18 byte messages, UMD addresses 0-126) and v5.0
+(UMD indexes 0-65534, several per packet) over UDP or TCP. TslSender is an
+output for the relay's tally, TslReceiver lets the relay follow a tally
+source that speaks TSL instead of a Vectar.
+
+Program is sent as red, preview as green: tally 1 and 2 in v3.1, the
+right-hand and left-hand tallies in v5.0, with the text tally showing
+whichever is on (red if both).
+"""
+
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger('tsl_umd')
+
+VERSIONS = ('3.1', '5.0')
+TRANSPORTS = ('udp', 'tcp')
+
+# v3.1: header byte (0x80 + address), control byte, 16 characters of text
+V31_MESSAGE_SIZE = 18
+V31_MAX_ADDRESS = 126
+V31_TEXT_SIZE = 16
+
+# v5.0: 16 bit byte count, version, flags, screen, then the display messages
+V5_HEADER = struct.Struct('<HBBH')
+V5_MESSAGE = struct.Struct('<HHH')
+V5_MAX_PACKET = 2048
+V5_BROADCAST = 0xFFFF
+V5_FLAG_UNICODE = 0x01
+V5_CONTROL_DATA = 0x8000
+
+# v5.0 over TCP: each packet starts with DLE/STX, and DLE bytes in it are doubled
+DLE = 0xFE
+STX = 0x02
+
+# v5.0 tally colours, as bits so amber counts as both
+TALLY_OFF = 0
+TALLY_RED = 1
+TALLY_GREEN = 2
+TALLY_AMBER = 3
+
+BRIGHTNESS_FULL = 3
+
+def v31_message(address, program, preview, text=''):
+    """
+    Encode one v3.1 display message.
+    
+    Args:
+        address: UMD address, 0-126
+        program: Tally 1 (red)
+        preview: Tally 2 (green)
+        text: Display text, cut or padded to 16 characters
+    
+    Returns:
+        bytes: The 18 byte message
+    """
+    if not 0 <= address <= V31_MAX_ADDRESS:
+        raise ValueError(f"TSL v3.1 address {address} out of range 0-{V31_MAX_ADDRESS}")
+    control = (BRIGHTNESS_FULL << 4) | (1 if program else 0) | (2 if preview else 0)
+    text = text.encode('ascii', 'replace')[:V31_TEXT_SIZE].ljust(V31_TEXT_SIZE)
+    return bytes((0x80 | address, control)) + text
+
+def encode_v31(messages):
+    """
+    Encode display messages as v3.1.
+    
+    Args:
+        messages: List of (index, program, preview, text)
+    
+    Returns:
+        list: One bytes payload, all messages back to back (indexes v3.1 can't address are left out)
+    """
+    payload = b''.join(
+        v31_message(index, program, preview, text)
+        for index, program, preview, text in messages if index <= V31_MAX_ADDRESS
+    )
+    return [payload] if payload else []
+
+def decode_v31(data):
+    """
+    Decode v3.1 display messages, skipping anything that isn't one.
+    
+    Returns:
+        list: (index, program, preview, text) tuples
+    """
+    messages = []
+    pos = 0
+    while pos + V31_MESSAGE_SIZE <= len(data):
+        if not data[pos] & 0x80:
+            pos += 1
+            continue
+        control = data[pos + 1]
+        text = data[pos + 2:pos + V31_MESSAGE_SIZE].decode('ascii', 'replace').strip()
+        messages.append((data[pos] & 0x7F, bool(control & 1), bool(control & 2), text))
+        pos += V31_MESSAGE_SIZE
+    return messages
+
+def v5_control(program, preview):
+    """v5.0 control word for a UMD's program/preview state"""
+    right = TALLY_RED if program else TALLY_OFF
+    left = TALLY_GREEN if preview else TALLY_OFF
+    middle = TALLY_RED if program else TALLY_GREEN if preview else TALLY_OFF
+    return right | (middle << 2) | (left << 4) | (BRIGHTNESS_FULL << 6)
+
+def encode_v5(messages, screen=0):
+    """
+    Encode display messages as v5.0 packets.
+    
+    Args:
+        messages: List of (index, program, preview, text)
+        screen: Screen index
+    
+    Returns:
+        list: bytes packets, each no bigger than 2048 bytes
+    """
+    packets = []
+    body = []
+    size = V5_HEADER.size
+    for index, program, preview, text in messages:
+        text = text.encode('ascii', 'replace')
+        message = V5_MESSAGE.pack(index, v5_control(program, preview), len(text)) + text
+        if body and size + len(message) > V5_MAX_PACKET:
+            packets.append(V5_HEADER.pack(size - 2, 0, 0, screen) + b''.join(body))
+            body = []
+            size = V5_HEADER.size
+        body.append(message)
+        size += len(message)
+    if body:
+        packets.append(V5_HEADER.pack(size - 2, 0, 0, screen) + b''.join(body))
+    return packets
+
+def decode_v5(packet):
+    """
+    Decode a v5.0 packet.
+    
+    Returns:
+        list: (index, program, preview, text) tuples, without control data messages
+    
+    Raises:
+        ValueError: If the packet is malformed
+    """
+    if len(packet) < V5_HEADER.size:
+        raise ValueError("TSL v5 packet too short")
+    count, _, flags, _ = V5_HEADER.unpack_from(packet)
+    end = min(len(packet), count + 2)
+    encoding = 'utf-16-le' if flags & V5_FLAG_UNICODE else 'ascii'
+    messages = []
+    pos = V5_HEADER.size
+    while pos + V5_MESSAGE.size <= end:
+        index, control, length = V5_MESSAGE.unpack_from(packet, pos)
+        pos += V5_MESSAGE.size
+        data = packet[pos:pos + length]
+        pos += length
+        if control & V5_CONTROL_DATA:
+            continue
+        tallies = (control & 3) | ((control >> 2) & 3) | ((control >> 4) & 3)
+        messages.append((index, bool(tallies & TALLY_RED), bool(tallies & TALLY_GREEN),
+                         data.decode(encoding, 'replace').strip()))
+    return messages
+
+def wrap_tcp(packet):
+    """Frame a v5.0 packet for TCP: DLE/STX, then the packet with its DLE bytes doubled"""
+    return bytes((DLE, STX)) + packet.replace(bytes((DLE,)), bytes((DLE, DLE)))
+
+class TcpUnwrapper:
+    """Splits a v5.0 TCP byte stream back into packets"""
+    
+    def __init__(self):
+        self.buffer = bytearray()
+        self.in_packet = False
+        self.escape = False
+    
+    def feed(self, data):
+        """
+        Add received bytes and return any packets they complete.
+        
+        Returns:
+            list: bytes packets
+        """
+        packets = []
+        for byte in data:
+            if self.escape:
+                self.escape = False
+                if byte == STX:
+                    # A new packet starts, whatever was being collected is dropped
+                    self.buffer = bytearray()
+                    self.in_packet = True
+                    continue
+                if byte != DLE or not self.in_packet:
+                    continue
+            elif byte == DLE:
+                self.escape = True
+                continue
+            if not self.in_packet:
+                continue
+            self.buffer.append(byte)
+            if len(self.buffer) >= 2 and len(self.buffer) == struct.unpack_from('<H', self.buffer)[0] + 2:
+                packets.append(bytes(self.buffer))
+                self.buffer = bytearray()
+                self.in_packet = False
+        return packets
+
+def encoder_for(version, screen=0):
+    """The function that encodes display messages for a TSL version"""
+    if version == '3.1':
+        return encode_v31
+    return lambda messages: encode_v5(messages, screen)
+
+class TslSender:
+    """
+    Tally output to one TSL UMD display, router or multiviewer.
+    
+    Sends the UMD messages of every TallyCycle it is given. The encoded
+    packets are cached on the cycle, so every sender with the same version
+    and screen shares one encoding. Over TCP a worker thread does the
+    sending and reconnecting, and the full state is re-sent after every
+    reconnect.
+    """
+    
+    def __init__(self, host, port, version='5.0', transport='udp', screen=0, queue_size=64):
+        """
+        Initialize the TslSender
+        
+        Args:
+            host: Display or router host
+            port: Its TSL port
+            version: '3.1' or '5.0'
+            transport: 'udp' or 'tcp'
+            screen: v5.0 screen index
+            queue_size: Cycles a TCP sender may fall behind by before it drops them and resyncs
+        """
+        if version not in VERSIONS:
+            raise ValueError(f"Unknown TSL version {version!r}, must be one of: {', '.join(VERSIONS)}")
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown TSL transport {transport!r}, must be one of: {', '.join(TRANSPORTS)}")
+        self.host = host
+        self.port = port
+        self.version = version
+        self.transport = transport
+        self.screen = screen
+        self.key = ('tsl', version, screen)
+        self.encode = encoder_for(version, screen)
+        self.table = None
+        self.running = True
+        
+        # Counters
+        self.packets = 0
+        self.messages = 0
+        self.errors = 0
+        self.dropped = 0
+        
+        if transport == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.sock = None
+            self.queue = queue.Queue(queue_size)
+            self.resync = True
+            self.thread = threading.Thread(target=self._run_tcp, daemon=True)
+            self.thread.start()
+    
+    @property
+    def name(self):
+        return f"tsl {self.version} {self.transport}://{self.host}:{self.port}"
+    
+    def attach(self, table):
+        """Use a UmdTable for the full state sent after a TCP reconnect"""
+        self.table = table
+    
+    def send(self, cycle):
+        """Send a cycle's UMD messages"""
+        if not cycle.umds:
+            return
+        packets = cycle.encoded(self.key, self.encode)
+        self.messages += len(cycle.umds)
+        if self.transport == 'udp':
+            for packet in packets:
+                try:
+                    self.sock.sendto(packet, (self.host, self.port))
+                    self.packets += 1
+                except OSError as e:
+                    self.errors += 1
+                    logger.warning(f"Error sending TSL to {self.host}:{self.port}: {e}")
+            return
+        if self.version == '5.0':
+            packets = cycle.encoded(self.key + ('tcp',), lambda messages, udp=packets: [wrap_tcp(p) for p in udp])
+        try:
+            self.queue.put_nowait(packets)
+        except queue.Full:
+            # Too far behind to catch up message by message, send the whole state instead
+            self.dropped += 1
+            self.resync = True
+    
+    def _full_state(self):
+        """Packets for every UMD, for a (re)connected TCP display"""
+        if self.table is None:
+            return []
+        packets = self.encode(self.table.messages())
+        return [wrap_tcp(p) for p in packets] if self.version == '5.0' else packets
+    
+    def _run_tcp(self):
+        """Worker loop: keep the TCP connection up and write queued packets to it"""
+        while self.running:
+            try:
+                packets = self.queue.get(timeout=1)
+            except queue.Empty:
+                if not self.resync:
+                    continue
+                packets = []
+            try:
+                if self.sock is None:
+                    self.sock = socket.create_connection((self.host, self.port), timeout=2)
+                    self.resync = True
+                    logger.info(f"Connected to TSL display {self.host}:{self.port}")
+                if self.resync:
+                    self.resync = False
+                    packets = self._full_state()
+                    # Anything still queued is older than the full state
+                    while not self.queue.empty():
+                        self.queue.get_nowait()
+                for packet in packets:
+                    self.sock.sendall(packet)
+                    self.packets += 1
+            except OSError as e:
+                self.errors += 1
+                logger.warning(f"TSL display {self.host}:{self.port} unavailable: {e}")
+                self.close()
+                self.resync = True
+                time.sleep(1)
+    
+    def close(self):
+        """Close the TCP connection if it is open"""
+        if self.transport == 'tcp' and self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+    
+    def stop(self):
+        """Stop the sender"""
+        self.running = False
+        if self.transport == 'udp':
+            self.sock.close()
+        else:
+            self.thread.join(timeout=5)
+            self.close()
+    
+    def stats(self):
+        """Send counters in a JSON friendly form"""
+        return {
+            'packets': self.packets,
+            'messages': self.messages,
+            'errors': self.errors,
+            'dropped': self.dropped
+        }
+
+class TslReceiver:
+    """
+    Follows the tally of a TSL UMD source, e.g. a router or another switcher.
+    
+    Keeps the last state of every UMD index it hears about and reports the
+    sources on program and preview in the same form as a Vectar fetch:
+    program is every index with its red tally on, preview the lowest index
+    with its green tally on.
+    """
+    
+    def __init__(self, port, on_update, host='0.0.0.0', version='5.0', transport='udp', sources=None,
+                 on_unchanged=None):
+        """
+        Initialize the TslReceiver
+        
+        Args:
+            port: Port to listen on
+            on_update: Called with (program_sources, preview_source) when the tally changes
+            host: Address to listen on
+            version: '3.1' or '5.0'
+            transport: 'udp' or 'tcp'
+            sources: Dict of UMD index to source name (default: index N is inputN)
+            on_unchanged: Called when a message arrives that changes nothing
+        """
+        if version not in VERSIONS:
+            raise ValueError(f"Unknown TSL version {version!r}, must be one of: {', '.join(VERSIONS)}")
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown TSL transport {transport!r}, must be one of: {', '.join(TRANSPORTS)}")
+        self.host = host
+        self.port = port
+        self.on_update = on_update
+        self.on_unchanged = on_unchanged
+        self.version = version
+        self.transport = transport
+        self.sources = {int(index): name for index, name in (sources or {}).items()}
+        self.umds = {}  # Format: {3: (program, preview, text)}
+        self.lock = threading.Lock()
+        self.sock = None
+        self.thread = None
+        self.running = False
+        self.mode = 'push'
+        
+        # Counters
+        self.packets = 0
+        self.messages = 0
+        self.updates = 0
+        self.errors = 0
+        self.last_packet = None
+    
+    def source_name(self, index):
+        return self.sources.get(index) or f"input{index}"
+    
+    def decode(self, data):
+        """Decode one UDP datagram or unwrapped TCP packet"""
+        return decode_v31(data) if self.version == '3.1' else decode_v5(data)
+    
+    def apply(self, messages):
+        """
+        Merge received display messages and report the tally if it changed.
+        
+        Returns:
+            bool: True if the program/preview state or a label changed
+        """
+        self.packets += 1
+        self.messages += len(messages)
+        self.last_packet = time.monotonic()
+        with self.lock:
+            changed = False
+            for index, program, preview, text in messages:
+                state = (program, preview, text)
+                if self.umds.get(index) != state:
+                    self.umds[index] = state
+                    changed = True
+        if changed:
+            self.report()
+        elif self.on_unchanged:
+            self.on_unchanged()
+        return changed
+    
+    def report(self):
+        """Send the current program/preview state to on_update"""
+        with self.lock:
+            umds = sorted(self.umds.items())
+        program_sources = []
+        preview_source = None
+        for index, (program, preview, text) in umds:
+            name = self.source_name(index)
+            source = {'source': name, 'label': text or name}
+            if program:
+                program_sources.append(source)
+            if preview and preview_source is None:
+                preview_source = source
+        self.updates += 1
+        self.on_update(program_sources, preview_source)
+    
+    def start(self):
+        """Listen in a background thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop listening"""
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+    
+    def run(self):
+        """Listen for TSL messages until stopped"""
+        self.running = True
+        if self.transport == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind((self.host, self.port))
+            logger.info(f"Listening for TSL {self.version} on udp {self.host}:{self.port}")
+            while self.running:
+                try:
+                    data = self.sock.recv(65535)
+                except OSError:
+                    return
+                self._received(data)
+            return
+        
+        self.sock = socket.create_server((self.host, self.port))
+        logger.info(f"Listening for TSL {self.version} on tcp {self.host}:{self.port}")
+        while self.running:
+            try:
+                conn, address = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_tcp, args=(conn, address), daemon=True).start()
+    
+    def _serve_tcp(self, conn, address):
+        logger.info(f"TSL source connected from {address[0]}")
+        unwrapper = TcpUnwrapper() if self.version == '5.0' else None
+        pending = b''
+        with conn:
+            while self.running:
+                try:
+                    data = conn.recv(65535)
+                except OSError:
+                    break
+                if not data:
+                    break
+                if unwrapper is not None:
+                    for packet in unwrapper.feed(data):
+                        self._received(packet)
+                    continue
+                # v3.1 messages are fixed size, keep any partial one for the next read
+                data = pending + data
+                whole = len(data) - len(data) % V31_MESSAGE_SIZE
+                pending = data[whole:]
+                if whole:
+                    self._received(data[:whole])
+        logger.info(f"TSL source {address[0]} disconnected")
+    
+    def _received(self, data):
+        try:
+            self.apply(self.decode(data))
+        except (ValueError, struct.error) as e:
+            self.errors += 1
+            logger.warning(f"Bad TSL message: {e}")
+    
+    def stats(self):
+        """Receive counters in a JSON friendly form"""
+        return {
+            'mode': f"tsl {self.version} {self.transport}",
+            'packets': self.packets,
+            'messages': self.messages,
+            'updates': self.updates,
+            'errors': self.errors,
+            'umds': len(self.umds),
+            'seconds_since_packet': round(time.monotonic() - self.last_packet, 1) if self.last_packet else None
+        }
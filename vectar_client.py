@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+VectarClient - persistent HTTP client for the Vectar dictionary API
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+logger = logging.getLogger('vectar_client')
+
+# Bytes fed to the streaming parser at a time
+PARSE_CHUNK_SIZE = 16384
+
+class _ElementCollector:
+    """
+    Parser target that keeps only the attributes of one element type.
+    
+    No tree is built at all, so memory stays flat however large the
+    document is.
+    """
+    
+    def __init__(self, tag):
+        self.tag = tag
+        self.found = []
+        self.done = False
+    
+    def start(self, tag, attrib):
+        if tag == self.tag:
+            self.found.append(attrib)
+    
+    def close(self):
+        return self.found
+
+class _ScopedElementCollector(_ElementCollector):
+    """Collector that is done once the parent of the first match closes"""
+    
+    def __init__(self, tag):
+        super().__init__(tag)
+        self.depth = 0
+        self.parent_depth = None
+    
+    def start(self, tag, attrib):
+        self.depth += 1
+        if tag == self.tag:
+            if self.parent_depth is None:
+                self.parent_depth = self.depth - 1
+            self.found.append(attrib)
+    
+    def end(self, tag):
+        self.depth -= 1
+        if self.parent_depth is not None and self.depth < self.parent_depth:
+            self.done = True
+
+def _iter_elements(xml, tag, stop_after_parent=False):
+    """
+    Stream an XML document and yield the attributes of every `tag` element.
+    
+    Args:
+        xml: Document as bytes or str
+        tag: Element tag to pick out
+        stop_after_parent: Stop as soon as the element containing the first
+            match is closed, instead of reading the rest of the document
+    """
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    
+    collector = _ScopedElementCollector(tag) if stop_after_parent else _ElementCollector(tag)
+    parser = ET.XMLParser(target=collector)
+    for offset in range(0, len(xml), PARSE_CHUNK_SIZE):
+        parser.feed(xml[offset:offset + PARSE_CHUNK_SIZE])
+        yield from collector.found
+        collector.found = []
+        if collector.done:
+            return
+    parser.close()
+    yield from collector.found
+
+def iter_tally_columns(xml):
+    """
+    Stream the tally dictionary.
+    
+    Yields:
+        tuple: (name, on_pgm, on_prev) for every column
+    """
+    for attrib in _iter_elements(xml, 'column'):
+        yield attrib.get('name'), attrib.get('on_pgm') == 'true', attrib.get('on_prev') == 'true'
+
+def iter_physical_inputs(xml):
+    """
+    Stream the switcher dictionary, stopping once the inputs have been read.
+    
+    Yields:
+        tuple: (physical_input_number, iso_label) for every physical input
+    """
+    for attrib in _iter_elements(xml, 'physical_input', stop_after_parent=True):
+        yield attrib.get('physical_input_number'), attrib.get('iso_label')
+
+class VectarClient:
+    """
+    Keeps one pooled HTTP session and Digest-auth handshake open to the
+    Vectar across poll cycles.
+    
+    Keep-alive connections and the digest nonce are reused, so a poll costs
+    a single request instead of a TCP connect plus a 401 challenge. The
+    session is only rebuilt after a request fails.
+    """
+    
+    def __init__(self, user, password, headers=None, timeout=5, pool_size=4):
+        """
+        Initialize the VectarClient
+        
+        Args:
+            user: Digest auth username
+            password: Digest auth password
+            headers: Headers to send with every request
+            timeout: Request timeout in seconds
+            pool_size: Number of keep-alive connections to hold per host
+        """
+        self.auth = HTTPDigestAuth(user, password)
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = None
+        self.lock = threading.Lock()
+        
+        # Round trip counters
+        self.requests = 0
+        self.round_trips = 0
+        self.challenges = 0
+        self.connections = 0
+        self.failures = 0
+        self.sessions = 0
+        
+        # Validators of the last response per URL, and unchanged-response counters
+        self.validators = {}
+        self.unchanged_hits = 0
+        self.unchanged_misses = 0
+    
+    def _new_session(self):
+        """Build a session with a keep-alive connection pool"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.headers)
+        session.auth = self.auth
+        self.sessions += 1
+        return session
+    
+    def reset(self):
+        """Drop the session so the next request starts afresh"""
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+    
+    def _pool_connections(self, url):
+        """Number of connections the pool has opened to the host of url"""
+        try:
+            pool = self.session.get_adapter(url).poolmanager.connection_from_url(url)
+            return pool.num_connections
+        except Exception:
+            return 0
+    
+    def get(self, url, headers=None):
+        """
+        GET a URL through the persistent session.
+        
+        Args:
+            url: URL to fetch
+            headers: Extra headers for this request
+        
+        Returns:
+            requests.Response: The response
+        
+        Raises:
+            requests.RequestException: If the request failed, after dropping the session
+        """
+        with self.lock:
+            if self.session is None:
+                self.session = self._new_session()
+            session = self.session
+        
+        opened_before = self._pool_connections(url)
+        try:
+            response = session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            self.failures += 1
+            self.reset()
+            raise
+        
+        # Every response in the history is an extra round trip, normally a 401 challenge
+        self.requests += 1
+        self.round_trips += 1 + len(response.history)
+        self.challenges += sum(1 for r in response.history if r.status_code == 401)
+        self.connections += max(0, self._pool_connections(url) - opened_before)
+        
+        if response.status_code >= 500:
+            self.failures += 1
+            self.reset()
+        return response
+    
+    def get_if_changed(self, url):
+        """
+        GET a URL, short-circuiting when the document has not changed.
+        
+        Sends the last ETag / Last-Modified as a conditional request, and
+        compares a hash of the body when the server does not support them.
+        
+        Args:
+            url: URL to fetch
+            
+        Returns:
+            requests.Response: The response, or None if it is unchanged since the last call
+            
+        Raises:
+            requests.RequestException: If the request failed
+            ConnectionError: If the server returned an error status
+        """
+        etag, last_modified, content_hash = self.validators.get(url, (None, None, None))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        response = self.get(url, headers=headers)
+        if response.status_code == 304:
+            self.unchanged_hits += 1
+            return None
+        if response.status_code != 200:
+            raise ConnectionError(f"HTTP {response.status_code}")
+        
+        new_hash = hashlib.sha1(response.content).digest()
+        self.validators[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), new_hash)
+        if new_hash == content_hash:
+            self.unchanged_hits += 1
+            return None
+        
+        self.unchanged_misses += 1
+        return response
+    
+    def invalidate(self, url):
+        """Forget the last response for url so the next get_if_changed returns it"""
+        self.validators.pop(url, None)
+    
+    def stats(self):
+        """Round trip counters in a JSON friendly form"""
+        return {
+            'requests': self.requests,
+            'round_trips': self.round_trips,
+            'challenges': self.challenges,
+            'connections': self.connections,
+            'failures': self.failures,
+            'sessions': self.sessions,
+            'unchanged_hits': self.unchanged_hits,
+            'unchanged_misses': self.unchanged_misses
+        }
+
+class LabelCache:
+    """
+    Cache of the switcher's source labels.
+    
+    Labels rarely change during a show, so the large switcher dictionary is
+    refreshed in the background every `ttl` seconds instead of on every
+    poll. Refreshes go through VectarClient.get_if_changed, so an idle
+    refresh costs no parsing. Until the labels have loaded, sources show
+    under their own names.
+    """
+    
+    def __init__(self, client, url, parse, ttl=30, retry_interval=5):
+        """
+        Initialize the LabelCache
+        
+        Args:
+            client: VectarClient to fetch through
+            url: Switcher dictionary URL
+            parse: Callable turning the response body into a labels dict
+            ttl: Seconds between background refreshes
+            retry_interval: Seconds between attempts while the labels have never loaded
+        """
+        self.client = client
+        self.url = url
+        self.parse = parse
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.labels = {}
+        self.loaded = False
+        self.background = False  # Set while something refreshes the labels off the poll path
+        self.last_attempt = None
+        self.refresh_event = threading.Event()
+        self.thread = None
+        
+        # Refresh counters
+        self.refreshes = 0
+        self.updates = 0
+        self.errors = 0
+    
+    def get(self):
+        """
+        Current labels.
+        
+        With a background refresher running this never fetches. Without one,
+        labels that have not loaded yet are fetched here, at most every
+        `retry_interval` seconds, so an unreachable switcher doesn't hold up
+        every poll.
+        
+        Returns:
+            dict: Source name to label (empty until the first fetch succeeds)
+        """
+        if not self.loaded and not self.background:
+            if self.last_attempt is None or time.monotonic() - self.last_attempt >= self.retry_interval:
+                self.refresh()
+        return self.labels
+    
+    def delay(self):
+        """Seconds until the next background refresh: ttl, or retry_interval until the labels load"""
+        return self.ttl if self.loaded else min(self.ttl, self.retry_interval)
+    
+    def invalidate(self):
+        """Ask the background thread to refresh now"""
+        self.refresh_event.set()
+    
+    def refresh(self):
+        """
+        Fetch the switcher dictionary if it changed and rebuild the labels.
+        
+        Returns:
+            bool: True if the labels changed
+        """
+        self.refreshes += 1
+        self.last_attempt = time.monotonic()
+        try:
+            response = self.client.get_if_changed(self.url)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error getting labels: {e}")
+            return False
+        
+        if response is None:
+            return False
+        
+        try:
+            labels = self.parse(response.content)
+        except Exception as e:
+            self.errors += 1
+            self.client.invalidate(self.url)
+            logger.error(f"Error parsing labels: {e}")
+            return False
+        
+        self.labels = labels
+        self.loaded = True
+        self.updates += 1
+        logger.info(f"Source labels updated: {len(labels)} inputs")
+        return True
+    
+    def start(self):
+        """Keep the labels fresh from a background thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.background = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        while True:
+            self.refresh()
+            self.refresh_event.wait(self.delay())
+            self.refresh_event.clear()
+    
+    def stats(self):
+        """Refresh counters in a JSON friendly form"""
+        return {
+            'ttl': self.ttl,
+            'labels': len(self.labels),
+            'refreshes': self.refreshes,
+            'updates': self.updates,
+            'errors': self.errors
+        }